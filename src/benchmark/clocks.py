@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Benchmark das operações de relógio vetorial da entrega causal (server/ordering.py)
+
+Mede merge, covers e compare de VectorClock (arrays percorridos com map()) contra a
+mesma operação em dicionários {origem: seq}, e o custo de CausalOrdering.offer por
+lote com N réplicas, com lotes entregues direto e com lotes que chegam fora de ordem.
+A ordem causal é verificada uma vez por lote de replicação, não por operação.
+
+Uso: python clocks.py [réplicas...] (padrão: 4 16 32 64)
+"""
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from ordering import CausalOrdering, VectorClock  # noqa: E402
+from sync import ReplicaLog  # noqa: E402
+
+
+def dict_merge(a, b):
+    merged = dict(a)
+    for name, value in b.items():
+        if value > merged.get(name, 0):
+            merged[name] = value
+    return merged
+
+
+def dict_covers(a, b):
+    return all(a.get(name, 0) >= value for name, value in b.items())
+
+
+def per_call(function, number):
+    """Melhor de 5 medições, em microssegundos por chamada"""
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1_000_000
+
+
+def offer_cost(replicas, shuffled, batches=2000):
+    """µs por lote em CausalOrdering.offer (com a aplicação simulada avançando o vetor)"""
+    names = [f"server_{i}" for i in range(replicas)]
+    rng = random.Random(replicas)
+    # Cada lote de uma origem depende do que ela já tinha aplicado das demais
+    known = {name: {} for name in names}
+    seqs = dict.fromkeys(names, 0)
+    stream = []
+    for _ in range(batches):
+        origin = rng.choice(names)
+        seqs[origin] += 1
+        stream.append((origin, seqs[origin], dict(known[origin])))
+        for name in names:
+            if name != origin:
+                known[name][origin] = seqs[origin]
+    if shuffled:
+        # Troca lotes vizinhos: parte chega antes das dependências
+        for i in range(0, len(stream) - 1, 2):
+            if rng.random() < 0.3:
+                stream[i], stream[i + 1] = stream[i + 1], stream[i]
+
+    replica_log = ReplicaLog()
+    ordering = CausalOrdering(replica_log)
+    start = timeit.default_timer()
+    for origin, seq, deps in stream:
+        for ready_origin, operations in ordering.offer(origin, deps, [seq]):
+            for ready_seq in operations:
+                replica_log.advance(ready_origin, ready_seq)
+    elapsed = timeit.default_timer() - start
+    return elapsed / batches * 1_000_000, ordering.metrics()
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [4, 16, 32, 64]
+    print(f"{'réplicas':>8} {'merge arr':>10} {'merge dict':>10} {'covers arr':>10} "
+          f"{'covers dict':>11} {'compare':>8} {'offer':>8} {'offer desord.':>13} {'adiados':>8}")
+    for size in sizes:
+        rng = random.Random(size)
+        a = {f"server_{i}": rng.randrange(1, 10**9) for i in range(size)}
+        # b: à frente de a em 10% das origens (merge/compare); c: coberto por a (covers percorre tudo)
+        b = {name: value + (rng.randrange(1, 1000) if rng.random() < 0.1 else -rng.randrange(0, 1000))
+             for name, value in a.items()}
+        c = {name: value - rng.randrange(0, 1000) for name, value in a.items()}
+        va, vb, vc = VectorClock.from_dict(a), VectorClock.from_dict(b), VectorClock.from_dict(c)
+        number = 20000
+        row = [
+            per_call(lambda: va.copy().merge(vb), number),
+            per_call(lambda: dict_merge(a, b), number),
+            per_call(lambda: va.covers(vc), number),
+            per_call(lambda: dict_covers(a, c), number),
+            per_call(lambda: va.compare(vb), number),
+        ]
+        ordered, _ = offer_cost(size, False)
+        shuffled, metrics = offer_cost(size, True)
+        print(f"{size:>8} " + " ".join(f"{value:>10.2f}" for value in row[:3])
+              + f" {row[3]:>11.2f} {row[4]:>8.2f} {ordered:>8.2f} {shuffled:>13.2f} "
+              f"{metrics['delayed_batches']:>8}")
+    print("tempos em µs por chamada (offer: por lote)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Benchmark da leitura do histórico: carga completa em memória x varredura via mmap
+
+Carregar todas as publicações em objetos Python (como fazia o formato JSON antigo, e como
+faz a reaplicação completa do log) custa memória proporcional ao histórico. A varredura
+de server/scan.py filtra pelo cabeçalho dos frames e só decodifica o que devolve. O pico de
+memória é medido com tracemalloc (as páginas do mmap são do cache do sistema e não contam).
+
+Uso: python history_scan.py [publicações] (padrão: 200000)
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from startup import CHANNELS, populate  # noqa: E402
+from scan import scan  # noqa: E402
+from storage import SegmentLog  # noqa: E402
+
+
+def measure(function):
+    """Tempo sem tracemalloc (que deixa tudo mais lento) e pico de memória em uma segunda execução"""
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    root = tempfile.mkdtemp(prefix="scan_")
+    try:
+        populate(os.path.join(root, "bench"), size)
+        directory = os.path.join(root, "bench", "publications")
+
+        def full_load():
+            log = SegmentLog(directory)
+            records = [record for _, record in log.replay()]
+            log.close()
+            return sum(1 for record in records if record["channel"] == "canal_0")
+
+        cases = [
+            ("carga completa + filtro", full_load),
+            ("mmap, um canal", lambda: sum(1 for _ in scan(directory, key="canal_0"))),
+            ("mmap, faixa de clock", lambda: sum(1 for _ in scan(directory, clock_from=size // 2,
+                                                                  clock_to=size // 2 + 999))),
+            ("mmap, canal + clock", lambda: sum(1 for _ in scan(directory, key="canal_0",
+                                                                 clock_from=size // 2))),
+            ("mmap, tudo", lambda: sum(1 for _ in scan(directory))),
+        ]
+        print(f"{size} publicações em {CHANNELS} canais")
+        print(f"{'leitura':<26} {'registros':>10} {'tempo (s)':>10} {'pico (MB)':>10}")
+        for name, function in cases:
+            count, elapsed, peak = measure(function)
+            print(f"{name:<26} {count:>10} {elapsed:>10.3f} {peak / 1024 / 1024:>10.2f}")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+"""Benchmark de carga do sistema completo (broker, proxy, referência e N servidores)
+
+Sobe os componentes como subprocessos em loopback, cria usuários e canais e gera
+requisições em malha aberta: cada requisição tem um instante agendado pela taxa alvo
+e é enviada nesse instante, mesmo que as anteriores ainda não tenham sido
+respondidas. A latência é medida a partir do instante agendado, então filas no
+sistema aparecem nos percentis em vez de apenas reduzirem a taxa gerada.
+
+Mede vazão, latência p50/p99/p999 por serviço, atraso de replicação (entre a
+operação entrar no lote do servidor de origem e o lote chegar pelo plano de
+controle) e atraso de entrega (entre o envio de um publish/message e a chegada no
+assinante). O resultado é salvo em JSON para comparar commits.
+
+Uso:
+  python main.py [--servers 3] [--rate 500] [--duration 10] [--mix publish=60,message=20,users=10,login=5,channel=5]
+                 [--output resultado.json] [--wire 1|2] [--external]
+  python main.py compare antes.json depois.json
+
+As variáveis de ambiente são repassadas aos componentes (ex.: SERVER_RUNTIME=asyncio,
+REPLICATION_CODEC=zlib, PROXY_MODE=sharded com PROXY_SHARDS). As portas fixas dos
+componentes (5555-5564) precisam estar livres; com --external o benchmark usa um
+sistema já em execução em localhost (ex.: docker-compose) em vez de iniciar um.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import zlib
+from datetime import datetime
+from multiprocessing import Process, Queue
+
+import msgpack
+import zmq
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(SRC_DIR, "server"))
+
+from replication import decode_batch  # noqa: E402
+import wire  # noqa: E402
+
+HOST = "127.0.0.1"
+BROKER_FRONTEND = f"tcp://{HOST}:5555"
+REFERENCE_ADDR = f"tcp://{HOST}:5559"
+PROXY_SUB = f"tcp://{HOST}:5558"
+PROXY_CONTROL_SUB = f"tcp://{HOST}:5562"
+PEER_BASE_PORT = 5600
+
+DEFAULT_MIX = "publish=60,message=20,users=10,login=5,channel=5"
+BENCH_USERS = 100
+BENCH_CHANNELS = 10
+STARTUP_TIMEOUT = 30.0
+DRAIN_TIMEOUT = 5.0  # espera pelas respostas e entregas pendentes ao fim da carga
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(samples):
+    """Percentis em milissegundos de uma lista de latências em segundos"""
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+        "p999_ms": round(percentile(samples, 0.999) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3) if samples else 0.0,
+    }
+
+
+def parse_mix(text):
+    """"publish=60,users=10" -> [("publish", 60), ("users", 10)]"""
+    mix = []
+    for part in text.split(","):
+        service, _, weight = part.partition("=")
+        if service not in ("login", "channel", "publish", "message", "users"):
+            raise ValueError(f"Serviço não suportado no mix: {service}")
+        mix.append((service, int(weight or 1)))
+    return mix
+
+
+class Cluster:
+    """Componentes do sistema como subprocessos locais, com logs em um diretório temporário"""
+
+    def __init__(self, servers):
+        self.servers = servers
+        self.root = tempfile.mkdtemp(prefix="bench_")
+        self.processes = []
+
+    def environment(self, **extra):
+        env = dict(os.environ)
+        env.update({
+            "PYTHONUNBUFFERED": "1",
+            "BROKER_BACKEND": f"tcp://{HOST}:5556",
+            "REFERENCE_ADDR": REFERENCE_ADDR,
+            "PROXY_PUB": f"tcp://{HOST}:5557",
+            "PROXY_CONTROL_PUB": f"tcp://{HOST}:5561",
+            "PROXY_CONTROL_SUB": PROXY_CONTROL_SUB,
+            "PROXY_SHARD_HOST": f"tcp://{HOST}",
+            "DATA_DIR": os.path.join(self.root, "data"),
+        })
+        env.update(extra)
+        return env
+
+    def spawn(self, name, component, args=(), **extra):
+        log = open(os.path.join(self.root, f"{name}.log"), "w")
+        process = subprocess.Popen(
+            [sys.executable, "main.py", *args],
+            cwd=os.path.join(SRC_DIR, component),
+            env=self.environment(**extra),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        self.processes.append((name, process, log))
+
+    def start(self):
+        self.spawn("broker", "broker")
+        self.spawn("proxy", "proxy")
+        self.spawn("reference", "reference")
+        time.sleep(1.0)
+        for i in range(1, self.servers + 1):
+            port = PEER_BASE_PORT + i
+            self.spawn(f"server{i}", "server", [f"bench_{i}"],
+                       PEER_PORT=str(port), PEER_ADDRESS=f"tcp://{HOST}:{port}")
+
+    def check(self):
+        for name, process, _ in self.processes:
+            if process.poll() is not None:
+                raise RuntimeError(f"{name} terminou (código {process.returncode}), ver {self.root}/{name}.log")
+
+    def stop(self, keep_logs=False):
+        for _, process, _ in self.processes:
+            process.terminate()
+        for _, process, log in self.processes:
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+        if keep_logs:
+            print(f"Logs em {self.root}")
+        else:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+def wait_ready(context, servers, check=None):
+    """Espera os servidores se registrarem na referência e atenderem pelo broker"""
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    registered = 0
+    while time.monotonic() < deadline:
+        if check:
+            check()
+        socket = context.socket(zmq.REQ)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.setsockopt(zmq.RCVTIMEO, 1000)
+        socket.connect(REFERENCE_ADDR)
+        try:
+            socket.send(msgpack.packb({"service": "list", "data": {"clock": 0}}))
+            registered = len(msgpack.unpackb(socket.recv(), raw=False)["data"]["list"])
+        except zmq.Again:
+            registered = 0
+        finally:
+            socket.close()
+        if registered >= servers:
+            break
+        time.sleep(0.5)
+    else:
+        raise RuntimeError(f"Apenas {registered}/{servers} servidores registrados após {STARTUP_TIMEOUT}s")
+
+    # Cada servidor só recebe requisições depois de anunciar capacidade ao broker
+    client = Requester(context)
+    while time.monotonic() < deadline:
+        client.send("users", {})
+        if client.socket.poll(1000):
+            client.receive()
+            return
+    raise RuntimeError("O broker não respondeu dentro do tempo limite")
+
+
+class Requester:
+    """Socket DEALER com várias requisições em andamento, correlacionadas pelo envelope"""
+
+    def __init__(self, context, version=1):
+        self.socket = context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(BROKER_FRONTEND)
+        self.version = version
+        self.next_id = 0
+        self.clock = 0
+
+    def send(self, service, data):
+        self.next_id += 1
+        self.clock += 1
+        if self.version == wire.WIRE_VERSION:
+            body = wire.encode_request(service, self.clock, data)
+        else:
+            body = msgpack.packb({
+                "service": service,
+                "data": {**data, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "clock": self.clock},
+            })
+        self.socket.send_multipart([self.next_id.to_bytes(8, "big"), b"", body])
+        return self.next_id
+
+    def decode(self, payload):
+        if self.version == wire.WIRE_VERSION:
+            return wire.decode_response(payload)
+        return msgpack.unpackb(payload, raw=False)
+
+    def receive(self):
+        frames = self.socket.recv_multipart()
+        response = self.decode(frames[-1])
+        self.clock = max(self.clock, response.get("data", {}).get("clock", 0)) + 1
+        return int.from_bytes(frames[0], "big"), response
+
+    def run_all(self, requests):
+        """Executa as requisições em pipeline e espera todas as respostas"""
+        pending = {self.send(service, data) for service, data in requests}
+        while pending:
+            if not self.socket.poll(DRAIN_TIMEOUT * 1000):
+                raise RuntimeError(f"{len(pending)} requisições de preparação sem resposta")
+            request_id, _ = self.receive()
+            pending.discard(request_id)
+
+
+def collect(topics, run_id, duration, results, version=1):
+    """Processo assinante: horários de chegada das entregas e atraso da replicação"""
+    context = zmq.Context()
+    if version == wire.WIRE_VERSION:
+        topics = [wire.WIRE_TOPIC_PREFIX.decode() + topic for topic in topics]
+    shards = int(os.environ.get("PROXY_SHARDS", 0)) if os.environ.get("PROXY_MODE") == "sharded" else 0
+    base_port = int(os.environ.get("PROXY_SHARD_BASE_PORT", 5570))
+
+    subscriber = context.socket(zmq.SUB)
+    if shards:
+        for shard in {zlib.crc32(topic.encode()) % shards for topic in topics}:
+            subscriber.connect(f"tcp://{HOST}:{base_port + 2 * shard + 1}")
+    else:
+        subscriber.connect(PROXY_SUB)
+    for topic in topics:
+        subscriber.subscribe(topic)
+
+    control = context.socket(zmq.SUB)
+    control.connect(PROXY_CONTROL_SUB)
+    control.subscribe("replication")
+
+    poller = zmq.Poller()
+    poller.register(subscriber, zmq.POLLIN)
+    poller.register(control, zmq.POLLIN)
+
+    prefix = f"{run_id}:"
+    delivered = {}  # {chave: instante da primeira entrega}
+    replication_lags = []
+    results.put("ready")
+
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        for socket, _ in poller.poll(100):
+            frames = socket.recv_multipart()
+            now = time.time()
+            if socket is subscriber:
+                publication = msgpack.unpackb(frames[1], raw=False)
+                # v1: {"user"|"src", "message", ...}; v2: [autor, mensagem, timestamp_us, clock]
+                message = publication[1] if isinstance(publication, list) else publication.get("message", "")
+                if isinstance(message, str) and message.startswith(prefix):
+                    delivered.setdefault(message, now)
+            elif len(frames) == 3:
+                header = msgpack.unpackb(frames[1], raw=False)
+                for entry in decode_batch(header, frames[2]):
+                    if "ts" in entry:
+                        replication_lags.append(now - entry["ts"])
+
+    results.put((delivered, replication_lags))
+
+
+def drive(context, mix, rate, duration, run_id, version=1):
+    """Gera carga em malha aberta e retorna latências por serviço e horários de envio"""
+    client = Requester(context, version)
+    # Sequência de serviços segundo os pesos, embaralhada de forma reprodutível
+    schedule = [service for service, weight in mix for _ in range(weight)]
+    random.Random(0).shuffle(schedule)
+    total_weight = len(schedule)
+
+    pending = {}  # id -> (serviço, instante agendado)
+    latencies = {service: [] for service, _ in mix}
+    errors = {service: 0 for service, _ in mix}
+    sent_at = {}  # chave da publicação/mensagem -> instante real do envio (relógio de parede)
+    count = 0
+
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    end = start + duration
+    next_at = start
+
+    while True:
+        now = time.perf_counter()
+        while next_at <= now and next_at < end:
+            service = schedule[count % total_weight]
+            user = f"bench_u{count % BENCH_USERS}"
+            channel = f"bench_c{count % BENCH_CHANNELS}"
+            key = f"{run_id}:{count}"
+            if service == "publish":
+                data = {"user": user, "channel": channel, "message": key}
+                sent_at[key] = time.time()
+            elif service == "message":
+                data = {"src": user, "dst": f"bench_u{(count + 1) % BENCH_USERS}", "message": key}
+                sent_at[key] = time.time()
+            elif service == "login":
+                data = {"user": f"bench_login_{run_id}_{count}"}
+            elif service == "channel":
+                data = {"channel": f"bench_ch_{run_id}_{count}"}
+            else:
+                data = {}
+            pending[client.send(service, data)] = (service, next_at)
+            count += 1
+            next_at += interval
+
+        if next_at >= end and (not pending or now > end + DRAIN_TIMEOUT):
+            break
+
+        wait = max(0.0, min(next_at, end + DRAIN_TIMEOUT) - time.perf_counter())
+        if client.socket.poll(wait * 1000):
+            while True:
+                try:
+                    frames = client.socket.recv_multipart(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                received = time.perf_counter()
+                request_id = int.from_bytes(frames[0], "big")
+                if request_id not in pending:
+                    continue
+                service, scheduled = pending.pop(request_id)
+                response = client.decode(frames[-1])
+                if response.get("data", {}).get("status") == "erro":
+                    errors[service] += 1
+                latencies[service].append(received - scheduled)
+
+    elapsed = min(time.perf_counter(), end) - start
+    timeouts = {}
+    for service, _ in pending.values():
+        timeouts[service] = timeouts.get(service, 0) + 1
+    return latencies, errors, timeouts, sent_at, count, elapsed
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    mix = parse_mix(args.mix)
+    run_id = uuid.uuid4().hex[:8]
+    cluster = None if args.external else Cluster(args.servers)
+    context = zmq.Context()
+    failed = True
+    if args.wire == wire.WIRE_VERSION:
+        # O coletor assina os tópicos v2; os servidores precisam publicá-los
+        os.environ.setdefault("WIRE_PUBLISH", "v2")
+
+    try:
+        if cluster:
+            cluster.start()
+        wait_ready(context, args.servers, cluster.check if cluster else None)
+
+        setup = Requester(context, args.wire)
+        setup.run_all([("login", {"user": f"bench_u{i}"}) for i in range(BENCH_USERS)])
+        setup.run_all([("channel", {"channel": f"bench_c{i}"}) for i in range(BENCH_CHANNELS)])
+        # Os outros servidores precisam receber usuários e canais antes da carga
+        time.sleep(1.0)
+
+        topics = [f"bench_c{i}" for i in range(BENCH_CHANNELS)] + [f"bench_u{i}" for i in range(BENCH_USERS)]
+        results = Queue()
+        collector = Process(target=collect, args=(topics, run_id, args.duration + DRAIN_TIMEOUT + 1.0, results, args.wire))
+        collector.start()
+        results.get()
+        time.sleep(0.5)  # assinaturas chegam ao proxy de forma assíncrona
+
+        print(f"Carga: {args.rate} req/s por {args.duration}s, mix {args.mix}, {args.servers} servidores")
+        latencies, errors, timeouts, sent_at, sent, elapsed = drive(context, mix, args.rate, args.duration, run_id, args.wire)
+
+        delivered, replication_lags = results.get()
+        collector.join()
+        if cluster:
+            cluster.check()
+        failed = False
+    finally:
+        if cluster:
+            cluster.stop(keep_logs=args.keep_logs or failed)
+
+    completed = sum(len(samples) for samples in latencies.values())
+    delivery = [delivered[key] - sent for key, sent in sent_at.items() if key in delivered]
+    result = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "config": {
+            "servers": args.servers,
+            "rate": args.rate,
+            "duration": args.duration,
+            "mix": args.mix,
+            "external": args.external,
+            "wire": args.wire,
+            "env": {name: value for name, value in os.environ.items()
+                    if name.startswith(("SERVER_", "REPLICATION_", "PROXY_", "BROKER_", "STORAGE_", "SHARD", "WIRE_"))},
+        },
+        "sent": sent,
+        "completed": completed,
+        "throughput": round(completed / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency": summarize([sample for samples in latencies.values() for sample in samples]),
+        "services": {
+            service: {**summarize(samples), "errors": errors[service], "timeouts": timeouts.get(service, 0)}
+            for service, samples in latencies.items()
+        },
+        "replication_lag": summarize(replication_lags),
+        "delivery": {**summarize(delivery), "expected": len(sent_at), "missing": len(sent_at) - len(delivery)},
+    }
+    return result
+
+
+def print_result(result):
+    print()
+    print(f"vazão: {result['throughput']} req/s ({result['completed']}/{result['sent']} respondidas)")
+    print(f"{'':<18} {'n':>8} {'p50 (ms)':>10} {'p99 (ms)':>10} {'p999 (ms)':>10} {'erros':>6} {'timeouts':>8}")
+    rows = [("total", result["latency"])] + list(result["services"].items())
+    rows += [("replicação", result["replication_lag"]), ("entrega", result["delivery"])]
+    for name, summary in rows:
+        print(f"{name:<18} {summary['count']:>8} {summary['p50_ms']:>10.2f} {summary['p99_ms']:>10.2f} "
+              f"{summary['p999_ms']:>10.2f} {summary.get('errors', ''):>6} {summary.get('timeouts', ''):>8}")
+    if result["delivery"]["missing"]:
+        print(f"entregas perdidas: {result['delivery']['missing']}/{result['delivery']['expected']}")
+
+
+def compare(before_path, after_path):
+    """Compara vazão e percentis de dois resultados"""
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    def change(old, new):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "-"
+
+    print(f"{'':<24} {before.get('commit') or before_path:>12} {after.get('commit') or after_path:>12} {'variação':>10}")
+    print(f"{'vazão (req/s)':<24} {before['throughput']:>12} {after['throughput']:>12} "
+          f"{change(before['throughput'], after['throughput']):>10}")
+    sections = [("total", before["latency"], after["latency"])]
+    sections += [(service, summary, after["services"][service])
+                 for service, summary in before["services"].items() if service in after["services"]]
+    sections += [("replicação", before["replication_lag"], after["replication_lag"]),
+                 ("entrega", before["delivery"], after["delivery"])]
+    for name, old, new in sections:
+        for field in ("p50_ms", "p99_ms", "p999_ms"):
+            print(f"{name + ' ' + field:<24} {old[field]:>12} {new[field]:>12} {change(old[field], new[field]):>10}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        if len(sys.argv) != 4:
+            sys.exit("Uso: python main.py compare antes.json depois.json")
+        compare(sys.argv[2], sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description="Benchmark de carga do sistema completo")
+    parser.add_argument("--servers", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=500, help="requisições por segundo (malha aberta)")
+    parser.add_argument("--duration", type=float, default=10, help="segundos de carga")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="pesos dos serviços, ex.: publish=60,users=10")
+    parser.add_argument("--output", help="arquivo JSON do resultado (padrão: bench_<commit>_<hora>.json)")
+    parser.add_argument("--wire", type=int, choices=(1, 2), default=1,
+                        help="versão do protocolo (2: esquema compacto, publicações v2)")
+    parser.add_argument("--external", action="store_true", help="usar um sistema já em execução em localhost")
+    parser.add_argument("--keep-logs", action="store_true", help="manter os logs dos componentes")
+    args = parser.parse_args()
+
+    result = run(args)
+    print_result(result)
+
+    output = args.output or f"bench_{result['commit'] or 'local'}_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Resultado salvo em {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Microbenchmark do caminho de publicação de um servidor (CPU por publicação)
+
+Chama Server.handle_publish diretamente, sem broker nem proxy: o socket de
+publicação é substituído por um que só conta frames e bytes. Mede o tempo de CPU
+do processo (inclui a thread de escrita do log e o envio dos lotes de replicação)
+e o tempo de parede por publicação, para comparar mudanças no encode, no log e na
+replicação entre commits.
+
+Uso:
+  python publish.py [--count 20000] [--size 100] [--rounds 5] [--output resultado.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DATA_DIR = tempfile.mkdtemp(prefix="bench_publish_")
+# O servidor lê DATA_DIR ao ser importado
+os.environ["DATA_DIR"] = DATA_DIR
+os.environ.setdefault("LOG_LEVEL", "warning")
+sys.path.insert(0, os.path.join(SRC_DIR, "server"))
+
+from main import Server  # noqa: E402
+
+
+class CountingSocket:
+    """Substitui o Publisher: descarta as mensagens e conta frames e bytes por tópico"""
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.replication_bytes = 0
+
+    def send_multipart(self, frames, copy=True):
+        size = sum(len(frame) for frame in frames)
+        if frames[0] == b"replication":
+            self.replication_bytes += size
+        else:
+            self.messages += 1
+            self.bytes += size
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SRC_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_round(server, count, text):
+    socket = CountingSocket()
+    timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for i in range(count):
+        server.handle_publish({"user": "bench_u", "channel": "bench_c", "message": text,
+                               "timestamp": timestamp, "clock": i}, socket)
+    server.replication.flush(socket, server.logical_clock)
+    server.storage.writer.flush()
+    return {
+        "cpu_us": (time.process_time() - cpu_start) / count * 1_000_000,
+        "wall_us": (time.perf_counter() - wall_start) / count * 1_000_000,
+        "fanout_bytes": socket.bytes / max(1, socket.messages),
+        "replication_bytes": socket.replication_bytes / count,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU por publicação em Server.handle_publish")
+    parser.add_argument("--count", type=int, default=20000, help="publicações por rodada")
+    parser.add_argument("--size", type=int, default=100, help="tamanho do texto da mensagem")
+    parser.add_argument("--rounds", type=int, default=5, help="rodadas (o resultado é a mediana)")
+    parser.add_argument("--output", help="arquivo JSON do resultado")
+    args = parser.parse_args()
+
+    try:
+        server = Server("bench_publish")
+        server.load_state()
+        server.channels.add("bench_c")
+        text = "x" * args.size
+
+        run_round(server, min(args.count, 1000), text)  # aquecimento
+        rounds = [run_round(server, args.count, text) for _ in range(args.rounds)]
+    finally:
+        shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+    median = {key: sorted(r[key] for r in rounds)[len(rounds) // 2] for key in rounds[0]}
+    result = {"commit": git_commit(), "count": args.count, "size": args.size, "rounds": args.rounds,
+              **{key: round(value, 2) for key, value in median.items()}}
+    print(f"CPU por publicação: {result['cpu_us']:.2f}us (parede {result['wall_us']:.2f}us), "
+          f"fan-out {result['fanout_bytes']:.0f} bytes/msg, replicação {result['replication_bytes']:.1f} bytes/op")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Resultado salvo em {args.output}")
+
+
+if __name__ == "__main__":
+    main()
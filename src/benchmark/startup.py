@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Benchmark de inicialização a frio do servidor em função do tamanho do histórico
+
+Compara a reconstrução do estado lendo o log completo com a carga de um snapshot
+seguida da reaplicação apenas do final dos logs.
+
+Uso: python startup.py [tamanhos...] (ex.: python startup.py 10000 100000 1000000)
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+import main as server_main  # noqa: E402
+from storage import Storage, GroupCommitWriter  # noqa: E402
+
+CHANNELS = 100
+USERS = 1000
+TAIL = 1000  # registros escritos depois do snapshot
+
+
+def populate(data_dir, count, offset=0):
+    """Escreve count publicações e count/10 mensagens diretamente nos logs"""
+    storage = Storage(data_dir, GroupCommitWriter(durability="async", metrics_interval=0))
+    if offset == 0:
+        for i in range(USERS):
+            storage.users.append({"user": f"user_{i}", "timestamp": f"2025-01-01T00:00:{i % 60:02d}"})
+        for i in range(CHANNELS):
+            storage.channels.append({"channel": f"canal_{i}"})
+    for i in range(offset, offset + count):
+        storage.publications.append({
+            "channel": f"canal_{i % CHANNELS}",
+            "user": f"user_{i % USERS}",
+            "message": f"mensagem {i}",
+            "timestamp": f"2025-01-01T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}",
+            "clock": i,
+        })
+        if i % 10 == 0:
+            storage.messages.append({
+                "src": f"user_{i % USERS}",
+                "dst": f"user_{(i + 1) % USERS}",
+                "message": f"privada {i}",
+                "timestamp": f"2025-01-01T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}",
+                "clock": i,
+            })
+    storage.close()
+
+
+def cold_start(data_dir):
+    """Mede o tempo de Server.load_state em um processo já aquecido"""
+    server_main.DATA_DIR = os.path.dirname(data_dir)
+    server = server_main.Server(os.path.basename(data_dir))
+    start = time.perf_counter()
+    server.load_state()
+    elapsed = time.perf_counter() - start
+    return server, elapsed
+
+
+def run(size):
+    root = tempfile.mkdtemp(prefix=f"startup_{size}_")
+    data_dir = os.path.join(root, "bench")
+    try:
+        populate(data_dir, size)
+
+        server, full = cold_start(data_dir)
+        server.snapshots.write_now(server.capture_snapshot())
+        server.storage.close()
+
+        populate(data_dir, TAIL, offset=size)
+        server, snap = cold_start(data_dir)
+        pages = server.channel_index.count("canal_0")
+        server.storage.close()
+        return full, snap, pages
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    results = []
+    for size in sizes:
+        full, snap, _ = run(size)
+        results.append((size, full, snap))
+    print()
+    print(f"{'publicações':>12} {'log completo (s)':>18} {'snapshot + final (s)':>22}")
+    for size, full, snap in results:
+        print(f"{size:>12} {full:>18.3f} {snap:>22.3f}")
@@ -2,13 +2,53 @@ package main
 
 import (
 	"fmt"
+	"hash/crc32"
 	"math/rand"
+	"os"
+	"strconv"
 	"time"
 
 	"github.com/vmihailenco/msgpack/v5"
 	zmq "github.com/pebbe/zmq4"
 )
 
+// 0: proxy único (5558); N: proxy em shards, shard i em proxyShardBasePort + 2i + 1.
+// O shard de um tópico é crc32(tópico) % N (deve coincidir com proxy/main.py)
+var proxyShards = envInt("PROXY_SHARDS", 0)
+var proxyShardBasePort = envInt("PROXY_SHARD_BASE_PORT", 5570)
+
+// 1: formato original ({service, data}); 2: esquema compacto (server/wire.py)
+var wireVersion = envInt("WIRE_VERSION", 1)
+
+const wireTopicPrefix = "\x02"
+
+// Código e campos posicionais de requisição e resposta (devem coincidir com server/wire.py)
+type wireService struct {
+	code     int
+	request  []string
+	response []string
+}
+
+var wireServices = map[string]wireService{
+	"login":    {1, []string{"user"}, nil},
+	"users":    {2, []string{"if_version", "since", "offset", "limit"}, []string{"users", "version", "not_modified", "delta", "next"}},
+	"channel":  {3, []string{"channel"}, nil},
+	"channels": {4, []string{"if_version", "since", "offset", "limit"}, []string{"channels", "version", "not_modified", "delta", "next"}},
+	"publish":  {5, []string{"user", "channel", "message"}, nil},
+	"message":  {6, []string{"src", "dst", "message"}, nil},
+	"history":  {7, []string{"channel", "limit", "before", "after"}, []string{"publications", "cursor"}},
+	"inbox":    {8, []string{"user", "limit", "before", "after"}, []string{"messages", "cursor"}},
+	"fetch":    {9, []string{"user", "limit", "after"}, []string{"messages", "cursor", "pending"}},
+	"ack":      {10, []string{"user", "cursor"}, []string{"cursor"}},
+}
+
+func envInt(name string, fallback int) int {
+	if value, err := strconv.Atoi(os.Getenv(name)); err == nil {
+		return value
+	}
+	return fallback
+}
+
 type Message struct {
 	Service string                 `msgpack:"service"`
 	Data    map[string]interface{} `msgpack:"data"`
@@ -19,6 +59,9 @@ type Bot struct {
 	subSocket    *zmq.Socket
 	username     string
 	logicalClock int
+	// Última lista de canais e sua versão: com if_version o servidor só a reenvia se mudou
+	channels        []string
+	channelsVersion string
 }
 
 func (b *Bot) updateClock(receivedClock int) {
@@ -54,26 +97,109 @@ func (b *Bot) Connect() error {
 		return err
 	}
 
-	if err := b.subSocket.Connect("tcp://proxy:5558"); err != nil {
-		return err
+	// Com o proxy em shards, a conexão ao shard do tópico é feita em Subscribe
+	if proxyShards == 0 {
+		if err := b.subSocket.Connect("tcp://proxy:5558"); err != nil {
+			return err
+		}
 	}
 
 	fmt.Println("Bot conectado ao broker e proxy")
 	return nil
 }
 
+func (b *Bot) Subscribe(name string) error {
+	// Publicações v2 usam o tópico com prefixo; o shard é calculado sobre o tópico real
+	topic := name
+	if wireVersion == 2 {
+		topic = wireTopicPrefix + name
+	}
+	if proxyShards > 0 {
+		shard := int(crc32.ChecksumIEEE([]byte(topic)) % uint32(proxyShards))
+		endpoint := fmt.Sprintf("tcp://proxy:%d", proxyShardBasePort+2*shard+1)
+		if err := b.subSocket.Connect(endpoint); err != nil {
+			return err
+		}
+	}
+	return b.subSocket.SetSubscribe(topic)
+}
+
+// encodeCompact monta a requisição v2: [2, código, clock, timestamp_us, campos...]
+func (b *Bot) encodeCompact(service string, data map[string]interface{}) ([]byte, error) {
+	spec := wireServices[service]
+	msg := []interface{}{2, spec.code, b.logicalClock, time.Now().UnixMicro()}
+	for _, field := range spec.request {
+		msg = append(msg, data[field])
+	}
+	return msgpack.Marshal(msg)
+}
+
+// decodeCompact converte a resposta v2 [2, código, status, clock, timestamp_us, campos...]
+// para o formato {"service", "data"} da v1
+func decodeCompact(service string, respBytes []byte) (map[string]interface{}, error) {
+	var fields []interface{}
+	if err := msgpack.Unmarshal(respBytes, &fields); err != nil {
+		return nil, err
+	}
+	if len(fields) < 5 {
+		return nil, fmt.Errorf("resposta v2 inválida: %v", fields)
+	}
+	data := map[string]interface{}{"clock": fields[3], "timestamp": fields[4], "status": "OK"}
+	if toInt(fields[2]) != 0 {
+		data["status"] = "erro"
+		if len(fields) > 5 {
+			data["description"] = fields[5]
+		}
+	} else {
+		for i, name := range wireServices[service].response {
+			if 5+i < len(fields) {
+				data[name] = fields[5+i]
+			}
+		}
+	}
+	return map[string]interface{}{"service": service, "data": data}, nil
+}
+
+// toInt aceita os tipos inteiros que o msgpack decodifica conforme o tamanho do valor
+func toInt(value interface{}) int {
+	switch v := value.(type) {
+	case int8:
+		return int(v)
+	case int16:
+		return int(v)
+	case int32:
+		return int(v)
+	case int64:
+		return int(v)
+	case uint8:
+		return int(v)
+	case uint16:
+		return int(v)
+	case uint32:
+		return int(v)
+	case uint64:
+		return int(v)
+	case int:
+		return v
+	}
+	return 0
+}
+
 func (b *Bot) SendRequest(service string, data map[string]interface{}) (map[string]interface{}, error) {
 	b.incrementClock()
-	
-	data["timestamp"] = time.Now().Format(time.RFC3339)
-	data["clock"] = b.logicalClock
 
-	msg := Message{
-		Service: service,
-		Data:    data,
+	var msgBytes []byte
+	var err error
+	if wireVersion == 2 {
+		msgBytes, err = b.encodeCompact(service, data)
+	} else {
+		data["timestamp"] = time.Now().Format(time.RFC3339)
+		data["clock"] = b.logicalClock
+		msgBytes, err = msgpack.Marshal(Message{
+			Service: service,
+			Data:    data,
+		})
 	}
-
-	msgBytes, err := msgpack.Marshal(msg)
 	if err != nil {
 		return nil, err
 	}
@@ -88,15 +214,17 @@ func (b *Bot) SendRequest(service string, data map[string]interface{}) (map[stri
 	}
 
 	var response map[string]interface{}
-	if err := msgpack.Unmarshal(respBytes, &response); err != nil {
+	if wireVersion == 2 {
+		if response, err = decodeCompact(service, respBytes); err != nil {
+			return nil, err
+		}
+	} else if err := msgpack.Unmarshal(respBytes, &response); err != nil {
 		return nil, err
 	}
 
 	// Atualiza relógio com resposta
 	if data, ok := response["data"].(map[string]interface{}); ok {
-		if clock, ok := data["clock"].(int); ok {
-			b.updateClock(clock)
-		}
+		b.updateClock(toInt(data["clock"]))
 	}
 
 	return response, nil
@@ -115,10 +243,12 @@ func (b *Bot) Login() error {
 	}
 
 	data := response["data"].(map[string]interface{})
-	if data["status"] == "sucesso" {
+	if data["status"] != "erro" {
 		fmt.Printf("Bot logado: %s\n", b.username)
 		// Inscreve no próprio nome
-		b.subSocket.SetSubscribe(b.username)
+		if err := b.Subscribe(b.username); err != nil {
+			return err
+		}
 		return nil
 	}
 
@@ -126,19 +256,28 @@ func (b *Bot) Login() error {
 }
 
 func (b *Bot) GetChannels() ([]string, error) {
-	response, err := b.SendRequest("channels", map[string]interface{}{})
+	request := map[string]interface{}{}
+	if b.channelsVersion != "" {
+		request["if_version"] = b.channelsVersion
+	}
+	response, err := b.SendRequest("channels", request)
 	if err != nil {
 		return nil, err
 	}
 
 	data := response["data"].(map[string]interface{})
-	channelsRaw := data["channels"].([]interface{})
+	if notModified, _ := data["not_modified"].(bool); notModified {
+		return b.channels, nil
+	}
+	channelsRaw, _ := data["channels"].([]interface{})
 
 	channels := make([]string, len(channelsRaw))
 	for i, ch := range channelsRaw {
 		channels[i] = ch.(string)
 	}
 
+	b.channels = channels
+	b.channelsVersion, _ = data["version"].(string)
 	return channels, nil
 }
 
@@ -153,11 +292,14 @@ func (b *Bot) PublishToChannel(channel, message string) error {
 	}
 
 	data := response["data"].(map[string]interface{})
-	if data["status"] == "OK" {
+	if data["status"] != "erro" {
 		fmt.Printf("[Clock=%d] [%s] Publicou: %s\n", b.logicalClock, channel, message)
 		return nil
 	}
 
+	if data["description"] != nil {
+		return fmt.Errorf("erro ao publicar: %v", data["description"])
+	}
 	return fmt.Errorf("erro ao publicar: %v", data["message"])
 }
 
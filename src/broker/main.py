@@ -1,21 +1,178 @@
 #!/usr/bin/env python3
+import os
+import time
+from collections import OrderedDict, deque
+
 import zmq
 
+# proxy: zmq.proxy com round-robin; lb: balanceamento por carga (LRU / paranoid pirate)
+BROKER_MODE = os.environ.get("BROKER_MODE", "lb")
+
+# Protocolo com os servidores (modo lb)
+PPP_READY = b"\x01"      # [READY, capacidade] - servidor disponível
+PPP_HEARTBEAT = b"\x02"  # [HEARTBEAT] - nos dois sentidos
+HEARTBEAT_INTERVAL = float(os.environ.get("BROKER_HEARTBEAT_INTERVAL", 1.0))
+HEARTBEAT_LIVENESS = int(os.environ.get("BROKER_HEARTBEAT_LIVENESS", 3))
+STATS_INTERVAL = float(os.environ.get("BROKER_STATS_INTERVAL", 10.0))
+LATENCY_SAMPLES = 1000
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Worker:
+    """Servidor conectado ao backend, com capacidade e requisições em andamento"""
+
+    def __init__(self, identity, capacity):
+        self.identity = identity
+        self.capacity = capacity
+        self.in_flight = 0
+        self.expiry = time.monotonic() + HEARTBEAT_INTERVAL * HEARTBEAT_LIVENESS
+        self.completed = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def name(self):
+        return self.identity.hex()
+
+    def available(self):
+        return self.in_flight < self.capacity
+
+
+class LoadBalancer:
+    """Encaminha requisições apenas para servidores com capacidade livre"""
+
+    def __init__(self, frontend, backend):
+        self.frontend = frontend
+        self.backend = backend
+        self.workers = OrderedDict()  # identidade -> Worker, ordem LRU
+        self.pending = {}             # (identidade, envelope) -> instante do envio
+        self.heartbeat_at = time.monotonic() + HEARTBEAT_INTERVAL
+        self.stats_at = time.monotonic() + STATS_INTERVAL
+
+    def has_capacity(self):
+        return any(worker.available() for worker in self.workers.values())
+
+    def next_worker(self):
+        """Escolhe o servidor menos ocupado; empates ficam com o usado há mais tempo"""
+        best = None
+        for worker in self.workers.values():
+            if worker.available() and (best is None or worker.in_flight < best.in_flight):
+                best = worker
+        self.workers.move_to_end(best.identity)
+        return best
+
+    def handle_backend(self, frames):
+        identity, frames = frames[0], frames[1:]
+        worker = self.workers.get(identity)
+
+        if b"" not in frames:
+            command = frames[0]
+            if command == PPP_READY:
+                capacity = int(frames[1]) if len(frames) > 1 else 1
+                if worker is None:
+                    print(f"Servidor {identity.hex()} disponível (capacidade={capacity})")
+                    worker = self.workers[identity] = Worker(identity, capacity)
+                worker.capacity = capacity
+            elif command != PPP_HEARTBEAT:
+                print(f"Mensagem inválida do servidor {identity.hex()}: {frames}")
+            if worker:
+                worker.expiry = time.monotonic() + HEARTBEAT_INTERVAL * HEARTBEAT_LIVENESS
+            return
+
+        # Resposta: [envelope do cliente..., b"", corpo]
+        envelope = tuple(frames[:frames.index(b"")])
+        sent_at = self.pending.pop((identity, envelope), None)
+        if worker:
+            worker.in_flight = max(0, worker.in_flight - 1)
+            worker.expiry = time.monotonic() + HEARTBEAT_INTERVAL * HEARTBEAT_LIVENESS
+            worker.completed += 1
+            if sent_at is not None:
+                worker.latencies.append((time.monotonic() - sent_at) * 1000)
+        self.frontend.send_multipart(frames)
+
+    def handle_frontend(self, frames):
+        if b"" not in frames:
+            print(f"Requisição sem delimitador descartada: {frames[:1]}")
+            return
+        worker = self.next_worker()
+        worker.in_flight += 1
+        envelope = tuple(frames[:frames.index(b"")])
+        self.pending[(worker.identity, envelope)] = time.monotonic()
+        self.backend.send_multipart([worker.identity] + frames)
+
+    def tick(self):
+        """Envia heartbeats, remove servidores mortos e publica estatísticas"""
+        now = time.monotonic()
+        if now >= self.heartbeat_at:
+            for worker in self.workers.values():
+                self.backend.send_multipart([worker.identity, PPP_HEARTBEAT])
+            self.heartbeat_at = now + HEARTBEAT_INTERVAL
+
+        for identity, worker in list(self.workers.items()):
+            if now > worker.expiry:
+                print(f"Servidor {worker.name()} removido (sem heartbeat, {worker.in_flight} requisições perdidas)")
+                del self.workers[identity]
+                for key in [key for key in self.pending if key[0] == identity]:
+                    del self.pending[key]
+
+        if STATS_INTERVAL > 0 and now >= self.stats_at:
+            self.stats_at = now + STATS_INTERVAL
+            for worker in self.workers.values():
+                samples = list(worker.latencies)
+                print(f"[stats] {worker.name()}: em andamento={worker.in_flight}/{worker.capacity} "
+                      f"concluídas={worker.completed} p50={percentile(samples, 0.50):.2f}ms "
+                      f"p99={percentile(samples, 0.99):.2f}ms")
+
+    def run(self):
+        backend_poller = zmq.Poller()
+        backend_poller.register(self.backend, zmq.POLLIN)
+        both_poller = zmq.Poller()
+        both_poller.register(self.backend, zmq.POLLIN)
+        both_poller.register(self.frontend, zmq.POLLIN)
+
+        while True:
+            # Só aceita novas requisições quando algum servidor tem capacidade livre
+            poller = both_poller if self.has_capacity() else backend_poller
+            socks = dict(poller.poll(HEARTBEAT_INTERVAL * 1000))
+
+            if self.backend in socks:
+                self.handle_backend(self.backend.recv_multipart())
+
+            if self.frontend in socks and self.has_capacity():
+                self.handle_frontend(self.frontend.recv_multipart())
+
+            self.tick()
+
+
 def main():
     context = zmq.Context()
-    
+
     # Socket para clientes (ROUTER)
     client_socket = context.socket(zmq.ROUTER)
     client_socket.bind("tcp://*:5555")
-    
-    # Socket para servidores (DEALER) - balanceamento round-robin
-    server_socket = context.socket(zmq.DEALER)
+
+    if BROKER_MODE == "proxy":
+        # Socket para servidores (DEALER) - balanceamento round-robin
+        server_socket = context.socket(zmq.DEALER)
+        server_socket.bind("tcp://*:5556")
+
+        print("Broker iniciado - Balanceamento de carga entre clientes e servidores")
+
+        # Proxy para balanceamento automático
+        zmq.proxy(client_socket, server_socket)
+        return
+
+    # Socket para servidores (ROUTER) - servidores anunciam disponibilidade
+    server_socket = context.socket(zmq.ROUTER)
     server_socket.bind("tcp://*:5556")
-    
-    print("Broker iniciado - Balanceamento de carga entre clientes e servidores")
-    
-    # Proxy para balanceamento automático
-    zmq.proxy(client_socket, server_socket)
+
+    print("Broker iniciado - Balanceamento por carga (servidores ociosos primeiro)")
+
+    LoadBalancer(client_socket, server_socket).run()
 
 if __name__ == "__main__":
     main()
@@ -2,6 +2,30 @@
 const zmq = require('zeromq');
 const msgpack = require('msgpack-lite');
 const readline = require('readline');
+const zlib = require('zlib');
+
+// 0: proxy único (5558); N: proxy em shards, shard i em PROXY_SHARD_BASE_PORT + 2i + 1.
+// O shard de um tópico é crc32(tópico) % N (deve coincidir com proxy/main.py)
+const PROXY_SHARDS = parseInt(process.env.PROXY_SHARDS || "0", 10);
+const PROXY_SHARD_BASE_PORT = parseInt(process.env.PROXY_SHARD_BASE_PORT || "5570", 10);
+
+// 1: formato original ({service, data}); 2: esquema compacto (server/wire.py).
+// Com 2, os servidores devem publicar em v2 (WIRE_PUBLISH=v2 ou both)
+const WIRE_VERSION = parseInt(process.env.WIRE_VERSION || "1", 10);
+const WIRE_TOPIC_PREFIX = "\x02";
+// Códigos e campos posicionais de cada serviço (devem coincidir com server/wire.py)
+const WIRE_SERVICES = {
+    login: [1, ["user"], []],
+    users: [2, ["if_version", "since", "offset", "limit"], ["users", "version", "not_modified", "delta", "next"]],
+    channel: [3, ["channel"], []],
+    channels: [4, ["if_version", "since", "offset", "limit"], ["channels", "version", "not_modified", "delta", "next"]],
+    publish: [5, ["user", "channel", "message"], []],
+    message: [6, ["src", "dst", "message"], []],
+    history: [7, ["channel", "limit", "before", "after"], ["publications", "cursor"]],
+    inbox: [8, ["user", "limit", "before", "after"], ["messages", "cursor"]],
+    fetch: [9, ["user", "limit", "after"], ["messages", "cursor", "pending"]],
+    ack: [10, ["user", "cursor"], ["cursor"]],
+};
 
 class Client {
     constructor() {
@@ -9,6 +33,7 @@ class Client {
         this.subSocket = null;
         this.username = null;
         this.logicalClock = 0;
+        this.connectedShards = new Set();
     }
 
     updateClock(receivedClock = 0) {
@@ -26,7 +51,9 @@ class Client {
         
         // Socket SUB para receber publicações do proxy (será usado na Parte 2)
         this.subSocket = new zmq.Subscriber();
-        await this.subSocket.connect("tcp://proxy:5558");
+        if (PROXY_SHARDS === 0) {
+            await this.subSocket.connect("tcp://proxy:5558");
+        }
         
         console.log("Cliente conectado ao broker e proxy");
     }
@@ -34,33 +61,55 @@ class Client {
     async sendRequest(service, data) {
         this.incrementClock();
         
-        const message = {
-            service: service,
-            data: {
-                ...data,
-                timestamp: new Date().toISOString(),
-                clock: this.logicalClock
-            }
-        };
+        let message;
+        if (WIRE_VERSION === 2) {
+            const [code, fields] = WIRE_SERVICES[service];
+            message = [2, code, this.logicalClock, Date.now() * 1000, ...fields.map((field) => data[field] ?? null)];
+        } else {
+            message = {
+                service: service,
+                data: {
+                    ...data,
+                    timestamp: new Date().toISOString(),
+                    clock: this.logicalClock
+                }
+            };
+        }
         
         const packed = msgpack.encode(message);
         await this.reqSocket.send(packed);
         const [response] = await this.reqSocket.receive();
-        const decoded = msgpack.decode(response);
+        const decoded = WIRE_VERSION === 2 ? this.decodeCompact(service, msgpack.decode(response)) : msgpack.decode(response);
         
         this.updateClock(decoded.data?.clock || 0);
         return decoded;
     }
 
+    // Resposta v2 [2, código, status, clock, timestamp_us, campos...] no formato {service, data}
+    decodeCompact(service, [, , status, clock, timestamp, ...values]) {
+        const data = { status: status === 0 ? "OK" : "erro", clock, timestamp };
+        if (status !== 0) {
+            data.description = values[0];
+        } else {
+            WIRE_SERVICES[service][2].forEach((field, i) => { data[field] = values[i]; });
+        }
+        return { service, data };
+    }
+
+    isOk(response) {
+        return response.data.status !== "erro";
+    }
+
     async login(username) {
         const response = await this.sendRequest("login", { user: username });
         
-        if (response.data.status === "sucesso") {
+        if (this.isOk(response)) {
             this.username = username;
             console.log(`Login bem-sucedido: ${username}`);
             
             // Inscreve no próprio nome para receber mensagens (Parte 2)
-            this.subSocket.subscribe(username);
+            this.subscribe(username);
+            await this.fetchPending();
             return true;
         } else {
             console.log(`Erro no login: ${response.data.description}`);
@@ -68,6 +117,25 @@ class Client {
         }
     }
 
+    // Mensagens privadas recebidas enquanto o cliente estava desconectado:
+    // busca em lotes a partir da última confirmação e confirma cada lote exibido
+    async fetchPending() {
+        let pending = 1;
+        while (pending > 0) {
+            const response = await this.sendRequest("fetch", { user: this.username });
+            if (!this.isOk(response) || response.data.messages.length === 0) {
+                return;
+            }
+            for (const record of response.data.messages) {
+                // v2: [origem, mensagem, timestamp_us, clock]
+                const [src, message] = Array.isArray(record) ? record : [record.src, record.message];
+                console.log(`[MSG pendente de ${src}]: ${message}`);
+            }
+            await this.sendRequest("ack", { user: this.username, cursor: response.data.cursor });
+            pending = response.data.pending;
+        }
+    }
+
     async listUsers() {
         const response = await this.sendRequest("users", {});
         console.log("Usuários cadastrados:", response.data.users);
@@ -77,7 +145,7 @@ class Client {
     async createChannel(channelName) {
         const response = await this.sendRequest("channel", { channel: channelName });
         
-        if (response.data.status === "sucesso") {
+        if (this.isOk(response)) {
             console.log(`Canal criado: ${channelName}`);
         } else {
             console.log(`Erro ao criar canal: ${response.data.description}`);
@@ -97,10 +165,10 @@ class Client {
             message: message
         });
         
-        if (response.data.status === "OK") {
+        if (this.isOk(response)) {
             console.log(`Mensagem publicada no canal ${channel}`);
         } else {
-            console.log(`Erro: ${response.data.message}`);
+            console.log(`Erro: ${response.data.message || response.data.description}`);
         }
     }
 
@@ -111,23 +179,43 @@ class Client {
             message: message
         });
         
-        if (response.data.status === "OK") {
+        if (this.isOk(response)) {
             console.log(`Mensagem enviada para ${toUser}`);
         } else {
-            console.log(`Erro: ${response.data.message}`);
+            console.log(`Erro: ${response.data.message || response.data.description}`);
+        }
+    }
+
+    subscribe(name) {
+        // Publicações v2 usam o tópico com prefixo; o shard é calculado sobre o tópico real
+        const topic = WIRE_VERSION === 2 ? WIRE_TOPIC_PREFIX + name : name;
+        // Com o proxy em shards, conecta apenas ao shard que carrega o tópico
+        if (PROXY_SHARDS > 0) {
+            const shard = zlib.crc32(topic) % PROXY_SHARDS;
+            if (!this.connectedShards.has(shard)) {
+                this.subSocket.connect(`tcp://proxy:${PROXY_SHARD_BASE_PORT + 2 * shard + 1}`);
+                this.connectedShards.add(shard);
+            }
         }
+        this.subSocket.subscribe(topic);
     }
 
     async subscribeToChannel(channel) {
-        this.subSocket.subscribe(channel);
+        this.subscribe(channel);
         console.log(`Inscrito no canal: ${channel}`);
     }
 
     startListening() {
         (async () => {
             for await (const [topic, msg] of this.subSocket) {
-                const topicStr = topic.toString();
-                const data = msgpack.decode(msg);
+                let topicStr = topic.toString();
+                let data = msgpack.decode(msg);
+                if (WIRE_VERSION === 2) {
+                    // [usuário | origem, mensagem, timestamp_us, clock]
+                    topicStr = topicStr.slice(WIRE_TOPIC_PREFIX.length);
+                    const [author, message, timestamp, clock] = data;
+                    data = { user: author, src: author, message, timestamp, clock };
+                }
                 
                 this.updateClock(data.clock || 0);
                 
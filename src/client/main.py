@@ -1,3 +1,10 @@
+import itertools
+import os
+import sys
+import time
+from datetime import datetime
+
+import msgpack
 import zmq
 
 req_address = "broker"
@@ -5,12 +12,165 @@ req_port = 5555
 
 sub_address = "proxy"
 sub_port = 5558
+# 0: proxy único; N: proxy em shards, shard i em shard_base_port + 2i + 1 (ver proxy/main.py)
+proxy_shards = int(os.environ.get("PROXY_SHARDS", 0))
+shard_base_port = int(os.environ.get("PROXY_SHARD_BASE_PORT", 5570))
+
+# Máximo de requisições em andamento no modo pipeline
+PIPELINE_WINDOW = 64
+# Espera (s) por cada resposta e reenvios de leituras sem resposta
+PIPELINE_TIMEOUT = float(os.environ.get("PIPELINE_TIMEOUT", 5.0))
+PIPELINE_RETRIES = int(os.environ.get("PIPELINE_RETRIES", 2))
+# Leituras sem efeito no servidor: podem ser reenviadas; mutações sem resposta falham
+IDEMPOTENT_SERVICES = {"users", "channels", "history", "inbox", "fetch"}
+
+
+class PipelinedClient:
+    """Cliente DEALER que mantém várias requisições em andamento
+
+    Cada requisição leva um ID de correlação no envelope ([id, b"", corpo]); o broker
+    e os servidores devolvem o envelope intacto, então as respostas podem chegar fora
+    de ordem e ainda assim ser associadas à requisição original.
+
+    Uma requisição sem resposta em `timeout` segundos é reenviada (com outro ID) se for
+    uma leitura, até `retries` vezes; mutações não são reenviadas, para não duplicar
+    publicações, e a espera termina com TimeoutError. Respostas atrasadas de IDs já
+    descartados são ignoradas.
+    """
+
+    def __init__(self, context, address=f"tcp://{req_address}:{req_port}", window=PIPELINE_WINDOW,
+                 timeout=PIPELINE_TIMEOUT, retries=PIPELINE_RETRIES):
+        self.socket = context.socket(zmq.DEALER)
+        self.socket.setsockopt(zmq.LINGER, 0)
+        self.socket.connect(address)
+        self.window = window
+        self.timeout = timeout
+        self.retries = retries
+        self.logical_clock = 0
+        self.ids = itertools.count(1)
+
+    def update_clock(self, received_clock=0):
+        self.logical_clock = max(self.logical_clock, received_clock) + 1
+
+    def message(self, service, data):
+        self.logical_clock += 1
+        return {
+            "service": service,
+            "data": {
+                **data,
+                "timestamp": datetime.now().isoformat(timespec="microseconds"),
+                "clock": self.logical_clock
+            }
+        }
+
+    def send(self, service, data):
+        """Envia uma requisição sem esperar a resposta; retorna o ID de correlação"""
+        request_id = next(self.ids).to_bytes(8, "big")
+        self.socket.send_multipart([request_id, b"", msgpack.packb(self.message(service, data))])
+        return request_id
+
+    def receive(self, timeout=None):
+        """Recebe a próxima resposta disponível como (ID de correlação, resposta); None após `timeout` s"""
+        if timeout is not None and not self.socket.poll(timeout * 1000):
+            return None
+        frames = self.socket.recv_multipart()
+        response = msgpack.unpackb(frames[-1], raw=False)
+        self.update_clock(response.get("data", {}).get("clock", 0))
+        return frames[0], response
+
+    def request(self, service, data):
+        """Requisição síncrona (equivalente a REQ)"""
+        return self.pipeline([(service, data)])[0]
+
+    def pipeline(self, operations):
+        """Executa as operações mantendo até `window` em andamento; respostas na ordem de entrada"""
+        operations = list(operations)
+        positions = {}
+        deadlines = {}  # {ID: (prazo da resposta, tentativas)}
+        responses = [None] * len(operations)
+        next_index = 0
+        while next_index < len(operations) or positions:
+            while next_index < len(operations) and len(positions) < self.window:
+                service, data = operations[next_index]
+                request_id = self.send(service, data)
+                positions[request_id] = next_index
+                deadlines[request_id] = (time.monotonic() + self.timeout, 1)
+                next_index += 1
+            wait = min(deadline for deadline, _ in deadlines.values()) - time.monotonic()
+            received = self.receive(max(0.0, wait))
+            if received is None:
+                self.expire(operations, positions, deadlines)
+                continue
+            request_id, response = received
+            index = positions.pop(request_id, None)
+            if index is not None:
+                del deadlines[request_id]
+                responses[index] = response
+        return responses
+
+    def expire(self, operations, positions, deadlines):
+        """Reenvia as leituras vencidas e falha nas mutações vencidas"""
+        now = time.monotonic()
+        for request_id, (deadline, attempts) in list(deadlines.items()):
+            if deadline > now:
+                continue
+            index = positions.pop(request_id)
+            del deadlines[request_id]
+            service, data = operations[index]
+            if service not in IDEMPOTENT_SERVICES or attempts > self.retries:
+                raise TimeoutError(f"Sem resposta para {service} após {attempts} tentativa(s) de {self.timeout}s")
+            request_id = self.send(service, data)
+            positions[request_id] = index
+            deadlines[request_id] = (now + self.timeout, attempts + 1)
+
+    def batch(self, operations):
+        """Envia várias operações em um único frame usando o serviço batch"""
+        response = self.request("batch", {
+            "operations": [self.message(service, data) for service, data in operations]
+        })
+        return response["data"].get("responses", [])
+
+
+def bulk_demo(count):
+    """Compara requisições sequenciais, pipeline e lote para logins e publicações"""
+    context = zmq.Context()
+    client = PipelinedClient(context)
+    client.request("channel", {"channel": "bulk"})
+
+    sequential = PipelinedClient(context, window=1)
+    start = time.perf_counter()
+    sequential.pipeline([("login", {"user": f"seq_{i}"}) for i in range(count)])
+    elapsed = time.perf_counter() - start
+    print(f"sequencial: {count / elapsed:.0f} ops/s")
+
+    start = time.perf_counter()
+    client.pipeline([("login", {"user": f"pipe_{i}"}) for i in range(count)])
+    elapsed = time.perf_counter() - start
+    print(f"pipeline (janela={client.window}): {count / elapsed:.0f} ops/s")
+
+    start = time.perf_counter()
+    operations = [("publish", {"user": "bulk", "channel": "bulk", "message": str(i)}) for i in range(count)]
+    for i in range(0, count, 100):
+        client.batch(operations[i:i + 100])
+    elapsed = time.perf_counter() - start
+    print(f"lotes de 100: {count / elapsed:.0f} ops/s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bulk":
+        bulk_demo(int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
+        sys.exit(0)
 
-context = zmq.Context()
+    context = zmq.Context()
 
-req_socket = context.socket(zmq.REQ)
-req_socket.connect(f"tcp://{req_address}:{req_port}")
+    req_socket = context.socket(zmq.REQ)
+    req_socket.connect(f"tcp://{req_address}:{req_port}")
 
-sub_socket = context.socket(zmq.SUB)
-sub_socket.connect(f"tcp://{sub_address}:{sub_port}")
-sub_socket.setsockopt_string(zmq.SUBSCRIBE, "")
+    sub_socket = context.socket(zmq.SUB)
+    if proxy_shards:
+        # Assina todos os tópicos, então precisa de todos os shards
+        for shard in range(proxy_shards):
+            sub_socket.connect(f"tcp://{sub_address}:{shard_base_port + 2 * shard + 1}")
+    else:
+        sub_socket.connect(f"tcp://{sub_address}:{sub_port}")
+    sub_socket.setsockopt_string(zmq.SUBSCRIBE, "")
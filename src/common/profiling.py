@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""Perfilamento opcional: spans por requisição, log de requisições lentas e amostragem de pilhas
+
+Com o perfilamento ligado, cada requisição acumula o tempo de suas etapas (decode,
+handler, persist, replicate, encode); as que passam de PROFILE_SLOW_MS são
+registradas com essa divisão. O amostrador lê as pilhas de todas as threads
+PROFILE_SAMPLE_HZ vezes por segundo e grava o resultado no formato "folded"
+(uma pilha por linha, "a;b;c contagem"), aceito por flamegraph.pl e speedscope.
+
+Tudo pode ser ligado e desligado em execução pelo serviço "profile".
+Fica em src/common e é copiado para a imagem de cada serviço pelo contexto de build
+adicional "common" do docker-compose (COPY --from=common no Dockerfile.python).
+
+Uso pela linha de comando:
+  python profiling.py tcp://localhost:5560 status|on|off|sample-start|sample-stop [limite_ms]
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+import msgpack
+
+PROFILE = os.environ.get("PROFILE", "off")  # on | off
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", 50))
+PROFILE_SAMPLE_HZ = float(os.environ.get("PROFILE_SAMPLE_HZ", 100))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp")
+PROFILE_TOP_STACKS = 10
+SPAN_ORDER = ("decode", "handler", "persist", "replicate", "encode")
+
+
+class Trace:
+    """Tempo acumulado por etapa de uma requisição"""
+
+    __slots__ = ("service", "start", "spans")
+
+    def __init__(self, service):
+        self.service = service
+        self.start = time.perf_counter()
+        self.spans = {}
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+
+class StackSampler:
+    """Amostra periodicamente as pilhas de todas as threads (formato folded)"""
+
+    def __init__(self, hz=PROFILE_SAMPLE_HZ):
+        self.interval = 1.0 / hz
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.started = time.time()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        own = threading.get_ident()
+        names = {}
+        while self.running:
+            time.sleep(self.interval)
+            if len(names) != threading.active_count():
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top(self, limit=PROFILE_TOP_STACKS):
+        """Pilhas mais frequentes, resumidas às três chamadas mais internas"""
+        return [[";".join(stack.split(";")[-3:]), count] for stack, count in self.stacks.most_common(limit)]
+
+
+class Profiler:
+    """Spans por requisição, requisições lentas e controle do amostrador"""
+
+    def __init__(self, name, log=print, enabled=PROFILE == "on", slow_ms=PROFILE_SLOW_MS):
+        self.name = name
+        self.log = log
+        self.enabled = enabled
+        self.slow_seconds = slow_ms / 1000
+        self.local = threading.local()
+        self.sampler = None
+        self.slow_requests = 0
+
+    def begin(self, service):
+        """Inicia o trace da requisição da thread atual (None se desligado)"""
+        if not self.enabled:
+            return None
+        trace = Trace(service)
+        self.local.trace = trace
+        return trace
+
+    def current(self):
+        """Trace em andamento na thread atual, para etapas medidas mais abaixo (persist, replicate)"""
+        if not self.enabled:
+            return None
+        return getattr(self.local, "trace", None)
+
+    def end(self, trace):
+        """Encerra o trace e registra a requisição se passou do limite"""
+        self.local.trace = None
+        total = time.perf_counter() - trace.start + trace.spans.get("decode", 0.0)
+        if total < self.slow_seconds:
+            return
+        self.slow_requests += 1
+        spans = trace.spans
+        # persist e replicate acontecem dentro do handler; mostra o handler sem elas
+        nested = spans.get("persist", 0.0) + spans.get("replicate", 0.0)
+        if "handler" in spans and nested:
+            spans["handler"] = max(0.0, spans["handler"] - nested)
+        names = [name for name in SPAN_ORDER if name in spans] + [name for name in spans if name not in SPAN_ORDER]
+        parts = ", ".join(f"{name} {spans[name] * 1000:.2f}ms" for name in names)
+        self.log(f"Requisição lenta: {trace.service} {total * 1000:.2f}ms ({parts})")
+
+    def observe(self, operation, seconds):
+        """Registra uma operação fora de requisições (ex.: espera pelo servidor de referência)"""
+        if self.enabled and seconds >= self.slow_seconds:
+            self.slow_requests += 1
+            self.log(f"Operação lenta: {operation} {seconds * 1000:.2f}ms")
+
+    def status(self):
+        return {
+            "enabled": self.enabled,
+            "slow_ms": self.slow_seconds * 1000,
+            "slow_requests": self.slow_requests,
+            "sampling": self.sampler is not None,
+            "samples": self.sampler.samples if self.sampler else 0,
+        }
+
+    def control(self, data):
+        """Trata o serviço "profile": action = status | on | off | sample-start | sample-stop"""
+        action = data.get("action", "status")
+        result = {}
+        if "slow_ms" in data:
+            self.slow_seconds = float(data["slow_ms"]) / 1000
+        if action == "on":
+            self.enabled = True
+        elif action == "off":
+            self.enabled = False
+        elif action == "sample-start":
+            if self.sampler is None:
+                self.sampler = StackSampler(max(1.0, float(data.get("hz", PROFILE_SAMPLE_HZ))))
+                self.sampler.start()
+        elif action == "sample-stop":
+            if self.sampler is not None:
+                sampler, self.sampler = self.sampler, None
+                sampler.stop()
+                stamp = datetime.fromtimestamp(sampler.started).strftime("%Y%m%d_%H%M%S")
+                path = os.path.join(PROFILE_DIR, f"profile_{self.name}_{stamp}.folded")
+                sampler.write(path)
+                self.log(f"Perfil gravado em {path} ({sampler.samples} amostras)")
+                result = {"output": path, "samples": sampler.samples, "top": sampler.top()}
+        elif action != "status":
+            raise ValueError(f"Ação de perfilamento desconhecida: {action}")
+        return {**self.status(), **result}
+
+
+def send_control(address, action, slow_ms=None):
+    """Envia o serviço "profile" a um servidor ou ao servidor de referência"""
+    import zmq
+
+    context = zmq.Context()
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.RCVTIMEO, 10000)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(address)
+    data = {"action": action}
+    if slow_ms is not None:
+        data["slow_ms"] = slow_ms
+    socket.send(msgpack.packb({"service": "profile", "data": data}))
+    return msgpack.unpackb(socket.recv(), raw=False)["data"]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        sys.exit("Uso: python profiling.py tcp://<host>:<porta> status|on|off|sample-start|sample-stop [limite_ms]")
+    data = send_control(sys.argv[1], sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else None)
+    for stack, count in data.pop("top", []):
+        print(f"{count:>8} {stack}")
+    print(data)
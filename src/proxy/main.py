@@ -1,21 +1,354 @@
 #!/usr/bin/env python3
+import os
+import signal
+import sys
+import time
+import zlib
+from datetime import datetime
+from multiprocessing import Process
+
+import msgpack
 import zmq
 
-def main():
+# single: um único proxy XSUB/XPUB (5557/5558)
+# sharded: PROXY_SHARDS proxies independentes, cada um com uma fatia dos tópicos
+PROXY_MODE = os.environ.get("PROXY_MODE", "single")
+PROXY_SHARDS = int(os.environ.get("PROXY_SHARDS", 4))
+# Shard i: publishers em BASE + 2i, subscribers em BASE + 2i + 1
+SHARD_BASE_PORT = int(os.environ.get("PROXY_SHARD_BASE_PORT", 5570))
+
+# Plano de controle dedicado para replicação e eleição (nunca compartilhado com o chat)
+CONTROL_PUB_PORT = 5561
+CONTROL_SUB_PORT = 5562
+
+# Contabilidade por tópico (assinantes, mensagens, bytes); off volta ao zmq.proxy
+PROXY_ACCOUNTING = os.environ.get("PROXY_ACCOUNTING", "on")
+STATS_PORT = int(os.environ.get("PROXY_STATS_PORT", 5563))           # REQ/REP de estatísticas
+STATS_COLLECT_PORT = int(os.environ.get("PROXY_STATS_COLLECT_PORT", 5564))  # proxies -> processo principal
+STATS_INTERVAL = float(os.environ.get("PROXY_STATS_INTERVAL", 2.0))  # segundos entre relatórios
+STATS_TOP = 20
+FORWARD_BATCH = 256  # mensagens encaminhadas por volta do laço
+
+
+def topic_shard(topic, shards):
+    """Shard de um tópico (deve coincidir com server/fabric.py e com os clientes)"""
+    return zlib.crc32(topic) % shards
+
+
+def shard_ports(shard):
+    return SHARD_BASE_PORT + 2 * shard, SHARD_BASE_PORT + 2 * shard + 1
+
+
+class TopicStats:
+    """Assinantes, mensagens e bytes por tópico de um proxy"""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.monotonic()
+        self.topics = {}  # {tópico: [mensagens, bytes, assinantes]}
+        self.messages = 0
+        self.bytes = 0
+        self.subscribe_events = 0
+        self.unsubscribe_events = 0
+        self.reported = {}  # {tópico: (mensagens, bytes)} no último relatório
+        self.reported_at = self.started
+
+    def entry(self, topic):
+        entry = self.topics.get(topic)
+        if entry is None:
+            entry = self.topics[topic] = [0, 0, 0]
+        return entry
+
+    def message(self, frames):
+        size = sum(len(frame) for frame in frames)
+        entry = self.entry(frames[0].bytes)
+        entry[0] += 1
+        entry[1] += size
+        self.messages += 1
+        self.bytes += size
+
+    def subscription(self, event):
+        """Evento do XPUB: primeiro byte 1 (assinatura) ou 0 (cancelamento), depois o tópico"""
+        if not event:
+            return
+        entry = self.entry(event[1:])
+        if event[0] == 1:
+            entry[2] += 1
+            self.subscribe_events += 1
+        elif event[0] == 0:
+            entry[2] = max(0, entry[2] - 1)
+            self.unsubscribe_events += 1
+
+    def snapshot(self):
+        """Totais e taxas desde o relatório anterior"""
+        now = time.monotonic()
+        elapsed = max(now - self.reported_at, 1e-6)
+        topics = {}
+        for topic, (messages, size, subscribers) in self.topics.items():
+            previous_messages, previous_bytes = self.reported.get(topic, (0, 0))
+            topics[topic.decode(errors="replace")] = [
+                messages, size, subscribers,
+                (messages - previous_messages) / elapsed, (size - previous_bytes) / elapsed,
+            ]
+        self.reported = {topic: (entry[0], entry[1]) for topic, entry in self.topics.items()}
+        self.reported_at = now
+        return {
+            "name": self.name,
+            "uptime": now - self.started,
+            "messages": self.messages,
+            "bytes": self.bytes,
+            "subscribe_events": self.subscribe_events,
+            "unsubscribe_events": self.unsubscribe_events,
+            "topics": topics,
+        }
+
+
+def forward(context, name, xsub, xpub):
+    """Laço XSUB/XPUB próprio: encaminha como zmq.proxy e contabiliza tópicos e assinaturas"""
+    if PROXY_ACCOUNTING == "off":
+        zmq.proxy(xsub, xpub)
+        return
+
+    stats = TopicStats(name)
+    reporter = context.socket(zmq.PUSH)
+    reporter.setsockopt(zmq.SNDHWM, 10)
+    reporter.setsockopt(zmq.LINGER, 0)
+    reporter.connect(f"tcp://127.0.0.1:{STATS_COLLECT_PORT}")
+    report_at = time.monotonic() + STATS_INTERVAL
+
+    poller = zmq.Poller()
+    poller.register(xsub, zmq.POLLIN)
+    poller.register(xpub, zmq.POLLIN)
+
+    while True:
+        socks = dict(poller.poll(STATS_INTERVAL * 1000))
+
+        if xsub in socks:
+            # Drena um lote para amortizar o custo do poll
+            for _ in range(FORWARD_BATCH):
+                try:
+                    frames = xsub.recv_multipart(zmq.NOBLOCK, copy=False)
+                except zmq.Again:
+                    break
+                xpub.send_multipart(frames, copy=False)
+                stats.message(frames)
+
+        if xpub in socks:
+            # Com XPUB_VERBOSER cada assinatura e cancelamento chega aqui, não só o primeiro/último
+            while True:
+                try:
+                    event = xpub.recv(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                xsub.send(event)
+                stats.subscription(event)
+
+        now = time.monotonic()
+        if now >= report_at:
+            report_at = now + STATS_INTERVAL
+            try:
+                reporter.send(msgpack.packb(stats.snapshot()), zmq.NOBLOCK)
+            except zmq.Again:
+                pass
+
+
+def verbose_xpub(context):
+    xpub = context.socket(zmq.XPUB)
+    if PROXY_ACCOUNTING != "off":
+        xpub.setsockopt(zmq.XPUB_VERBOSER, 1)
+    return xpub
+
+
+def run_proxy(name, pub_port, sub_port):
+    """Proxy XSUB/XPUB em um processo próprio"""
     context = zmq.Context()
-    
+
     # XSUB para publishers
     xsub = context.socket(zmq.XSUB)
-    xsub.bind("tcp://*:5557")
-    
+    xsub.bind(f"tcp://*:{pub_port}")
+
     # XPUB para subscribers
-    xpub = context.socket(zmq.XPUB)
+    xpub = verbose_xpub(context)
+    xpub.bind(f"tcp://*:{sub_port}")
+
+    print(f"Proxy {name} iniciado (publishers: {pub_port}, subscribers: {sub_port})")
+
+    forward(context, name, xsub, xpub)
+
+
+def run_router(shards):
+    """Recebe em 5557 de publishers antigos e encaminha cada tópico ao seu shard"""
+    context = zmq.Context()
+    xsub = context.socket(zmq.XSUB)
+    xsub.bind("tcp://*:5557")
+    # Assina todos os tópicos dos publishers conectados
+    xsub.send(b"\x01")
+
+    publishers = []
+    for shard in range(shards):
+        pub = context.socket(zmq.PUB)
+        pub.connect(f"tcp://127.0.0.1:{shard_ports(shard)[0]}")
+        publishers.append(pub)
+
+    print(f"Roteador de tópicos iniciado na porta 5557 ({shards} shards)")
+    while True:
+        frames = xsub.recv_multipart()
+        publishers[topic_shard(frames[0], shards)].send_multipart(frames)
+
+
+def run_aggregator(shards):
+    """Publica em 5558 os tópicos de todos os shards, para subscribers que não conhecem os shards"""
+    context = zmq.Context()
+    xsub = context.socket(zmq.XSUB)
+    for shard in range(shards):
+        xsub.connect(f"tcp://127.0.0.1:{shard_ports(shard)[1]}")
+    xpub = verbose_xpub(context)
     xpub.bind("tcp://*:5558")
-    
-    print("Proxy Pub/Sub iniciado")
-    
-    # Proxy para pub/sub
-    zmq.proxy(xsub, xpub)
+
+    print(f"Agregador de shards iniciado na porta 5558 ({shards} shards)")
+    forward(context, "agregador", xsub, xpub)
+
+
+class StatsServer:
+    """Junta os relatórios dos proxies e responde ao serviço "stats" (REQ/REP)"""
+
+    def __init__(self, context):
+        self.collector = context.socket(zmq.PULL)
+        self.collector.bind(f"tcp://127.0.0.1:{STATS_COLLECT_PORT}")
+        self.socket = context.socket(zmq.REP)
+        self.socket.bind(f"tcp://*:{STATS_PORT}")
+        self.reports = {}  # {proxy: último snapshot}
+        self.logical_clock = 0
+        self.poller = zmq.Poller()
+        self.poller.register(self.collector, zmq.POLLIN)
+        self.poller.register(self.socket, zmq.POLLIN)
+
+    def handle_stats(self, data):
+        """Tópicos mais ativos de todos os proxies, ordenados por `sort` (bytes, messages ou subscribers)"""
+        self.logical_clock = max(self.logical_clock, data.get("clock", 0)) + 1
+        sort = data.get("sort", "bytes")
+        top = data.get("top", STATS_TOP)
+        wanted = data.get("topic")
+
+        proxies = {}
+        topics = []
+        for name, report in self.reports.items():
+            proxies[name] = {field: value for field, value in report.items() if field != "topics"}
+            proxies[name]["topics"] = len(report["topics"])
+            for topic, (messages, size, subscribers, message_rate, byte_rate) in report["topics"].items():
+                if wanted is not None and topic != wanted:
+                    continue
+                topics.append({
+                    "proxy": name,
+                    "topic": topic,
+                    "messages": messages,
+                    "bytes": size,
+                    "subscribers": subscribers,
+                    "messages_per_second": round(message_rate, 2),
+                    "bytes_per_second": round(byte_rate, 2),
+                })
+
+        if sort not in ("bytes", "messages", "subscribers"):
+            sort = "bytes"
+        topics.sort(key=lambda topic: topic[sort], reverse=True)
+
+        return {
+            "service": "stats",
+            "data": {
+                "status": "OK",
+                "proxies": proxies,
+                "topics": topics[:top],
+                "timestamp": datetime.now().isoformat(),
+                "clock": self.logical_clock,
+            },
+        }
+
+    def poll(self, timeout_ms):
+        socks = dict(self.poller.poll(timeout_ms))
+        if self.collector in socks:
+            while True:
+                try:
+                    report = msgpack.unpackb(self.collector.recv(zmq.NOBLOCK), raw=False)
+                except zmq.Again:
+                    break
+                self.reports[report["name"]] = report
+
+        if self.socket in socks:
+            try:
+                request = msgpack.unpackb(self.socket.recv(), raw=False)
+            except (ValueError, msgpack.UnpackException):
+                request = None
+            # Só o formato v1 ({service, data}); v2 (lista) e bytes inválidos recebem erro
+            if not isinstance(request, dict) or not isinstance(request.get("data", {}), dict):
+                response = self.error(None, "Requisição inválida: esperado {service, data} (formato v1)")
+            elif request.get("service") == "stats":
+                response = self.handle_stats(request.get("data", {}))
+            else:
+                response = self.error(request.get("service"), f"Serviço desconhecido: {request.get('service')}")
+            self.socket.send(msgpack.packb(response))
+
+    def error(self, service, description):
+        return {
+            "service": service,
+            "data": {
+                "status": "erro",
+                "timestamp": datetime.now().isoformat(),
+                "clock": self.logical_clock,
+                "description": description,
+            },
+        }
+
+
+def print_stats(address, sort="bytes", top=STATS_TOP):
+    """Consulta o serviço de estatísticas e imprime os tópicos mais ativos"""
+    context = zmq.Context()
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.RCVTIMEO, 5000)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(address)
+    socket.send(msgpack.packb({"service": "stats", "data": {"sort": sort, "top": top}}))
+    data = msgpack.unpackb(socket.recv(), raw=False)["data"]
+
+    for name, proxy in sorted(data["proxies"].items()):
+        print(f"{name}: {proxy['messages']} mensagens, {proxy['bytes']} bytes, {proxy['topics']} tópicos")
+    print(f"{'proxy':<14} {'tópico':<24} {'assin.':>6} {'msgs':>10} {'msgs/s':>9} {'bytes/s':>11}")
+    for topic in data["topics"]:
+        print(f"{topic['proxy']:<14} {topic['topic']:<24} {topic['subscribers']:>6} {topic['messages']:>10} "
+              f"{topic['messages_per_second']:>9.1f} {topic['bytes_per_second']:>11.1f}")
+
+
+def main():
+    # SIGTERM encerra pelo caminho normal, que também termina os processos filhos
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    processes = [Process(target=run_proxy, args=("controle", CONTROL_PUB_PORT, CONTROL_SUB_PORT))]
+
+    if PROXY_MODE == "sharded":
+        for shard in range(PROXY_SHARDS):
+            processes.append(Process(target=run_proxy, args=(f"shard {shard}", *shard_ports(shard))))
+        processes.append(Process(target=run_router, args=(PROXY_SHARDS,)))
+        processes.append(Process(target=run_aggregator, args=(PROXY_SHARDS,)))
+    else:
+        processes.append(Process(target=run_proxy, args=("pubsub", 5557, 5558)))
+
+    for process in processes:
+        process.daemon = True
+        process.start()
+
+    # Criado depois dos fork(); os relatórios enviados antes do bind ficam na fila do PUSH
+    stats = StatsServer(zmq.Context())
+
+    print(f"Proxy Pub/Sub iniciado (modo {PROXY_MODE}), estatísticas na porta {STATS_PORT}")
+
+    # Se qualquer proxy terminar, encerra para que o container seja reiniciado
+    while all(process.is_alive() for process in processes):
+        stats.poll(1000)
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == "stats":
+        # python main.py stats [bytes|messages|subscribers] [endereço]
+        sort = sys.argv[2] if len(sys.argv) > 2 else "bytes"
+        address = sys.argv[3] if len(sys.argv) > 3 else f"tcp://localhost:{STATS_PORT}"
+        print_stats(address, sort)
+    else:
+        main()
@@ -1,17 +1,30 @@
 #!/usr/bin/env python3
+import os
+import sys
 import zmq
 import msgpack
 import time
-import threading
 from datetime import datetime
 
+# Módulos compartilhados (src/common): copiados para /app na imagem, procurados em ../common fora dela
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+from membership import Membership
+from profiling import Profiler
+
+# Eleições são publicadas no plano de controle do proxy (separado do tráfego de chat)
+PROXY_CONTROL_PUB = os.environ.get("PROXY_CONTROL_PUB", "tcp://proxy:5561")
+# Espera antes de anunciar a eleição após um registro (o servidor novo ainda está se conectando)
+ANNOUNCE_DELAY = 2.0
+
 class ReferenceServer:
     def __init__(self):
-        self.servers = {}  # {name: {"rank": int, "last_heartbeat": timestamp}}
-        self.next_rank = 0
+        self.members = Membership()
         self.logical_clock = 0
         self.current_coordinator = None
+        self.announce_at = None  # anúncio de eleição adiado (ver ANNOUNCE_DELAY)
         self.pub_socket = None
+        self.profiler = Profiler("reference", log=lambda message: print(f"[PERFIL] {message}"))
         
     def update_clock(self, received_clock):
         """Atualiza relógio lógico"""
@@ -19,18 +32,7 @@ class ReferenceServer:
     
     def get_coordinator(self):
         """Retorna o coordenador (servidor com menor rank ativo)"""
-        current_time = time.time()
-        active_servers = {
-            name: info for name, info in self.servers.items()
-            if current_time - info["last_heartbeat"] < 30
-        }
-        
-        if not active_servers:
-            return None
-        
-        # Coordenador é o servidor com menor rank
-        coordinator = min(active_servers.items(), key=lambda x: x[1]["rank"])
-        return coordinator[0]
+        return self.members.coordinator()
     
     def publish_coordinator(self):
         """Publica o coordenador atual para todos os servidores"""
@@ -48,7 +50,7 @@ class ReferenceServer:
                 self.logical_clock += 1
                 message = {
                     "coordinator": coordinator,
-                    "rank": self.servers[coordinator]["rank"],
+                    "rank": self.members.rank(coordinator),
                     "clock": self.logical_clock
                 }
                 
@@ -58,41 +60,45 @@ class ReferenceServer:
                 if old_coordinator:
                     print(f"[ELEIÇÃO] Mudança de coordenador: {old_coordinator} -> {coordinator}")
                 else:
-                    print(f"[ELEIÇÃO] Coordenador inicial eleito: {coordinator} (rank={self.servers[coordinator]['rank']})")
+                    print(f"[ELEIÇÃO] Coordenador inicial eleito: {coordinator} (rank={self.members.rank(coordinator)})")
     
-    def monitor_coordinator(self):
-        """Thread que monitora e publica mudanças de coordenador"""
-        while True:
-            try:
-                time.sleep(5)  # Verifica a cada 5 segundos
-                self.publish_coordinator()
-            except Exception as e:
-                print(f"Erro no monitor de coordenador: {e}")
+    def membership_changed(self):
+        """Anuncia a eleição na hora, a menos que um anúncio adiado esteja pendente"""
+        if self.announce_at is None:
+            self.publish_coordinator()
+    
+    def check_deadlines(self):
+        """Expira servidores sem heartbeat e dispara anúncios adiados (chamado a cada volta do laço)"""
+        expired = self.members.expire()
+        for name, silent in expired:
+            print(f"[FALHA] Servidor {name} sem heartbeat há {silent:.1f}s")
+        if self.announce_at is not None and time.monotonic() >= self.announce_at:
+            self.announce_at = None
+            self.publish_coordinator()
+        elif expired:
+            self.membership_changed()
+    
+    def poll_timeout(self, default=1000):
+        """Milissegundos até o próximo prazo de heartbeat ou anúncio adiado"""
+        deadlines = [t for t in (self.members.next_deadline(), self.announce_at) if t is not None]
+        if not deadlines:
+            return default
+        return max(0, min(default, (min(deadlines) - time.monotonic()) * 1000))
         
     def handle_rank(self, data):
         """Fornece rank para servidor"""
         self.update_clock(data.get("clock", 0))
         
         server_name = data.get("user")
-        is_new_server = server_name not in self.servers
+        # Endereço para sincronização entre réplicas (opcional)
+        rank, is_new_server = self.members.register(server_name, data.get("address"))
         
         if is_new_server:
-            # Novo servidor
-            rank = self.next_rank
-            self.next_rank += 1
-            self.servers[server_name] = {
-                "rank": rank,
-                "last_heartbeat": time.time()
-            }
             print(f"[REGISTRO] Novo servidor registrado: {server_name} (rank={rank})")
-        else:
-            rank = self.servers[server_name]["rank"]
-            self.servers[server_name]["last_heartbeat"] = time.time()
-        
-        # Publica coordenador quando novo servidor entra
-        if is_new_server:
             # Aguarda um pouco para garantir que o servidor está pronto
-            threading.Timer(2.0, self.publish_coordinator).start()
+            self.announce_at = time.monotonic() + ANNOUNCE_DELAY
+        else:
+            self.membership_changed()
         
         return {
             "service": "rank",
@@ -107,22 +113,10 @@ class ReferenceServer:
         """Retorna lista de servidores ativos"""
         self.update_clock(data.get("clock", 0))
         
-        # Remove servidores inativos (sem heartbeat há mais de 30s)
-        current_time = time.time()
-        active_servers = {
-            name: info for name, info in self.servers.items()
-            if current_time - info["last_heartbeat"] < 30
-        }
-        
-        server_list = [
-            {"name": name, "rank": info["rank"]}
-            for name, info in active_servers.items()
-        ]
-        
         return {
             "service": "list",
             "data": {
-                "list": server_list,
+                "list": self.members.active_list(),
                 "timestamp": datetime.now().isoformat(),
                 "clock": self.logical_clock
             }
@@ -133,9 +127,10 @@ class ReferenceServer:
         self.update_clock(data.get("clock", 0))
         
         server_name = data.get("user")
-        
-        if server_name in self.servers:
-            self.servers[server_name]["last_heartbeat"] = time.time()
+        was_active = len(self.members)
+        if self.members.heartbeat(server_name) and len(self.members) != was_active:
+            print(f"[REGISTRO] Servidor {server_name} voltou a enviar heartbeats")
+            self.membership_changed()
         
         return {
             "service": "heartbeat",
@@ -145,6 +140,17 @@ class ReferenceServer:
             }
         }
     
+    def handle_profile(self, data):
+        """Liga/desliga o perfilamento e o amostrador de pilhas em execução"""
+        self.update_clock(data.get("clock", 0))
+        try:
+            response = {"status": "OK", **self.profiler.control(data)}
+        except (ValueError, OSError) as e:
+            response = {"status": "erro", "description": str(e)}
+        response["timestamp"] = datetime.now().isoformat()
+        response["clock"] = self.logical_clock
+        return {"service": "profile", "data": response}
+    
     def run(self):
         context = zmq.Context()
         
@@ -154,7 +160,7 @@ class ReferenceServer:
         
         # Socket PUB para notificações de coordenador
         self.pub_socket = context.socket(zmq.PUB)
-        self.pub_socket.connect("tcp://proxy:5557")
+        self.pub_socket.connect(PROXY_CONTROL_PUB)
         
         # Aguarda um pouco para conexão estabelecer
         time.sleep(1)
@@ -162,17 +168,24 @@ class ReferenceServer:
         print("Servidor de referência iniciado na porta 5559")
         print("Conectado ao proxy para publicação de eleições")
         
-        # Inicia thread de monitoramento de coordenador
-        monitor_thread = threading.Thread(target=self.monitor_coordinator, daemon=True)
-        monitor_thread.start()
+        # Sem thread de monitoramento: o poll acorda no próximo prazo de heartbeat
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
         
         while True:
             try:
+                ready = poller.poll(self.poll_timeout())
+                self.check_deadlines()
+                if not ready:
+                    continue
                 message_bytes = socket.recv()
+                start = time.perf_counter()
                 message = msgpack.unpackb(message_bytes, raw=False)
+                decoded = time.perf_counter()
                 
                 service = message.get("service")
                 data = message.get("data", {})
+                trace = self.profiler.begin(service)
                 
                 print(f"[Clock={self.logical_clock}] Recebido: {service}")
                 
@@ -182,6 +195,8 @@ class ReferenceServer:
                     response = self.handle_list(data)
                 elif service == "heartbeat":
                     response = self.handle_heartbeat(data)
+                elif service == "profile":
+                    response = self.handle_profile(data)
                 else:
                     self.logical_clock += 1
                     response = {
@@ -194,7 +209,13 @@ class ReferenceServer:
                         }
                     }
                 
+                handled = time.perf_counter()
                 response_bytes = msgpack.packb(response)
+                if trace:
+                    trace.add("decode", decoded - start)
+                    trace.add("handler", handled - decoded)
+                    trace.add("encode", time.perf_counter() - handled)
+                    self.profiler.end(trace)
                 socket.send(response_bytes)
                 print(f"[Clock={self.logical_clock}] Respondido: {service}")
                 
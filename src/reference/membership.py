@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Membros do cluster: prazos de heartbeat em um heap e índice ordenado de ranks
+
+Cada servidor ativo tem uma entrada (prazo, nome) no heap. Um heartbeat só
+atualiza o prazo no registro do servidor; quando a entrada antiga chega ao topo,
+ela é recolocada com o prazo novo ou, se o prazo de fato venceu, o servidor sai do
+índice de ativos. Assim heartbeats custam O(1), expirações O(log n) e o laço
+principal sabe exatamente quando acordar (next_deadline), sem varrer a lista.
+
+Os ativos ficam em uma lista ordenada por rank: o coordenador é o primeiro
+elemento e a resposta do serviço "list" é reconstruída só quando os membros mudam.
+"""
+import heapq
+import os
+import time
+from bisect import bisect_left, insort
+
+HEARTBEAT_TIMEOUT = float(os.environ.get("HEARTBEAT_TIMEOUT", 6.0))  # segundos sem heartbeat até a falha
+
+
+class Membership:
+    """Registro, heartbeats e expiração dos servidores"""
+
+    def __init__(self, timeout=HEARTBEAT_TIMEOUT, clock=time.monotonic):
+        self.timeout = timeout
+        self.clock = clock
+        self.servers = {}    # {nome: {"rank", "address", "deadline", "last_heartbeat", "active"}}
+        self.next_rank = 0
+        self.deadlines = []  # heap de (prazo, nome), uma entrada por servidor ativo
+        self.ranks = []      # [(rank, nome)] dos ativos, ordenada
+        self.listing = None  # resposta do "list" em cache (None: reconstruir)
+
+    def __len__(self):
+        return len(self.ranks)
+
+    def register(self, name, address=None):
+        """Registra (ou renova) um servidor; retorna (rank, novo)"""
+        info = self.servers.get(name)
+        is_new = info is None
+        if is_new:
+            info = self.servers[name] = {"rank": self.next_rank, "address": None, "active": False}
+            self.next_rank += 1
+        if address and address != info["address"]:
+            info["address"] = address
+            self.listing = None
+        self.heartbeat(name)
+        return info["rank"], is_new
+
+    def heartbeat(self, name):
+        """Renova o prazo de um servidor; retorna False se ele não está registrado"""
+        info = self.servers.get(name)
+        if info is None:
+            return False
+        now = self.clock()
+        info["deadline"] = now + self.timeout
+        info["last_heartbeat"] = time.time()
+        if not info["active"]:
+            # Volta ao índice (registro novo ou servidor que havia expirado)
+            info["active"] = True
+            insort(self.ranks, (info["rank"], name))
+            heapq.heappush(self.deadlines, (info["deadline"], name))
+            self.listing = None
+        return True
+
+    def expire(self):
+        """Retira os servidores com prazo vencido; retorna [(nome, segundos sem heartbeat)]"""
+        now = self.clock()
+        expired = []
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, name = heapq.heappop(self.deadlines)
+            info = self.servers[name]
+            if info["deadline"] > deadline:
+                # Recebeu heartbeat depois que a entrada foi criada
+                heapq.heappush(self.deadlines, (info["deadline"], name))
+                continue
+            info["active"] = False
+            del self.ranks[bisect_left(self.ranks, (info["rank"], name))]
+            self.listing = None
+            expired.append((name, now - deadline + self.timeout))
+        return expired
+
+    def next_deadline(self):
+        """Instante (no relógio monotônico) da próxima expiração possível, ou None"""
+        return self.deadlines[0][0] if self.deadlines else None
+
+    def coordinator(self):
+        """Servidor ativo de menor rank"""
+        return self.ranks[0][1] if self.ranks else None
+
+    def rank(self, name):
+        return self.servers[name]["rank"]
+
+    def active_list(self):
+        """Servidores ativos em ordem de rank, no formato da resposta do serviço list"""
+        if self.listing is None:
+            self.listing = [
+                {"name": name, "rank": rank, "address": self.servers[name]["address"]}
+                for rank, name in self.ranks
+            ]
+        return self.listing
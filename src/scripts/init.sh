@@ -59,18 +59,13 @@ case "$1" in
     docker-compose ps
     ;;
     
-  scale-servers)
-    echo "Escalando servidores para $2 réplicas..."
-    docker-compose up -d --scale server=$2
-    ;;
-    
   scale-bots)
     echo "Escalando bots para $2 réplicas..."
     docker-compose up -d --scale bot=$2
     ;;
     
   *)
-    echo "Uso: $0 {start|stop|restart|build|logs|client|clean|status|scale-servers N|scale-bots N}"
+    echo "Uso: $0 {start|stop|restart|build|logs|client|clean|status|scale-bots N}"
     echo ""
     echo "Comandos:"
     echo "  start           - Inicia o sistema"
@@ -81,7 +76,6 @@ case "$1" in
     echo "  client          - Conecta um cliente interativo"
     echo "  clean           - Remove todos os containers e dados"
     echo "  status          - Mostra status dos containers"
-    echo "  scale-servers N - Escala servidores para N réplicas"
     echo "  scale-bots N    - Escala bots para N réplicas"
     exit 1
     ;;
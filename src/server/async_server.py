@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""Runtime alternativo do servidor baseado em asyncio e zmq.asyncio
+
+Selecionado com `python main.py --asyncio` ou SERVER_RUNTIME=asyncio. Requisições,
+replicação, heartbeats e persistência em segundo plano rodam como corrotinas
+independentes; mutações de estado são executadas em uma única thread dona do
+estado, para que o loop de eventos nunca bloqueie em disco.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import msgpack
+import zmq
+import zmq.asyncio
+
+from main import (
+    Server,
+    BROKER_BACKEND,
+    BROKER_MODE,
+    PPP_READY,
+    PPP_HEARTBEAT,
+    HEARTBEAT_INTERVAL,
+    HEARTBEAT_LIVENESS,
+    RECONNECT_INTERVAL,
+    REFERENCE_ADDR,
+    REFERENCE_HEARTBEAT_INTERVAL,
+    PEER_SERVICES,
+    is_write_request,
+)
+from sync import PEER_PORT, SYNC_CHECK_INTERVAL
+from fabric import Publisher, control_subscriber
+from metrics import METRICS_PORT
+import wire
+
+REFERENCE_TIMEOUT = 5.0
+SNAPSHOT_CHECK_INTERVAL = 1.0
+# Requisições simultâneas anunciadas ao broker no modo lb
+ASYNC_CAPACITY = int(os.environ.get("ASYNC_CAPACITY", 64))
+
+
+class AsyncServer(Server):
+    """Servidor que atende várias requisições simultâneas em um loop asyncio"""
+
+    def __init__(self, server_name=None):
+        super().__init__(server_name)
+        self.context = None
+        self.owner = None
+        self.owner_pub_socket = None
+        self.frontend = None
+        self.tasks = set()
+
+    def init_owner(self):
+        """Cria o socket PUB usado exclusivamente pela thread dona do estado"""
+        self.owner_pub_socket = Publisher(zmq.Context.instance())
+
+    def process_owned(self, message, decode_seconds=0.0):
+        return self.process_request(message, self.owner_pub_socket, decode_seconds)
+
+    def on_owner(self, function, *args):
+        """Executa function no executor dono do estado (chamado pelas threads de sincronização)"""
+        return self.owner.submit(function, *args).result()
+
+    def process_peer_request(self, message):
+        return self.process_request(message, peer=True)
+
+    async def run_owned(self, function, *args):
+        """Executa uma mutação na thread dona do estado sem bloquear o loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.owner, function, *args)
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def reference_request(self, ref_socket, message):
+        """Envia uma requisição ao servidor de referência com timeout"""
+        start = time.perf_counter()
+        await ref_socket.send(msgpack.packb(message))
+        response_bytes = await asyncio.wait_for(ref_socket.recv(), REFERENCE_TIMEOUT)
+        self.profiler.observe(f"referência ({message['service']})", time.perf_counter() - start)
+        return msgpack.unpackb(response_bytes, raw=False)
+
+    def reference_socket(self):
+        ref_socket = self.context.socket(zmq.REQ)
+        ref_socket.setsockopt(zmq.LINGER, 0)
+        ref_socket.connect(REFERENCE_ADDR)
+        return ref_socket
+
+    async def register(self):
+        """Registra o servidor e obtém a lista de servidores"""
+        ref_socket = self.reference_socket()
+        try:
+            self.apply_rank(await self.reference_request(
+                ref_socket, self.reference_message("rank", user=self.server_name, address=self.peer_address)))
+            self.apply_servers_list(await self.reference_request(
+                ref_socket, self.reference_message("list")))
+        except Exception as e:
+            self.log.error(f"Erro ao registrar no servidor de referência: {e}")
+        finally:
+            ref_socket.close()
+
+    async def heartbeats(self):
+        """Envia heartbeats periódicos sem compartilhar socket com outras tarefas"""
+        ref_socket = self.reference_socket()
+        while True:
+            await asyncio.sleep(REFERENCE_HEARTBEAT_INTERVAL)
+            try:
+                response = await self.reference_request(
+                    ref_socket, self.reference_message("heartbeat", user=self.server_name))
+                self.update_clock(response["data"].get("clock", 0))
+                # Mantém a lista de pares usada na sincronização atualizada
+                self.apply_servers_list(await self.reference_request(
+                    ref_socket, self.reference_message("list")))
+            except Exception as e:
+                self.log.error(f"Erro ao enviar heartbeat: {e}")
+                # REQ fica inconsistente após timeout; recria o socket
+                ref_socket.close()
+                ref_socket = self.reference_socket()
+
+    async def handle_frames(self, frames):
+        """Trata uma requisição recebida pelo ROUTER e responde com o mesmo envelope"""
+        delimiter = frames.index(b"")
+        envelope, message_bytes = frames[:delimiter + 1], frames[-1]
+        message = None
+        try:
+            start = time.perf_counter()
+            message = msgpack.unpackb(message_bytes, raw=False)
+            decode_seconds = time.perf_counter() - start
+            if is_write_request(message):
+                start = time.perf_counter()
+                self.metrics.add("owner_queue_depth", 1)
+                try:
+                    response_bytes = await self.run_owned(self.process_owned, message, decode_seconds)
+                finally:
+                    self.metrics.add("owner_queue_depth", -1)
+                self.metrics.observe("owner_wait_seconds", wire.request_service(message), time.perf_counter() - start)
+            else:
+                # Leituras leem os logs em disco e, com sharding, podem ser encaminhadas ao
+                # dono da chave: rodam no executor padrão para não bloquear o loop
+                loop = asyncio.get_running_loop()
+                response_bytes = await loop.run_in_executor(None, self.process_request, message, None, decode_seconds)
+        except Exception as e:
+            # Sempre responde: o cliente REQ ficaria bloqueado e o broker não liberaria o in_flight
+            self.log.error(f"Erro: {e}", key="request_error")
+            response_bytes = self.error_response(message, e)
+        # Usa o socket atual: pode ter sido recriado durante o processamento
+        await self.frontend.send_multipart(envelope + [response_bytes])
+
+    async def connect_frontend(self):
+        if BROKER_MODE == "proxy":
+            self.frontend = self.context.socket(zmq.ROUTER)
+            self.frontend.connect(BROKER_BACKEND)
+            return
+        self.frontend = self.context.socket(zmq.DEALER)
+        self.frontend.setsockopt(zmq.LINGER, 0)
+        self.frontend.connect(BROKER_BACKEND)
+        await self.frontend.send_multipart([PPP_READY, str(ASYNC_CAPACITY).encode()])
+
+    async def serve_requests(self):
+        """Recebe requisições do broker e as trata concorrentemente"""
+        await self.connect_frontend()
+        last_seen = time.monotonic()
+        heartbeat_at = last_seen + HEARTBEAT_INTERVAL
+        while True:
+            try:
+                frames = await asyncio.wait_for(self.frontend.recv_multipart(), HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                frames = None
+            now = time.monotonic()
+
+            if frames is not None:
+                last_seen = now
+                # Heartbeats do broker não têm delimitador; requisições têm
+                if b"" in frames:
+                    self.spawn(self.handle_frames(frames))
+
+            if BROKER_MODE == "proxy":
+                continue
+
+            if now >= heartbeat_at:
+                await self.frontend.send(PPP_HEARTBEAT)
+                heartbeat_at = now + HEARTBEAT_INTERVAL
+
+            if now - last_seen > HEARTBEAT_INTERVAL * HEARTBEAT_LIVENESS:
+                self.log.warning("Broker sem resposta, reconectando...")
+                self.frontend.close()
+                await asyncio.sleep(RECONNECT_INTERVAL)
+                await self.connect_frontend()
+                last_seen = time.monotonic()
+
+    async def consume_subscriptions(self):
+        """Recebe notificações de coordenador e replicação do proxy"""
+        sub_socket = control_subscriber(self.context)
+        while True:
+            frames = await sub_socket.recv_multipart()
+            try:
+                await self.run_owned(self.handle_subscription, frames)
+            except Exception as e:
+                self.log.error(f"Erro na replicação: {e}")
+
+    async def replication_flusher(self):
+        """Publica lotes de replicação pendentes quando o tempo limite expira"""
+        while True:
+            await asyncio.sleep(self.replication.max_seconds)
+            try:
+                await self.run_owned(self.flush_replication, self.owner_pub_socket)
+                if self.ordering.queues:
+                    await self.run_owned(self.release_ordered)
+            except Exception as e:
+                self.log.error(f"Erro ao publicar replicação: {e}")
+
+    async def serve_peers(self):
+        """Atende requisições de sincronização de outras réplicas"""
+        loop = asyncio.get_running_loop()
+        socket = self.context.socket(zmq.REP)
+        socket.bind(f"tcp://*:{PEER_PORT}")
+        while True:
+            message_bytes = await socket.recv()
+            message = None
+            try:
+                message = msgpack.unpackb(message_bytes, raw=False)
+                if not isinstance(message, dict) or message.get("service") not in PEER_SERVICES:
+                    raise ValueError("Serviço não atendido na porta de pares")
+                # Leitura dos logs fora do loop de eventos
+                response_bytes = await loop.run_in_executor(None, self.process_peer_request, message)
+            except Exception as e:
+                self.log.error(f"Erro na sincronização: {e}")
+                response_bytes = self.peer_error(message, e)
+            # O REP sempre responde, senão deixa de receber
+            await socket.send(response_bytes)
+
+    async def anti_entropy(self):
+        """Sincroniza origens com lacunas e faz a anti-entropia periódica
+
+        As requisições aos pares rodam no executor padrão; o estado só é tocado em on_owner().
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(SYNC_CHECK_INTERVAL)
+            try:
+                await loop.run_in_executor(None, self.maybe_sync, zmq.Context.instance())
+            except Exception as e:
+                self.log.error(f"Erro na sincronização: {e}")
+
+    async def background_persistence(self):
+        """Verifica periodicamente se é hora de gravar um snapshot"""
+        while True:
+            await asyncio.sleep(SNAPSHOT_CHECK_INTERVAL)
+            try:
+                await self.run_owned(self.maybe_snapshot)
+                await self.run_owned(self.maybe_compact)
+            except Exception as e:
+                self.log.error(f"Erro ao gravar snapshot: {e}")
+
+    async def main(self):
+        self.context = zmq.asyncio.Context()
+        self.owner = ThreadPoolExecutor(max_workers=1, initializer=self.init_owner)
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.load_state)
+        if METRICS_PORT:
+            self.metrics.serve_http(METRICS_PORT)
+        await self.register()
+        await loop.run_in_executor(None, self.catch_up, zmq.Context.instance())
+        self.compactor.start()
+
+        self.log.info(f"Servidor {self.server_name} (rank={self.rank}, asyncio) iniciado, Clock: {self.logical_clock}")
+
+        await asyncio.gather(
+            self.serve_requests(),
+            self.consume_subscriptions(),
+            self.heartbeats(),
+            self.replication_flusher(),
+            self.serve_peers(),
+            self.anti_entropy(),
+            self.background_persistence(),
+        )
+
+    def run(self):
+        asyncio.run(self.main())
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Cache versionado das respostas dos serviços de listagem (users e channels)
+
+Bots consultam essas listas o tempo todo e, em uma instalação grande, cada resposta
+serializa dezenas de milhares de nomes. As listas só crescem (usuários e canais não
+são removidos) e mantêm a ordem de inserção, então cada uma guarda:
+
+- a versão: quantidade de itens e um digest da soma dos hashes dos nomes. O digest não
+  depende da ordem, logo duas réplicas com o mesmo conteúdo têm a mesma versão e
+  `if_version` funciona qualquer que seja o servidor que atende;
+- a lista já codificada em msgpack, refeita no máximo uma vez por versão, e as páginas
+  completas (que nunca mudam, pois os itens novos entram no fim);
+- uma época por processo: com `since` da mesma época e do mesmo servidor, a resposta traz
+  só os itens adicionados depois daquela versão (delta); senão, a lista inteira.
+
+Mutações locais e replicadas chamam add(); a carga do estado chama reset().
+"""
+import hashlib
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+import msgpack
+
+from wire import Prepacked
+
+RESPONSE_PAGE_LIMIT = int(os.environ.get("RESPONSE_PAGE_LIMIT", 10000))  # itens por página
+RESPONSE_CACHE_PAGES = int(os.environ.get("RESPONSE_CACHE_PAGES", 64))   # páginas codificadas em cache
+DIGEST_MASK = (1 << 64) - 1
+
+
+def item_hash(item):
+    return int.from_bytes(hashlib.blake2b(str(item).encode(), digest_size=8).digest(), "big")
+
+
+class CachedList:
+    """Lista append-only de nomes com versão e codificações em cache"""
+
+    def __init__(self, name, epoch, page_cache=RESPONSE_CACHE_PAGES):
+        self.name = name
+        self.epoch = epoch
+        self.items = []
+        self.digest = 0
+        self.packed = None  # (quantidade, bytes) da lista inteira
+        self.pages = OrderedDict()  # {(início, fim): bytes} de páginas completas
+        self.page_cache = page_cache
+        self.lock = threading.Lock()
+        self.hits = 0    # respostas servidas de uma codificação em cache
+        self.builds = 0  # codificações refeitas
+
+    def reset(self, items):
+        items = list(items)
+        digest = 0
+        for item in items:
+            digest = (digest + item_hash(item)) & DIGEST_MASK
+        with self.lock:
+            self.items, self.digest = items, digest
+            self.packed = None
+            self.pages.clear()
+
+    def add(self, item):
+        """Novo item: muda a versão e invalida a lista codificada (as páginas completas continuam válidas)"""
+        with self.lock:
+            self.items.append(item)
+            self.digest = (self.digest + item_hash(item)) & DIGEST_MASK
+            self.packed = None
+
+    def version(self):
+        with self.lock:
+            return f"{self.epoch}:{len(self.items)}:{self.digest:016x}"
+
+    def encoded(self, start, end):
+        """Itens [start:end] codificados, do cache quando possível"""
+        with self.lock:
+            count = len(self.items)
+            if start == 0 and end >= count:
+                if self.packed is not None and self.packed[0] == count:
+                    self.hits += 1
+                    return Prepacked(self.packed[1], self.items[:count])
+                items = self.items[:count]
+                key = None
+            else:
+                end = min(end, count)
+                items = self.items[start:end]
+                key = (start, end)
+                data = self.pages.get(key)
+                if data is not None:
+                    self.pages.move_to_end(key)
+                    self.hits += 1
+                    return Prepacked(data, items)
+        data = msgpack.packb(items)
+        with self.lock:
+            self.builds += 1
+            if key is None:
+                if len(self.items) == len(items):
+                    self.packed = (len(items), data)
+            elif len(items) == key[1] - key[0]:
+                self.pages[key] = data
+                if len(self.pages) > self.page_cache:
+                    self.pages.popitem(last=False)
+        return Prepacked(data, items)
+
+    def view(self, data):
+        """Campos da resposta conforme if_version, since, offset e limit da requisição"""
+        version = self.version()
+        epoch, count, digest = version.split(":")
+        count = int(count)
+
+        requested = data.get("if_version")
+        if isinstance(requested, str) and requested.split(":")[1:] == [str(count), digest]:
+            return {self.name: None, "version": version, "not_modified": True}
+
+        since = data.get("since")
+        if isinstance(since, str) and since.count(":") == 2:
+            since_epoch, since_count, _ = since.split(":")
+            if since_epoch == epoch and since_count.isdigit() and int(since_count) <= count:
+                return {self.name: self.encoded(int(since_count), count), "version": version, "delta": True}
+
+        offset = data.get("offset")
+        limit = data.get("limit")
+        if offset is None and limit is None:
+            return {self.name: self.encoded(0, count), "version": version}
+        offset = max(0, int(offset or 0))
+        limit = max(1, min(int(limit or RESPONSE_PAGE_LIMIT), RESPONSE_PAGE_LIMIT))
+        end = offset + limit
+        return {self.name: self.encoded(offset, end), "version": version,
+                "next": end if end < count else None}
+
+
+class ResponseCache:
+    """Listas em cache do servidor: {"users", "channels"}"""
+
+    def __init__(self, server_name):
+        # Época: identifica a ordem dos itens deste processo (deltas só valem na mesma época)
+        epoch = f"{server_name}-{uuid.uuid4().hex[:8]}".replace(":", "_")
+        self.lists = {name: CachedList(name, epoch) for name in ("users", "channels")}
+        self.not_modified = 0
+
+    def reset(self, name, items):
+        self.lists[name].reset(items)
+
+    def add(self, name, item):
+        self.lists[name].add(item)
+
+    def view(self, name, data):
+        response = self.lists[name].view(data)
+        if response.get("not_modified"):
+            self.not_modified += 1
+        return response
+
+    def metrics(self):
+        return {
+            "not_modified": self.not_modified,
+            **{name: {"version": cached.version(), "hits": cached.hits, "builds": cached.builds,
+                      "pages": len(cached.pages)} for name, cached in self.lists.items()},
+        }
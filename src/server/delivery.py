@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Filas de entrega das mensagens privadas com confirmação (serviços fetch/ack)
+
+A fila de um usuário é a sua caixa de entrada depois da marca d'água confirmada
+(high-water mark, um cursor [clock, timestamp, origem, seq] como os do histórico). As
+mensagens já estão no log de mensagens e as posições no índice da caixa de
+entrada, então a fila não duplica dados: `fetch` devolve um lote a partir da marca
+e `ack` a avança. O servidor grava cada nova marca no log acks/ com origem e seq, como
+as demais mutações (ver Server.save_ack), e a replica, para que a próxima busca em
+qualquer servidor continue do mesmo ponto.
+
+As mensagens recentes dos usuários ativos ficam também em memória (no máximo
+DELIVERY_QUEUE_MEMORY por usuário, para DELIVERY_HOT_USERS usuários, os demais
+são descartados do cache pelo menos recente). Usuários frios, ou que ficaram mais
+atrasados que o cache, são atendidos lendo do disco pelas posições do índice.
+"""
+import os
+import threading
+from collections import OrderedDict, deque
+
+from history import cursor_key, record_key, unpack_pointer
+
+DELIVERY_QUEUE_MEMORY = int(os.environ.get("DELIVERY_QUEUE_MEMORY", 256))  # mensagens em memória por usuário
+DELIVERY_HOT_USERS = int(os.environ.get("DELIVERY_HOT_USERS", 1024))       # filas mantidas em memória
+DELIVERY_FETCH_LIMIT = int(os.environ.get("DELIVERY_FETCH_LIMIT", 500))    # mensagens por fetch
+
+
+class DeliveryQueues:
+    """Marcas de confirmação por usuário e cache das mensagens recentes"""
+
+    def __init__(self, index, read, queue_memory=DELIVERY_QUEUE_MEMORY,
+                 hot_users=DELIVERY_HOT_USERS):
+        self.index = index  # HistoryIndex da caixa de entrada
+        self.read = read    # posição -> registro da mensagem
+        self.queue_memory = queue_memory
+        self.hot_users = hot_users
+        self.acks = {}      # {usuário: chave (history_key) da última mensagem confirmada}
+        self.buffers = OrderedDict()  # {usuário: deque de (chave, registro)}, do menos ao mais recente
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_reads = 0
+
+    def advance(self, user, cursor):
+        """Avança a marca de um usuário; retorna False se ela já estava adiante"""
+        cursor = cursor_key(cursor)
+        current = self.acks.get(user)
+        if current is not None and cursor <= current:
+            return False
+        self.acks[user] = cursor
+        return True
+
+    def cursor(self, user):
+        current = self.acks.get(user)
+        return list(current) if current is not None else None
+
+    def push(self, user, record):
+        """Guarda uma mensagem recém-indexada no cache do destinatário"""
+        if self.queue_memory <= 0:
+            return
+        key = record_key(record)
+        with self.lock:
+            buffer = self.buffers.get(user)
+            if buffer is None:
+                buffer = self.buffers[user] = deque(maxlen=self.queue_memory)
+                if len(self.buffers) > self.hot_users:
+                    self.buffers.popitem(last=False)
+            else:
+                self.buffers.move_to_end(user)
+                if buffer and key < buffer[-1][0]:
+                    # Chegou fora de ordem (replicação): o disco atende até o cache se refazer
+                    buffer.clear()
+            buffer.append((key, record))
+
+    def fetch(self, user, limit=DELIVERY_FETCH_LIMIT, after=None):
+        """Retorna (mensagens, cursor da última, quantas ainda restam) depois da marca (ou de `after`)"""
+        limit = max(1, min(int(limit), DELIVERY_FETCH_LIMIT))
+        start = cursor_key(after) if after else self.acks.get(user)
+        keys, pointers, pending = self.index.after(user, start, limit)
+        if not keys:
+            if not self.index.count(user):
+                return [], self.cursor(user), 0
+            return [], list(start) if start is not None else None, 0
+
+        records = self.from_memory(user, keys[0], len(keys))
+        if records is None:
+            records = [record for record in (self.read(unpack_pointer(p)) for p in pointers)
+                       if record is not None]
+            self.disk_reads += 1
+        else:
+            self.memory_hits += 1
+        return records, list(keys[-1]), pending
+
+    def from_memory(self, user, first, count):
+        """Mensagens a partir da chave `first` se o cache cobre todo o trecho; senão None"""
+        with self.lock:
+            buffer = self.buffers.get(user)
+            if not buffer or buffer[0][0] > first:
+                return None
+            records = []
+            for key, record in buffer:
+                if key >= first:
+                    records.append(record)
+                    if len(records) == count:
+                        break
+        return records if len(records) == count else None
+
+    def metrics(self):
+        return {
+            "users_acked": len(self.acks),
+            "hot_users": len(self.buffers),
+            "buffered_messages": sum(len(buffer) for buffer in list(self.buffers.values())),
+            "memory_hits": self.memory_hits,
+            "disk_reads": self.disk_reads,
+        }
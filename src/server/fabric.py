@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Publicação no proxy Pub/Sub: tópicos de chat por shard e plano de controle separado"""
+import os
+import zlib
+
+import zmq
+
+PROXY_PUB = os.environ.get("PROXY_PUB", "tcp://proxy:5557")
+# Replicação e eleição trafegam em um proxy dedicado, sem disputar com o chat
+PROXY_CONTROL_PUB = os.environ.get("PROXY_CONTROL_PUB", "tcp://proxy:5561")
+PROXY_CONTROL_SUB = os.environ.get("PROXY_CONTROL_SUB", "tcp://proxy:5562")
+# 0: proxy único em PROXY_PUB; N: shards em PROXY_SHARD_HOST:BASE + 2i (deve coincidir com o proxy)
+PROXY_SHARDS = int(os.environ.get("PROXY_SHARDS", 0))
+PROXY_SHARD_HOST = os.environ.get("PROXY_SHARD_HOST", "tcp://proxy")
+PROXY_SHARD_BASE_PORT = int(os.environ.get("PROXY_SHARD_BASE_PORT", 5570))
+
+CONTROL_TOPICS = {b"replication", b"servers"}
+
+
+def topic_shard(topic, shards):
+    """Shard de um tópico (deve coincidir com proxy/main.py e com os clientes)"""
+    return zlib.crc32(topic) % shards
+
+
+class Publisher:
+    """Substitui o socket PUB: cada mensagem vai para o shard do seu tópico ou para o plano de controle"""
+
+    def __init__(self, context):
+        self.control = context.socket(zmq.PUB)
+        self.control.connect(PROXY_CONTROL_PUB)
+        self.shards = []
+        if PROXY_SHARDS > 0:
+            for shard in range(PROXY_SHARDS):
+                socket = context.socket(zmq.PUB)
+                socket.connect(f"{PROXY_SHARD_HOST}:{PROXY_SHARD_BASE_PORT + 2 * shard}")
+                self.shards.append(socket)
+        else:
+            socket = context.socket(zmq.PUB)
+            socket.connect(PROXY_PUB)
+            self.shards.append(socket)
+
+    def send_multipart(self, frames, copy=True):
+        topic = frames[0]
+        if topic in CONTROL_TOPICS:
+            self.control.send_multipart(frames, copy=copy)
+        else:
+            self.shards[topic_shard(topic, len(self.shards))].send_multipart(frames, copy=copy)
+
+
+def control_subscriber(context):
+    """Socket SUB do servidor: apenas eleição e replicação, no plano de controle"""
+    socket = context.socket(zmq.SUB)
+    socket.connect(PROXY_CONTROL_SUB)
+    socket.subscribe("servers")
+    socket.subscribe("replication")
+    return socket
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Índices em memória do histórico de publicações e mensagens privadas"""
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+from storage import RecordPointer
+import wire
+
+MAX_HISTORY_LIMIT = 1000
+OFFSET_BITS = 40
+
+
+def pack_pointer(pointer):
+    """Compacta uma RecordPointer em um inteiro de 64 bits"""
+    return (pointer.segment << OFFSET_BITS) | pointer.offset
+
+
+def unpack_pointer(value):
+    return RecordPointer(value >> OFFSET_BITS, value & ((1 << OFFSET_BITS) - 1))
+
+
+def timestamp_key(timestamp):
+    """Timestamp do cliente como texto: ISO ou número (segundos/µs) viram ISO, para que a
+    chave compare sempre valores do mesmo tipo"""
+    if isinstance(timestamp, str):
+        return timestamp
+    if timestamp is None:
+        return ""
+    if isinstance(timestamp, (int, float)):
+        try:
+            return wire.to_iso(wire.to_micros(timestamp))
+        except (OverflowError, OSError, ValueError):
+            pass
+    return str(timestamp)
+
+
+def history_key(clock, timestamp, origin=None, seq=None):
+    """Chave de ordenação de um registro: relógio lógico, timestamp e, no empate, (origem, seq)
+
+    (origem, seq) identifica a mutação e é igual em todas as réplicas, então dois registros
+    numerados nunca têm a mesma chave e um cursor vale em qualquer servidor.
+    """
+    return (clock or 0, timestamp_key(timestamp), origin or "", seq or 0)
+
+
+def record_key(record):
+    return history_key(record.get("clock"), record.get("timestamp"), record.get("origin"), record.get("seq"))
+
+
+def cursor_key(cursor):
+    """Chave de um cursor recebido; cursores antigos [clock, timestamp] valem como prefixo
+    (com `after`, os registros com o mesmo prefixo voltam na próxima página, nenhum é pulado)"""
+    if len(cursor) == 2:
+        return (cursor[0] or 0, timestamp_key(cursor[1]))
+    return history_key(*cursor)
+
+
+def valid_cursor(cursor):
+    """[clock, timestamp] ou [clock, timestamp, origem, seq] com tipos comparáveis às chaves"""
+    if not isinstance(cursor, (list, tuple)) or len(cursor) not in (2, 4):
+        return False
+    if cursor[0] is not None and not isinstance(cursor[0], int):
+        return False
+    if len(cursor) == 4:
+        origin, seq = cursor[2], cursor[3]
+        if origin is not None and not isinstance(origin, str):
+            return False
+        if seq is not None and not isinstance(seq, int):
+            return False
+    return True
+
+
+class HistoryIndex:
+    """Mapeia cada chave (canal ou destinatário) para as posições de seus registros no log
+
+    Só a thread dona do estado altera o índice, mas workers, a entrega e a compactação o
+    leem em paralelo: keys e pointers de uma chave mudam juntos sob `lock`, e quem lê as
+    duas listas (page, after, all, locked) também o segura.
+    """
+
+    def __init__(self):
+        self.keys = {}      # {chave: [(clock, timestamp, origem, seq), ...]} ordenado
+        self.pointers = {}  # {chave: array('Q') de posições compactadas} paralelo a keys
+        self.lock = threading.Lock()
+
+    def add(self, name, key, pointer):
+        """Indexa um registro mantendo a ordem pela chave (ver history_key)"""
+        packed = pack_pointer(pointer)
+        with self.lock:
+            keys = self.keys.setdefault(name, [])
+            pointers = self.pointers.get(name)
+            if pointers is None:
+                pointers = self.pointers[name] = array("Q")
+            if not keys or key >= keys[-1]:
+                keys.append(key)
+                pointers.append(packed)
+            else:
+                # Registro replicado fora de ordem
+                position = bisect_right(keys, key)
+                keys.insert(position, key)
+                pointers.insert(position, packed)
+
+    def trim(self, name, count):
+        """Descarta os `count` registros mais antigos da chave (política de retenção)"""
+        with self.lock:
+            keys = self.keys.get(name)
+            if not keys or count <= 0:
+                return 0
+            count = min(count, len(keys))
+            if count == len(keys):
+                del self.keys[name]
+                del self.pointers[name]
+            else:
+                del keys[:count]
+                del self.pointers[name][:count]
+            return count
+
+    def locked(self, name):
+        """(chaves, posições) da chave para leitura com `lock` já adquirido"""
+        return self.keys.get(name, ()), self.pointers.get(name, ())
+
+    def count(self, name):
+        return len(self.keys.get(name, ()))
+
+    def page(self, name, limit=100, before=None, after=None):
+        """Retorna (posições, próximo cursor) dos registros mais recentes no intervalo
+
+        before/after são cursores [clock, timestamp, origem, seq] exclusivos. O próximo
+        cursor aponta para o registro mais antigo retornado, ou None se não há mais páginas.
+        """
+        limit = max(1, min(int(limit), MAX_HISTORY_LIMIT))
+        before = cursor_key(before) if before else None
+        after = cursor_key(after) if after else None
+        with self.lock:
+            keys = self.keys.get(name)
+            if not keys:
+                return [], None
+            hi = bisect_left(keys, before) if before else len(keys)
+            lo = bisect_right(keys, after) if after else 0
+            start = max(lo, hi - limit)
+            cursor = list(keys[start]) if start > lo else None
+            pointers = self.pointers[name][start:hi]
+        return [unpack_pointer(p) for p in pointers], cursor
+
+    def after(self, name, start, limit):
+        """(chaves, posições, quantos restam) de até `limit` registros depois da chave `start`"""
+        with self.lock:
+            keys = self.keys.get(name)
+            if not keys:
+                return [], [], 0
+            lo = bisect_right(keys, start) if start is not None else 0
+            hi = min(len(keys), lo + limit)
+            return keys[lo:hi], self.pointers[name][lo:hi], len(keys) - hi
+
+    def all(self, name):
+        """Posições de todos os registros da chave, do mais antigo ao mais recente"""
+        with self.lock:
+            pointers = self.pointers.get(name, array("Q"))[:]
+        return [unpack_pointer(p) for p in pointers]
+
+    def export(self):
+        """Serializa o índice de forma compacta para snapshots (na thread dona, sem `lock`)"""
+        return [
+            [
+                name,
+                array("q", [k[0] for k in keys]).tobytes(),
+                [k[1] for k in keys],
+                [k[2] for k in keys],
+                array("Q", [k[3] for k in keys]).tobytes(),
+                self.pointers[name].tobytes(),
+            ]
+            for name, keys in self.keys.items()
+        ]
+
+    def restore(self, exported):
+        """Reconstrói o índice a partir de export()"""
+        keys, pointers_by_name = {}, {}
+        for name, clocks, timestamps, origins, seqs, pointers in exported:
+            clock_array = array("q")
+            clock_array.frombytes(clocks)
+            seq_array = array("Q")
+            seq_array.frombytes(seqs)
+            # Snapshots antigos podem ter timestamps numéricos na chave
+            keys[name] = list(zip(clock_array, map(timestamp_key, timestamps), origins, seq_array))
+            pointer_array = array("Q")
+            pointer_array.frombytes(pointers)
+            pointers_by_name[name] = pointer_array
+        with self.lock:
+            self.keys, self.pointers = keys, pointers_by_name
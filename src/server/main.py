@@ -1,19 +1,98 @@
 #!/usr/bin/env python3
 import zmq
-import json
 import msgpack
 import os
+import sys
 import time
 import threading
+import queue
 import random
+import gc
 from datetime import datetime
+from socket import gethostbyname, gethostname
+
+# Módulos compartilhados (src/common): copiados para /app na imagem, procurados em ../common fora dela
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+from storage import Storage, GroupCommitWriter, migrate_legacy_json, import_shared_logs
+from history import HistoryIndex, record_key, valid_cursor
+from delivery import DeliveryQueues, DELIVERY_FETCH_LIMIT
+from state import OrderedSet, UserRecord, UserTable
+from snapshot import SnapshotManager
+from retention import Compactor
+from cache import ResponseCache
+from replication import ReplicationBatcher, decode_batch
+from ordering import CausalOrdering
+from sync import (
+    ReplicaLog,
+    record_hash,
+    PEER_PORT,
+    SYNC_TIMEOUT,
+    SYNC_INTERVAL,
+    SYNC_RETRY_INTERVAL,
+    SYNC_CHECK_INTERVAL,
+    SYNC_BATCH_OPERATIONS,
+    SYNC_MAX_BUCKETS,
+    RECORD_FIELDS,
+    OPERATIONS,
+    DUPLICATE,
+    GAP,
+)
+from sharding import HashRing, SHARDING
+from fabric import Publisher, control_subscriber
+from metrics import Metrics, Logger, METRICS_PORT
+from profiling import Profiler
+import wire
+
+# Diretório para persistência (cada réplica usa o subdiretório DATA_DIR/<nome do servidor>)
+DATA_DIR = os.environ.get("DATA_DIR", "/app/data")
+# Diretório do layout antigo, compartilhado entre réplicas, de onde os dados são importados
+SHARED_DATA_DIR = os.environ.get("SHARED_DATA_DIR", DATA_DIR)
+# Nome estável do servidor; padrão: server_<hostname> (o id do container no Docker)
+SERVER_NAME = os.environ.get("SERVER_NAME")
+
+BROKER_BACKEND = os.environ.get("BROKER_BACKEND", "tcp://broker:5556")
+REFERENCE_ADDR = os.environ.get("REFERENCE_ADDR", "tcp://reference:5559")
+# Intervalo dos heartbeats ao servidor de referência (que declara a falha após HEARTBEAT_TIMEOUT)
+REFERENCE_HEARTBEAT_INTERVAL = float(os.environ.get("REFERENCE_HEARTBEAT_INTERVAL", 2.0))
+# Endereço anunciado às outras réplicas para sincronização (padrão: IP do host + PEER_PORT)
+PEER_ADDRESS = os.environ.get("PEER_ADDRESS")
+SERVER_RUNTIME = os.environ.get("SERVER_RUNTIME", "threads")  # threads | asyncio
+
+# Protocolo com o broker no modo lb (deve coincidir com broker/main.py)
+BROKER_MODE = os.environ.get("BROKER_MODE", "lb")  # lb | proxy
+PPP_READY = b"\x01"
+PPP_HEARTBEAT = b"\x02"
+HEARTBEAT_INTERVAL = float(os.environ.get("BROKER_HEARTBEAT_INTERVAL", 1.0))
+HEARTBEAT_LIVENESS = int(os.environ.get("BROKER_HEARTBEAT_LIVENESS", 3))
+RECONNECT_INTERVAL = 1.0
+
+# Pool de workers: leituras são atendidas nos workers, mutações são
+# encaminhadas para a thread dona do estado (preserva ordem e relógio)
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", 4))
+WRITE_SERVICES = {"login", "channel", "publish", "message", "ack"}
+# Serviços conhecidos (rótulos das métricas; outros nomes contam como "desconhecido")
+SERVICES = WRITE_SERVICES | {"users", "channels", "history", "inbox", "fetch", "batch", "sync", "stats", "profile"}
+MAX_BATCH_OPERATIONS = int(os.environ.get("MAX_BATCH_OPERATIONS", 1000))
+# Serviços atendidos na porta de pares (sincronização e leituras encaminhadas no modo shard)
+PEER_SERVICES = {"sync", "history", "inbox", "fetch", "stats", "profile"}
+# Serviços de controle: só na porta de pares, nunca pelo broker
+CONTROL_SERVICES = {"sync", "stats", "profile"}
+
+
+def is_write_request(message):
+    """Indica se a requisição (ou alguma operação de um lote) altera o estado"""
+    service = wire.request_service(message)
+    if service == "batch":
+        operations = message.get("data", {}).get("operations") or []
+        return any(isinstance(op, dict) and op.get("service") in WRITE_SERVICES for op in operations)
+    return service in WRITE_SERVICES
+
+
+def optional_int(value):
+    """Campo numérico opcional da requisição: ausente ou inteiro (bool não conta)"""
+    return value is None or (isinstance(value, int) and not isinstance(value, bool))
 
-# Diretório para persistência
-DATA_DIR = "/app/data"
-USERS_FILE = os.path.join(DATA_DIR, "users.json")
-CHANNELS_FILE = os.path.join(DATA_DIR, "channels.json")
-MESSAGES_FILE = os.path.join(DATA_DIR, "messages.json")
-PUBLICATIONS_FILE = os.path.join(DATA_DIR, "publications.json")
 
 class Server:
     def __init__(self, server_name=None):
@@ -21,171 +100,383 @@ class Server:
         self.message_count = 0
         self.coordinator = None
         self.rank = None
-        self.server_name = server_name or f"server_{random.randint(1000, 9999)}"
+        self.server_name = server_name or SERVER_NAME or f"server_{gethostname()}"
+        self.data_dir = os.path.join(DATA_DIR, self.server_name)
         self.servers_list = []
         
-        self.users = {}
-        self.channels = []
+        self.clock_lock = threading.Lock()
+        self.replication = ReplicationBatcher(self.server_name, deps=self.dependencies)
+        
+        self.users = UserTable()
+        self.channels = OrderedSet()
+        self.storage = None
+        self.snapshots = None
+        self.channel_index = HistoryIndex()
+        self.inbox_index = HistoryIndex()
+        self.delivery = None
+        self.compactor = None
+        self.responses = ResponseCache(self.server_name)
+        
+        self.replica_log = ReplicaLog()
+        self.ordering = CausalOrdering(self.replica_log)
+        self.peer_address = PEER_ADDRESS or self.default_peer_address()
+        self.next_sync_at = time.monotonic() + SYNC_INTERVAL
+        self.sync_retry_at = 0.0
+        
+        # Modo shard: donos de cada canal / caixa de entrada no anel de servidores
+        self.ring = HashRing([self.server_name])
+        self.rebalance_pending = False
+        self.peer_sockets = threading.local()
+
+        # Chamadas da thread de sincronização executadas pela thread dona do estado
+        self.owner_calls = queue.Queue()
+        self.owner_thread = None
+        self.owner_wakeup = None
+        
+        self.log = Logger(self.server_name)
+        self.metrics = Metrics()
+        self.register_metrics()
+        self.profiler = Profiler(self.server_name, log=lambda message: self.log.warning(message, key="slow"))
         
+    def register_metrics(self):
+        """Descreve as métricas e registra os gauges lidos sob demanda"""
+        m = self.metrics
+        m.describe("requests_total", "Requisições atendidas", "service")
+        m.describe("request_errors_total", "Requisições respondidas com erro", "service")
+        m.describe("request_seconds", "Tempo de tratamento da requisição", "service")
+        m.describe("owner_wait_seconds", "Espera de uma mutação pela thread dona do estado", "service")
+        m.describe("persist_seconds", "Tempo para enfileirar ou gravar um registro", "kind")
+        m.describe("disk_flush_seconds", "Duração de cada escrita + fsync em lote")
+        m.describe("disk_flush_records", "Registros gravados em lotes")
+        m.describe("replicate_seconds", "Tempo para enfileirar uma operação de replicação", "operation")
+        m.describe("replicated_operations_total", "Operações enviadas para replicação", "operation")
+        m.describe("replication_applied_total", "Operações replicadas recebidas", "origin")
+        m.describe("replication_lag_seconds", "Atraso entre a operação na origem e o recebimento")
+        m.gauge("owner_queue_depth", lambda: m.level("owner_queue_depth"), "Mutações aguardando a thread dona do estado")
+        m.gauge("storage_queue_depth", lambda: self.storage.writer.queue.qsize() if self.storage else 0,
+                "Registros aguardando a thread de escrita")
+        m.gauge("replication_pending", lambda: len(self.replication.operations), "Operações no lote de replicação atual")
+        m.gauge("replication_buffered", lambda: self.ordering.buffered_ops,
+                "Operações replicadas aguardando dependências causais")
+        m.gauge("users", lambda: len(self.users), "Usuários conhecidos")
+        m.gauge("channels", lambda: len(self.channels), "Canais conhecidos")
+        m.gauge("logical_clock", lambda: self.logical_clock, "Relógio lógico")
+
+    def record_flush(self, count, seconds):
+        """Chamado pela thread de escrita a cada lote gravado"""
+        self.metrics.observe("disk_flush_seconds", None, seconds)
+        self.metrics.inc("disk_flush_records", None, count)
+
+    def default_peer_address(self):
+        try:
+            host = gethostbyname(gethostname())
+        except OSError:
+            host = "127.0.0.1"
+        return f"tcp://{host}:{PEER_PORT}"
+
     def update_clock(self, received_clock=0):
         """Atualiza relógio lógico"""
-        self.logical_clock = max(self.logical_clock, received_clock) + 1
+        with self.clock_lock:
+            self.logical_clock = max(self.logical_clock, received_clock) + 1
         
     def increment_clock(self):
         """Incrementa relógio antes de enviar mensagem"""
-        self.logical_clock += 1
+        with self.clock_lock:
+            self.logical_clock += 1
         
     def ensure_data_dir(self):
         """Cria diretório de dados se não existir"""
-        if not os.path.exists(DATA_DIR):
-            os.makedirs(DATA_DIR)
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
 
-    def load_users(self):
-        """Carrega usuários do disco"""
-        if os.path.exists(USERS_FILE):
-            try:
-                with open(USERS_FILE, 'r') as f:
-                    content = f.read()
-                    if content.strip():
-                        return json.loads(content)
-            except (json.JSONDecodeError, ValueError) as e:
-                print(f"Aviso: Arquivo de usuários corrompido, reiniciando: {e}")
-        return {}
-
-    def save_users(self):
-        """Salva usuários no disco"""
-        with open(USERS_FILE, 'w') as f:
-            json.dump(self.users, f, indent=2)
-
-    def load_channels(self):
-        """Carrega canais do disco"""
-        if os.path.exists(CHANNELS_FILE):
-            try:
-                with open(CHANNELS_FILE, 'r') as f:
-                    content = f.read()
-                    if content.strip():
-                        return json.loads(content)
-            except (json.JSONDecodeError, ValueError) as e:
-                print(f"Aviso: Arquivo de canais corrompido, reiniciando: {e}")
-        return []
-
-    def save_channels(self):
-        """Salva canais no disco"""
-        with open(CHANNELS_FILE, 'w') as f:
-            json.dump(self.channels, f, indent=2)
-
-    def save_message(self, message_data):
-        """Salva mensagem no disco"""
-        messages = []
-        if os.path.exists(MESSAGES_FILE):
-            try:
-                with open(MESSAGES_FILE, 'r') as f:
-                    content = f.read()
-                    if content.strip():  # Verifica se não está vazio
-                        messages = json.loads(content)
-            except (json.JSONDecodeError, ValueError) as e:
-                print(f"[{self.server_name}] Aviso: Arquivo de mensagens corrompido, reiniciando: {e}")
-                messages = []
-        messages.append(message_data)
-        with open(MESSAGES_FILE, 'w') as f:
-            json.dump(messages, f, indent=2)
-
-    def save_publication(self, publication_data):
-        """Salva publicação no disco"""
-        publications = []
-        if os.path.exists(PUBLICATIONS_FILE):
-            try:
-                with open(PUBLICATIONS_FILE, 'r') as f:
-                    content = f.read()
-                    if content.strip():  # Verifica se não está vazio
-                        publications = json.loads(content)
-            except (json.JSONDecodeError, ValueError) as e:
-                print(f"[{self.server_name}] Aviso: Arquivo de publicações corrompido, reiniciando: {e}")
-                publications = []
-        publications.append(publication_data)
-        with open(PUBLICATIONS_FILE, 'w') as f:
-            json.dump(publications, f, indent=2)
+    def open_storage(self, recover_from=None):
+        """Abre os logs desta réplica, importando os dados do formato compartilhado antigo se houver"""
+        writer = GroupCommitWriter(observer=self.record_flush)
+        self.storage = Storage(self.data_dir, writer, recover_from=recover_from)
+        migrate_legacy_json(self.data_dir, self.storage)
+        import_shared_logs(SHARED_DATA_DIR, self.storage)
+        migrate_legacy_json(SHARED_DATA_DIR, self.storage, shared=True)
+
+    def load_state(self):
+        """Carrega o estado do snapshot mais recente e reaplica apenas o final dos logs"""
+        self.ensure_data_dir()
+        start = time.perf_counter()
+        self.snapshots = SnapshotManager(self.data_dir)
+        snapshot = self.snapshots.load()
+        high_water = snapshot["high_water"] if snapshot else {}
+        self.open_storage(high_water)
+        self.snapshots.storage = self.storage
+        self.delivery = DeliveryQueues(self.inbox_index,
+                                       lambda pointer: self.storage.read(self.storage.messages, pointer))
+        # Snapshots anteriores à numeração das confirmações não têm "acks" no índice de réplicas
+        if snapshot and ("replicas" not in snapshot or "acks" not in snapshot["replicas"]["digests"]
+                         or not self.snapshots.matches(snapshot)):
+            snapshot, high_water = None, {}
+
+        # Evita coletas do GC durante a criação de milhões de objetos de índice
+        gc.disable()
+        try:
+            if snapshot:
+                self.restore_snapshot(snapshot)
+            self.load_users(high_water.get("users"))
+            self.load_channels(high_water.get("channels"))
+            self.load_acks(high_water.get("acks"))
+            self.load_history(high_water.get("messages"), high_water.get("publications"))
+        finally:
+            gc.enable()
+        elapsed = (time.perf_counter() - start) * 1000
+        self.responses.reset("users", self.users.keys())
+        self.responses.reset("channels", self.channels.to_list())
+        self.compactor = Compactor(self.storage,
+                                   {"messages": self.inbox_index, "publications": self.channel_index},
+                                   self.users, self.replica_log, log=self.log.info)
+        origin = "snapshot + log" if snapshot else "log completo"
+        self.log.info(f"Estado carregado ({origin}) em {elapsed:.1f}ms: "
+              f"{len(self.users)} usuários, {len(self.channels)} canais")
+
+    def capture_snapshot(self):
+        """Captura o estado atual junto com as posições finais dos logs"""
+        return {
+            "clock": self.logical_clock,
+            "message_count": self.message_count,
+            "users": [[name, user.logins.to_list()] for name, user in self.users.items()],
+            "channels": self.channels.to_list(),
+            "high_water": {name: list(tail) for name, tail in self.storage.tails().items()},
+            "indexes": {
+                "channels": self.channel_index.export(),
+                "inbox": self.inbox_index.export(),
+            },
+            "replicas": self.replica_log.export(),
+        }
+
+    def restore_snapshot(self, snapshot):
+        """Restaura o estado a partir de um snapshot"""
+        self.logical_clock = max(self.logical_clock, snapshot["clock"])
+        self.message_count = snapshot["message_count"]
+        self.users = UserTable(
+            (name, UserRecord.restore(name, logins)) for name, logins in snapshot["users"])
+        self.channels = OrderedSet(snapshot["channels"])
+        self.channel_index.restore(snapshot["indexes"]["channels"])
+        self.inbox_index.restore(snapshot["indexes"]["inbox"])
+        self.replica_log.restore(snapshot["replicas"])
+
+    def maybe_snapshot(self):
+        if self.snapshots.due():
+            self.snapshots.take(self.capture_snapshot())
+
+    def maybe_compact(self):
+        """Aplica as trocas preparadas pela thread de retenção/compactação"""
+        if self.compactor:
+            self.compactor.apply()
+
+    def owns(self, key):
+        """Indica se este servidor guarda os dados da chave (sempre, fora do modo shard)"""
+        return SHARDING != "hash" or not key or self.server_name in self.ring.owners(key)
+
+    def stamp(self, record):
+        """Atribui a uma mutação local a origem e o próximo seq deste servidor"""
+        seq = self.replica_log.next_sequence(self.server_name)
+        record["origin"] = self.server_name
+        record["seq"] = seq
+        self.replica_log.advance(self.server_name, seq)
+        return record
+
+    def encode_record(self, record):
+        """Numera uma mutação local e a serializa uma única vez
+
+        Os bytes resultantes são reutilizados na publicação aos assinantes, no log e
+        no lote de replicação (ver handle_publish e handle_message).
+        """
+        self.stamp(record)
+        return msgpack.packb(record)
+
+    def persist(self, kind, record, origin=None, seq=None, payload=None):
+        """Grava um registro com sua origem e número de sequência
+
+        Mutações locais (origin=None) recebem o próximo seq deste servidor; registros
+        replicados mantêm os da origem, e registros antigos sem seq continuam sem.
+        Com payload (de encode_record), o registro já está numerado e codificado.
+        """
+        if origin is None:
+            if payload is None:
+                self.stamp(record)
+        elif seq is not None:
+            record["origin"] = origin
+            record["seq"] = seq
+        start = time.perf_counter()
+        pointer = self.storage.append(getattr(self.storage, kind), record, payload)
+        elapsed = time.perf_counter() - start
+        self.metrics.observe("persist_seconds", kind, elapsed)
+        trace = self.profiler.current()
+        if trace:
+            trace.add("persist", elapsed)
+        self.replica_log.add(kind, record, pointer)
+        self.snapshots.record_mutation()
+        return pointer
+
+    def load_users(self, start=None):
+        """Carrega usuários do disco (a partir da posição start)"""
+        for pointer, record in self.storage.users.replay(start):
+            self.users.add_login(record["user"], record["timestamp"])
+            self.replica_log.add("users", record, pointer)
+
+    def save_users(self, user, timestamp, origin=None, seq=None):
+        """Salva login de usuário no disco"""
+        record = {"user": user, "timestamp": timestamp}
+        self.persist("users", record, origin, seq)
+        return record
+
+    def load_channels(self, start=None):
+        """Carrega canais do disco (a partir da posição start)"""
+        for pointer, record in self.storage.channels.replay(start):
+            self.channels.add(record["channel"])
+            self.replica_log.add("channels", record, pointer)
+
+    def save_channels(self, channel, origin=None, seq=None):
+        """Salva canal no disco"""
+        record = {"channel": channel}
+        self.persist("channels", record, origin, seq)
+        return record
+
+    def load_acks(self, start=None):
+        """Reconstrói as marcas de entrega (do log inteiro: elas não entram no snapshot) e
+        registra no índice de réplicas as confirmações a partir da posição start"""
+        for pointer, record in self.storage.acks.replay():
+            self.delivery.advance(record["user"], record["cursor"])
+            if start is None or pointer >= start:
+                self.replica_log.add("acks", record, pointer)
+
+    def save_ack(self, user, cursor, origin=None, seq=None):
+        """Salva no disco a marca de entrega confirmada de um usuário"""
+        record = {"user": user, "cursor": list(cursor)}
+        self.persist("acks", record, origin, seq)
+        return record
+
+    def save_message(self, message_data, origin=None, seq=None, payload=None):
+        """Salva mensagem no disco
+
+        No modo shard, cópias replicadas só ficam nos donos da caixa de entrada, mas uma
+        mensagem aceita por este servidor (origin=None) é sempre gravada aqui: se o lote de
+        replicação se perder, é desta cópia que a sincronização a entrega aos donos.
+        """
+        if origin is not None and not self.owns(message_data.get("dst")):
+            return None
+        pointer = self.persist("messages", message_data, origin, seq, payload)
+        self.index_message(pointer, message_data)
+        self.delivery.push(message_data.get("dst"), message_data)
+        return pointer
+
+    def save_publication(self, publication_data, origin=None, seq=None, payload=None):
+        """Salva publicação no disco (no modo shard, nos donos do canal e na origem; ver save_message)"""
+        if origin is not None and not self.owns(publication_data.get("channel")):
+            return None
+        pointer = self.persist("publications", publication_data, origin, seq, payload)
+        self.index_publication(pointer, publication_data)
+        return pointer
+
+    def index_message(self, pointer, message_data):
+        self.inbox_index.add(message_data.get("dst"), record_key(message_data), pointer)
+
+    def index_publication(self, pointer, publication_data):
+        self.channel_index.add(publication_data.get("channel"), record_key(publication_data), pointer)
+
+    def load_history(self, messages_start=None, publications_start=None):
+        """Reconstrói os índices de histórico a partir dos logs"""
+        for pointer, record in self.storage.messages.replay(messages_start):
+            self.index_message(pointer, record)
+            self.replica_log.add("messages", record, pointer)
+        for pointer, record in self.storage.publications.replay(publications_start):
+            self.index_publication(pointer, record)
+            self.replica_log.add("publications", record, pointer)
+
+    def reference_message(self, service, **fields):
+        """Monta uma requisição ao servidor de referência"""
+        self.increment_clock()
+        return {
+            "service": service,
+            "data": {
+                **fields,
+                "timestamp": datetime.now().isoformat(),
+                "clock": self.logical_clock
+            }
+        }
+
+    def apply_rank(self, response):
+        self.update_clock(response["data"].get("clock", 0))
+        self.rank = response["data"]["rank"]
+        self.log.info(f"Rank recebido: {self.rank}, Clock: {self.logical_clock}")
+
+    def apply_servers_list(self, response):
+        self.update_clock(response["data"].get("clock", 0))
+        servers = response["data"]["list"]
+        if servers != self.servers_list:
+            self.servers_list = servers
+            self.log.info(f"Servidores ativos: {len(self.servers_list)}")
+        if SHARDING == "hash":
+            nodes = {server["name"] for server in servers} | {self.server_name}
+            if nodes != set(self.ring.nodes):
+                self.ring = HashRing(nodes)
+                self.rebalance_pending = True
+                self.log.info(f"Anel de shards atualizado: {len(nodes)} servidores")
+
+    def reference_call(self, ref_socket, message):
+        """Requisição ao servidor de referência (a espera entra no log de operações lentas)"""
+        start = time.perf_counter()
+        ref_socket.send(msgpack.packb(message))
+        response = msgpack.unpackb(ref_socket.recv(), raw=False)
+        self.profiler.observe(f"referência ({message['service']})", time.perf_counter() - start)
+        return response
 
     def register_with_reference(self, ref_socket):
         """Registra servidor e obtém rank"""
         try:
-            self.increment_clock()
-            message = {
-                "service": "rank",
-                "data": {
-                    "user": self.server_name,
-                    "timestamp": datetime.now().isoformat(),
-                    "clock": self.logical_clock
-                }
-            }
-            ref_socket.send(msgpack.packb(message))
-            response_bytes = ref_socket.recv()
-            response = msgpack.unpackb(response_bytes, raw=False)
-            
-            self.update_clock(response["data"].get("clock", 0))
-            self.rank = response["data"]["rank"]
-            print(f"[{self.server_name}] Rank recebido: {self.rank}, Clock: {self.logical_clock}")
+            self.apply_rank(self.reference_call(ref_socket, self.reference_message(
+                "rank", user=self.server_name, address=self.peer_address)))
         except Exception as e:
-            print(f"Erro ao registrar no servidor de referência: {e}")
+            self.log.error(f"Erro ao registrar no servidor de referência: {e}")
             self.rank = random.randint(1, 1000)
 
     def get_servers_list(self, ref_socket):
         """Obtém lista de servidores do servidor de referência"""
         try:
-            self.increment_clock()
-            message = {
-                "service": "list",
-                "data": {
-                    "timestamp": datetime.now().isoformat(),
-                    "clock": self.logical_clock
-                }
-            }
-            ref_socket.send(msgpack.packb(message))
-            response_bytes = ref_socket.recv()
-            response = msgpack.unpackb(response_bytes, raw=False)
-            
-            self.update_clock(response["data"].get("clock", 0))
-            self.servers_list = response["data"]["list"]
-            print(f"[{self.server_name}] Servidores ativos: {len(self.servers_list)}")
+            self.apply_servers_list(self.reference_call(ref_socket, self.reference_message("list")))
         except Exception as e:
-            print(f"Erro ao obter lista de servidores: {e}")
+            self.log.error(f"Erro ao obter lista de servidores: {e}")
 
     def send_heartbeat(self, ref_socket):
         """Envia heartbeat periódico ao servidor de referência"""
         while True:
             try:
-                time.sleep(10)
-                self.increment_clock()
-                message = {
-                    "service": "heartbeat",
-                    "data": {
-                        "user": self.server_name,
-                        "timestamp": datetime.now().isoformat(),
-                        "clock": self.logical_clock
-                    }
-                }
-                ref_socket.send(msgpack.packb(message))
-                response_bytes = ref_socket.recv()
-                response = msgpack.unpackb(response_bytes, raw=False)
+                time.sleep(REFERENCE_HEARTBEAT_INTERVAL)
+                response = self.reference_call(ref_socket, self.reference_message("heartbeat", user=self.server_name))
                 self.update_clock(response["data"].get("clock", 0))
+                # Mantém a lista de pares usada na sincronização atualizada
+                self.get_servers_list(ref_socket)
             except Exception as e:
-                print(f"Erro ao enviar heartbeat: {e}")
+                self.log.error(f"Erro ao enviar heartbeat: {e}")
 
-    def replicate_data(self, pub_socket, operation, data):
-        """Replica dados para outros servidores"""
+    def replicate_data(self, pub_socket, operation, data, payload=None):
+        """Replica dados para outros servidores (em lotes, ver ReplicationBatcher)"""
         self.increment_clock()
-        replication_msg = {
-            "operation": operation,
-            "data": data,
-            "server": self.server_name,
-            "clock": self.logical_clock
-        }
-        packed = msgpack.packb(replication_msg)
-        pub_socket.send_multipart([b"replication", packed])
-        print(f"[{self.server_name}] Replicando: {operation}")
+        start = time.perf_counter()
+        self.replication.add(pub_socket, operation, data, self.logical_clock, payload)
+        elapsed = time.perf_counter() - start
+        self.metrics.observe("replicate_seconds", operation, elapsed)
+        trace = self.profiler.current()
+        if trace:
+            trace.add("replicate", elapsed)
+        self.metrics.inc("replicated_operations_total", operation)
+
+    def dependencies(self):
+        """Vetor enviado em cada lote de replicação: o que este servidor já aplicou das outras origens"""
+        return self.replica_log.vector.to_dict(exclude=self.server_name)
+
+    def flush_replication(self, pub_socket):
+        """Publica o lote de replicação pendente se o tempo limite expirou"""
+        self.replication.flush_due(pub_socket, self.logical_clock)
     
     def handle_replication(self, replication_data):
-        """Processa dados replicados de outros servidores"""
+        """Processa dados replicados de outros servidores (formato de uma operação)"""
         operation = replication_data.get("operation")
         data = replication_data.get("data")
         source_server = replication_data.get("server")
@@ -194,28 +485,424 @@ class Server:
         if source_server == self.server_name:
             return
         
-        print(f"[{self.server_name}] Recebendo replicação de {source_server}: {operation}")
+        self.log.debug(f"Recebendo replicação de {source_server}: {operation}", key="replication")
+        self.apply_replicated(operation, data, source_server)
+
+    def handle_replication_batch(self, header, payload):
+        """Aplica um lote de replicação inteiro com um único flush de persistência"""
+        source_server = header.get("server")
         
+        # Não processa replicação do próprio servidor
+        if source_server == self.server_name:
+            return
+        
+        operations = decode_batch(header, payload)
+        self.replication.record_received(operations)
+        now = time.time()
+        for entry in operations:
+            if "ts" in entry:
+                self.metrics.observe("replication_lag_seconds", None, now - entry["ts"])
+        self.metrics.inc("replication_applied_total", source_server, len(operations))
+        self.log.debug(f"Recebendo replicação de {source_server}: {len(operations)} operações", key="replication")
+        with self.storage.deferred():
+            # Lotes cujas dependências ainda não chegaram ficam em espera (ver ordering.py)
+            for origin, batch in self.ordering.offer(source_server, header.get("deps"), operations):
+                for entry in batch:
+                    self.apply_replicated(entry.get("operation"), entry.get("data"), origin)
+
+    def release_ordered(self):
+        """Aplica os lotes em espera cujas dependências chegaram ou cuja janela de reordenação venceu"""
+        if not self.ordering.queues:
+            return
+        with self.storage.deferred():
+            for origin, batch in self.ordering.release():
+                for entry in batch:
+                    self.apply_replicated(entry.get("operation"), entry.get("data"), origin)
+
+    def apply_replicated(self, operation, data, origin, mode="live"):
+        """Aplica uma operação replicada ao estado local
+
+        Operações numeradas são aplicadas em ordem por origem: duplicadas são ignoradas
+        e, ao vivo, uma lacuna descarta a operação e marca a origem para sincronização.
+        Respostas de sync ("sync") podem pular números (operações que não alteraram o
+        estado do par); registros de reparo ("repair") só entram se o seq já passou.
+        """
+        seq = data.get("seq")
+        if seq is not None:
+            origin = data.get("origin", origin)
+            status = self.replica_log.check(origin, seq)
+            if mode == "repair":
+                if status != DUPLICATE:
+                    return False
+            elif status == DUPLICATE:
+                return False
+            elif status == GAP and mode == "live":
+                self.replica_log.pending.add(origin)
+                return False
+
         if operation == "login":
             user = data.get("user")
             timestamp = data.get("timestamp")
-            if user not in self.users:
-                self.users[user] = []
-            if timestamp not in self.users[user]:
-                self.users[user].append(timestamp)
-                self.save_users()
+            is_new = user not in self.users
+            if self.users.add_login(user, timestamp):
+                self.save_users(user, timestamp, origin, seq)
+                if is_new:
+                    self.responses.add("users", user)
                 
         elif operation == "channel":
             channel = data.get("channel")
-            if channel and channel not in self.channels:
-                self.channels.append(channel)
-                self.save_channels()
+            if channel and self.channels.add(channel):
+                self.save_channels(channel, origin, seq)
+                self.responses.add("channels", channel)
                 
         elif operation == "message":
-            self.save_message(data)
+            self.save_message(data, origin, seq)
             
         elif operation == "publication":
-            self.save_publication(data)
+            self.save_publication(data, origin, seq)
+
+        elif operation == "ack":
+            user = data.get("user")
+            cursor = data.get("cursor")
+            # Confirmações numeradas são gravadas mesmo sem avançar a marca: todas as réplicas
+            # guardam as mesmas e os digests da anti-entropia convergem
+            if valid_cursor(cursor) and (self.delivery.advance(user, cursor) or seq is not None):
+                self.save_ack(user, cursor, origin, seq)
+
+        if seq is not None and mode != "repair":
+            self.replica_log.advance(origin, seq)
+        return True
+
+    def read_records(self, log, pointers):
+        """Lê registros pelas posições, ignorando os já descartados pela retenção"""
+        records = [self.storage.read(log, pointer) for pointer in pointers]
+        return [record for record in records if record is not None]
+
+    def bucket_records(self, kind, bucket):
+        log = getattr(self.storage, kind)
+        return self.read_records(log, self.replica_log.bucket_pointers(kind, bucket))
+
+    def handle_sync(self, data):
+        """Serve a outra réplica as operações posteriores a `since` e os registros que
+        faltam nos baldes divergentes (`buckets`: [[tipo, balde, [hashes conhecidos]]])"""
+        self.update_clock(data.get("clock", 0))
+
+        response = {"status": "OK", "server": self.server_name}
+        since = data.get("since")
+        if isinstance(since, dict):
+            # Lido antes das operações: tudo até `applied` está incluído na resposta
+            applied = dict(self.replica_log.applied)
+            limit = max(1, min(int(data.get("limit", SYNC_BATCH_OPERATIONS)), SYNC_BATCH_OPERATIONS))
+            entries, more = self.replica_log.after(since, limit)
+            response["operations"] = [
+                [OPERATIONS[kind], record] for kind, record in (
+                    (kind, self.storage.read(getattr(self.storage, kind), pointer)) for kind, pointer in entries)
+                if record is not None
+            ]
+            response["more"] = more
+            response["applied"] = applied
+            response["digest"] = self.replica_log.digest()
+
+        buckets = data.get("buckets")
+        if isinstance(buckets, list):
+            records = []
+            for kind, bucket, hashes in buckets[:SYNC_MAX_BUCKETS]:
+                if kind not in RECORD_FIELDS or not 0 <= bucket < self.replica_log.buckets:
+                    continue
+                known = set(hashes)
+                for record in self.bucket_records(kind, bucket):
+                    if record_hash(kind, record) not in known:
+                        records.append([OPERATIONS[kind], record])
+            response["records"] = records
+
+        # Transferência de chaves no modo shard: contagens e registros de uma chave
+        counts = data.get("counts")
+        if isinstance(counts, dict):
+            response["counts"] = {
+                kind: {name: self.history_index(kind).count(name) for name in names
+                       if self.history_index(kind).count(name)}
+                for kind, names in counts.items() if kind in ("messages", "publications")
+            }
+
+        key = data.get("key")
+        if isinstance(key, list) and key[0] in ("messages", "publications"):
+            kind, name, hashes = key
+            known = set(hashes)
+            records = []
+            log = getattr(self.storage, kind)
+            for record in self.read_records(log, self.history_index(kind).all(name)):
+                if record_hash(kind, record) not in known:
+                    records.append([OPERATIONS[kind], record])
+                    if len(records) >= SYNC_BATCH_OPERATIONS:
+                        break
+            response["records"] = records
+            response["more"] = len(records) >= SYNC_BATCH_OPERATIONS
+
+        self.increment_clock()
+        response["timestamp"] = datetime.now().isoformat()
+        response["clock"] = self.logical_clock
+        return {"service": "sync", "data": response}
+
+    def sync_request(self, socket, **fields):
+        socket.send(msgpack.packb(self.reference_message("sync", **fields)))
+        response = msgpack.unpackb(socket.recv(), raw=False)
+        self.update_clock(response["data"].get("clock", 0))
+        if response["data"].get("status") != "OK":
+            raise RuntimeError(response["data"].get("description"))
+        return response["data"]
+
+    def sync_with(self, context, address):
+        """Recebe de um par as operações que faltam e repara os baldes divergentes"""
+        socket = context.socket(zmq.REQ)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.setsockopt(zmq.RCVTIMEO, int(SYNC_TIMEOUT * 1000))
+        socket.connect(address)
+        received = repaired = 0
+        try:
+            while True:
+                since = self.on_owner(lambda: dict(self.replica_log.applied))
+                response = self.sync_request(socket, since=since)
+                received += self.on_owner(self.apply_synced, response.get("operations", []), response["server"], "sync")
+                if not response.get("more"):
+                    break
+            # Números pulados pelo par não alteraram o estado dele; o digest cobre o resto
+            self.on_owner(self.advance_applied, response.get("applied", {}))
+
+            # No modo shard, mensagens e publicações diferem entre réplicas por construção
+            kinds = ("users", "channels", "acks") if SHARDING == "hash" else None
+            differing = self.on_owner(self.replica_log.diff, response.get("digest", {}), SYNC_MAX_BUCKETS, kinds)
+            if differing:
+                buckets = self.on_owner(self.bucket_hashes, differing)
+                response = self.sync_request(socket, buckets=buckets)
+                repaired += self.on_owner(self.apply_synced, response.get("records", []), response["server"], "repair")
+        except zmq.Again:
+            self.log.warning(f"Sincronização com {address} sem resposta")
+            return False
+        except Exception as e:
+            self.log.error(f"Erro ao sincronizar com {address}: {e}")
+            return False
+        finally:
+            socket.close()
+        self.log.info(f"Sincronizado com {response['server']}: {received} operações, "
+              f"{repaired} registros reparados, {len(differing)} baldes divergentes")
+        return True
+
+    def apply_synced(self, operations, server, mode):
+        """Aplica (na thread dona do estado) as operações recebidas de um par"""
+        applied = 0
+        with self.storage.deferred():
+            for operation, record in operations:
+                applied += self.apply_replicated(operation, record, server, mode)
+        return applied
+
+    def advance_applied(self, applied):
+        for origin, seq in applied.items():
+            self.replica_log.advance(origin, seq)
+
+    def bucket_hashes(self, differing):
+        """[[tipo, balde, [hashes conhecidos]]] dos baldes divergentes, para o pedido de reparo"""
+        return [
+            [kind, bucket, [record_hash(kind, record) for record in self.bucket_records(kind, bucket)]]
+            for kind, bucket in differing
+        ]
+
+    def history_index(self, kind):
+        return self.inbox_index if kind == "messages" else self.channel_index
+
+    def owned_keys(self):
+        return {
+            "publications": [channel for channel in self.channels if self.owns(channel)],
+            "messages": [user for user in self.users if self.owns(user)],
+        }
+
+    def behind(self, counts):
+        """[(tipo, chave)] em que o par tem mais registros que esta réplica"""
+        return [(kind, name) for kind, names in counts.items() for name, count in names.items()
+                if count > self.history_index(kind).count(name)]
+
+    def rebalance(self, context):
+        """Modo shard: busca nos pares os canais e caixas de entrada que passaram a ser deste servidor"""
+        owned = self.on_owner(self.owned_keys)
+        moved = 0
+        for peer in self.sync_peers():
+            socket = context.socket(zmq.REQ)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.setsockopt(zmq.RCVTIMEO, int(SYNC_TIMEOUT * 1000))
+            socket.connect(peer["address"])
+            try:
+                counts = self.sync_request(socket, counts=owned).get("counts", {})
+                for kind, name in self.on_owner(self.behind, counts):
+                    moved += self.pull_key(socket, kind, name)
+            except Exception as e:
+                self.log.error(f"Erro ao rebalancear com {peer['name']}: {e}")
+            finally:
+                socket.close()
+        if moved:
+            self.log.info(f"Rebalanceamento: {moved} registros recebidos")
+
+    def pull_key(self, socket, kind, name):
+        """Copia de um par os registros de uma chave que faltam localmente"""
+        known = self.on_owner(self.key_hashes, kind, name)
+        received = 0
+        while True:
+            response = self.sync_request(socket, key=[kind, name, list(known)])
+            records = response.get("records", [])
+            known.update(record_hash(kind, record) for _, record in records)
+            received += self.on_owner(self.apply_synced, records, response["server"], "repair")
+            if not response.get("more"):
+                return received
+
+    def key_hashes(self, kind, name):
+        log = getattr(self.storage, kind)
+        return {record_hash(kind, record)
+                for record in self.read_records(log, self.history_index(kind).all(name))}
+
+    def peer_request(self, address, message):
+        """Requisição a outra réplica com um socket REQ por thread e por par"""
+        sockets = self.peer_sockets.__dict__
+        socket = sockets.get(address)
+        if socket is None:
+            socket = zmq.Context.instance().socket(zmq.REQ)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.setsockopt(zmq.RCVTIMEO, int(SYNC_TIMEOUT * 1000))
+            socket.connect(address)
+            sockets[address] = socket
+        try:
+            socket.send(msgpack.packb(message))
+            return msgpack.unpackb(socket.recv(), raw=False)
+        except zmq.ZMQError:
+            # REQ fica inconsistente após timeout; recria na próxima requisição
+            socket.close()
+            del sockets[address]
+            raise
+
+    def forward_read(self, key, service, data):
+        """Modo shard: encaminha uma leitura para um dono da chave; None se nenhum responder"""
+        addresses = {server["name"]: server.get("address") for server in self.servers_list}
+        for owner in self.ring.owners(key):
+            address = addresses.get(owner)
+            if owner == self.server_name or not address:
+                continue
+            try:
+                response = self.peer_request(address, {"service": service, "data": {**data, "forwarded": True}})
+            except zmq.ZMQError as e:
+                self.log.warning(f"Dono de '{key}' ({owner}) sem resposta: {e}")
+                continue
+            self.update_clock(response["data"].get("clock", 0))
+            return response
+        return None
+
+    def sync_peers(self):
+        return [server for server in self.servers_list
+                if server.get("address") and server.get("name") != self.server_name]
+
+    def catch_up(self, context, origins=None):
+        """Sincroniza com os pares (com a origem das lacunas primeiro, se informada)"""
+        peers = self.sync_peers()
+        if origins:
+            peers.sort(key=lambda server: server.get("name") not in origins)
+        synced = False
+        for peer in peers:
+            synced = self.sync_with(context, peer["address"]) or synced
+            if synced and origins:
+                break
+        return synced
+
+    def take_pending(self):
+        origins, self.replica_log.pending = self.replica_log.pending, set()
+        return origins
+
+    def maybe_sync(self, context):
+        """Sincroniza origens com lacunas e faz a anti-entropia periódica com um par
+
+        Roda fora da thread dona do estado: as requisições aos pares podem levar até
+        SYNC_TIMEOUT cada, e o estado só é lido ou alterado em on_owner().
+        """
+        if self.rebalance_pending:
+            self.rebalance_pending = False
+            self.rebalance(context)
+        now = time.monotonic()
+        if self.replica_log.pending and now >= self.sync_retry_at:
+            origins = self.on_owner(self.take_pending)
+            if not self.catch_up(context, origins):
+                self.sync_retry_at = now + SYNC_RETRY_INTERVAL
+        elif SYNC_INTERVAL > 0 and now >= self.next_sync_at:
+            self.next_sync_at = now + SYNC_INTERVAL
+            peers = self.sync_peers()
+            if peers:
+                self.sync_with(context, random.choice(peers)["address"])
+
+    def sync_loop(self, context):
+        """Thread de sincronização: catch-up, rebalanceamento e anti-entropia fora da thread dona"""
+        wakeup = context.socket(zmq.PUSH)
+        wakeup.connect("inproc://owner-calls")
+        self.owner_wakeup = lambda: wakeup.send(b"")  # só esta thread usa o socket
+        while True:
+            try:
+                self.maybe_sync(context)
+            except Exception as e:
+                self.log.error(f"Erro na sincronização: {e}")
+            time.sleep(SYNC_CHECK_INTERVAL)
+
+    def on_owner(self, function, *args):
+        """Executa function na thread dona do estado e aguarda o resultado
+
+        Antes do laço principal (catch-up da inicialização) quem chama já é a dona do estado.
+        """
+        if self.owner_thread is None or self.owner_thread is threading.current_thread():
+            return function(*args)
+        done = threading.Event()
+        result = []
+        self.owner_calls.put((function, args, done, result))
+        self.owner_wakeup()
+        done.wait()
+        value, error = result
+        if error is not None:
+            raise error
+        return value
+
+    def run_owner_calls(self):
+        """Chamado pela thread dona do estado: executa as chamadas enfileiradas por on_owner()"""
+        while True:
+            try:
+                function, args, done, result = self.owner_calls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                result.extend((function(*args), None))
+            except Exception as e:
+                result.extend((None, e))
+            finally:
+                done.set()
+
+    def peer_error(self, message, error):
+        self.increment_clock()
+        return msgpack.packb({
+            "service": message.get("service") if isinstance(message, dict) else None,
+            "data": {
+                "status": "erro",
+                "timestamp": datetime.now().isoformat(),
+                "clock": self.logical_clock,
+                "description": str(error) or type(error).__name__
+            }
+        })
+
+    def serve_peers(self, context):
+        """Atende requisições de sincronização de outras réplicas (sempre responde no REP)"""
+        socket = context.socket(zmq.REP)
+        socket.bind(f"tcp://*:{PEER_PORT}")
+        while True:
+            message_bytes = socket.recv()
+            message = None
+            try:
+                message = msgpack.unpackb(message_bytes, raw=False)
+                if not isinstance(message, dict) or message.get("service") not in PEER_SERVICES:
+                    raise ValueError("Serviço não atendido na porta de pares")
+                response_bytes = self.process_request(message, peer=True)
+            except Exception as e:
+                self.log.error(f"Erro na sincronização: {e}")
+                response_bytes = self.peer_error(message, e)
+            socket.send(response_bytes)
 
     def handle_login(self, data, pub_socket=None):
         """Processa login de usuário"""
@@ -236,15 +923,15 @@ class Server:
                 }
             }
         
-        if user not in self.users:
-            self.users[user] = []
-        
-        self.users[user].append(timestamp)
-        self.save_users()
-        
-        # Replica para outros servidores
-        if pub_socket:
-            self.replicate_data(pub_socket, "login", {"user": user, "timestamp": timestamp})
+        is_new = user not in self.users
+        if self.users.add_login(user, timestamp):
+            record = self.save_users(user, timestamp)
+            if is_new:
+                self.responses.add("users", user)
+            
+            # Replica para outros servidores
+            if pub_socket:
+                self.replicate_data(pub_socket, "login", record)
         
         self.increment_clock()
         return {
@@ -256,17 +943,37 @@ class Server:
             }
         }
 
+    def invalid_list_page(self, data):
+        """Motivo pelo qual offset/limit de uma página de users/channels são inválidos, ou None"""
+        if not optional_int(data.get("offset")):
+            return "Offset inválido"
+        if not optional_int(data.get("limit")):
+            return "Limite inválido"
+        return None
+
     def handle_users(self, data):
-        """Retorna lista de usuários"""
+        """Retorna lista de usuários (do cache de respostas; ver cache.py)"""
         self.update_clock(data.get("clock", 0))
         self.increment_clock()
-        
+
+        invalid = self.invalid_list_page(data)
+        if invalid:
+            return {
+                "service": "users",
+                "data": {
+                    "status": "erro",
+                    "message": invalid,
+                    "timestamp": datetime.now().isoformat(),
+                    "clock": self.logical_clock
+                }
+            }
+
         return {
             "service": "users",
             "data": {
                 "timestamp": datetime.now().isoformat(),
                 "clock": self.logical_clock,
-                "users": list(self.users.keys())
+                **self.responses.view("users", data)
             }
         }
 
@@ -288,7 +995,7 @@ class Server:
                 }
             }
         
-        if channel in self.channels:
+        if not self.channels.add(channel):
             self.increment_clock()
             return {
                 "service": "channel",
@@ -300,12 +1007,12 @@ class Server:
                 }
             }
         
-        self.channels.append(channel)
-        self.save_channels()
+        record = self.save_channels(channel)
+        self.responses.add("channels", channel)
         
         # Replica para outros servidores
         if pub_socket:
-            self.replicate_data(pub_socket, "channel", {"channel": channel})
+            self.replicate_data(pub_socket, "channel", record)
         
         self.increment_clock()
         return {
@@ -318,19 +1025,44 @@ class Server:
         }
 
     def handle_channels(self, data):
-        """Retorna lista de canais"""
+        """Retorna lista de canais (do cache de respostas; ver cache.py)"""
         self.update_clock(data.get("clock", 0))
         self.increment_clock()
-        
+
+        invalid = self.invalid_list_page(data)
+        if invalid:
+            return {
+                "service": "channels",
+                "data": {
+                    "status": "erro",
+                    "message": invalid,
+                    "timestamp": datetime.now().isoformat(),
+                    "clock": self.logical_clock
+                }
+            }
+
         return {
             "service": "channels",
             "data": {
                 "timestamp": datetime.now().isoformat(),
                 "clock": self.logical_clock,
-                "channels": self.channels
+                **self.responses.view("channels", data)
             }
         }
 
+    def fanout(self, pub_socket, topic, record, author, payload):
+        """Publica no proxy no(s) formato(s) de WIRE_PUBLISH
+
+        v1 envia o próprio registro já codificado (payload, o mesmo gravado no log);
+        v2 envia o array compacto de wire.py.
+        """
+        topic = topic.encode()
+        if wire.WIRE_PUBLISH != "v2":
+            pub_socket.send_multipart([topic, payload], copy=False)
+        if wire.WIRE_PUBLISH != "v1":
+            compact = wire.encode_publication(author, record["message"], record["timestamp"], record["clock"])
+            pub_socket.send_multipart([wire.WIRE_TOPIC_PREFIX + topic, compact])
+
     def handle_publish(self, data, pub_socket):
         """Publica mensagem em um canal"""
         self.update_clock(data.get("clock", 0))
@@ -352,30 +1084,25 @@ class Server:
                 }
             }
         
-        # Publica no canal
+        # Um único registro, codificado uma vez: assinantes, log e replicação usam os mesmos bytes
         self.increment_clock()
-        publication = {
+        pub_data = {
+            "channel": channel,
             "user": user,
             "message": message,
             "timestamp": timestamp,
             "clock": self.logical_clock
         }
+        payload = self.encode_record(pub_data)
         
-        pub_message = msgpack.packb(publication)
-        pub_socket.send_multipart([channel.encode(), pub_message])
+        # Publica no canal
+        self.fanout(pub_socket, channel, pub_data, user, payload)
         
         # Salva publicação
-        pub_data = {
-            "channel": channel,
-            "user": user,
-            "message": message,
-            "timestamp": timestamp,
-            "clock": self.logical_clock
-        }
-        self.save_publication(pub_data)
+        self.save_publication(pub_data, payload=payload)
         
         # Replica para outros servidores
-        self.replicate_data(pub_socket, "publication", pub_data)
+        self.replicate_data(pub_socket, "publication", pub_data, payload)
         
         self.message_count += 1
         
@@ -409,30 +1136,25 @@ class Server:
                 }
             }
         
-        # Publica no tópico do usuário
+        # Um único registro, codificado uma vez: assinante, log e replicação usam os mesmos bytes
         self.increment_clock()
-        private_message = {
+        msg_data = {
             "src": src,
+            "dst": dst,
             "message": message,
             "timestamp": timestamp,
             "clock": self.logical_clock
         }
+        payload = self.encode_record(msg_data)
         
-        pub_message = msgpack.packb(private_message)
-        pub_socket.send_multipart([dst.encode(), pub_message])
+        # Publica no tópico do usuário
+        self.fanout(pub_socket, dst, msg_data, src, payload)
         
         # Salva mensagem
-        msg_data = {
-            "src": src,
-            "dst": dst,
-            "message": message,
-            "timestamp": timestamp,
-            "clock": self.logical_clock
-        }
-        self.save_message(msg_data)
+        self.save_message(msg_data, payload=payload)
         
         # Replica para outros servidores
-        self.replicate_data(pub_socket, "message", msg_data)
+        self.replicate_data(pub_socket, "message", msg_data, payload)
         
         self.message_count += 1
         
@@ -445,110 +1167,582 @@ class Server:
             }
         }
 
+    def invalid_read(self, data, field):
+        """Motivo pelo qual os argumentos de uma leitura paginada são inválidos, ou None"""
+        if not isinstance(data.get(field), str):
+            return "Canal inválido" if field == "channel" else "Usuário inválido"
+        if not optional_int(data.get("limit")):
+            return "Limite inválido"
+        if not all(valid_cursor(data[name]) for name in ("before", "after") if data.get(name)):
+            return "Cursor inválido"
+        return None
+
+    def handle_history(self, data):
+        """Retorna a última página do histórico de um canal"""
+        self.update_clock(data.get("clock", 0))
+
+        channel = data.get("channel")
+
+        invalid = self.invalid_read(data, "channel")
+        if invalid or channel not in self.channels:
+            self.increment_clock()
+            return {
+                "service": "history",
+                "data": {
+                    "status": "erro",
+                    "message": invalid or "Canal não existe",
+                    "timestamp": datetime.now().isoformat(),
+                    "clock": self.logical_clock
+                }
+            }
+
+        if not data.get("forwarded") and not self.owns(channel):
+            response = self.forward_read(channel, "history", data)
+            if response is not None:
+                return response
+
+        pointers, cursor = self.channel_index.page(
+            channel, data.get("limit", 100), data.get("before"), data.get("after"))
+        publications = self.read_records(self.storage.publications, pointers)
+
+        self.increment_clock()
+        return {
+            "service": "history",
+            "data": {
+                "status": "OK",
+                "channel": channel,
+                "publications": publications,
+                "cursor": cursor,
+                "timestamp": datetime.now().isoformat(),
+                "clock": self.logical_clock
+            }
+        }
+
+    def handle_inbox(self, data):
+        """Retorna a última página de mensagens privadas recebidas por um usuário"""
+        self.update_clock(data.get("clock", 0))
+
+        user = data.get("user")
+
+        invalid = self.invalid_read(data, "user")
+        if invalid or user not in self.users:
+            self.increment_clock()
+            return {
+                "service": "inbox",
+                "data": {
+                    "status": "erro",
+                    "message": invalid or "Usuário não existe",
+                    "timestamp": datetime.now().isoformat(),
+                    "clock": self.logical_clock
+                }
+            }
+
+        if not data.get("forwarded") and not self.owns(user):
+            response = self.forward_read(user, "inbox", data)
+            if response is not None:
+                return response
+
+        pointers, cursor = self.inbox_index.page(
+            user, data.get("limit", 100), data.get("before"), data.get("after"))
+        messages = self.read_records(self.storage.messages, pointers)
+
+        self.increment_clock()
+        return {
+            "service": "inbox",
+            "data": {
+                "status": "OK",
+                "user": user,
+                "messages": messages,
+                "cursor": cursor,
+                "timestamp": datetime.now().isoformat(),
+                "clock": self.logical_clock
+            }
+        }
+
+    def handle_fetch(self, data):
+        """Entrega em lote as mensagens privadas ainda não confirmadas de um usuário
+
+        Começa depois da marca confirmada com `ack` (ou de `after`) e devolve o cursor
+        da última mensagem do lote, a ser confirmado, e quantas ainda restam.
+        """
+        self.update_clock(data.get("clock", 0))
+
+        user = data.get("user")
+
+        invalid = self.invalid_read(data, "user")
+        if invalid or user not in self.users:
+            self.increment_clock()
+            return {
+                "service": "fetch",
+                "data": {
+                    "status": "erro",
+                    "message": invalid or "Usuário não existe",
+                    "timestamp": datetime.now().isoformat(),
+                    "clock": self.logical_clock
+                }
+            }
+
+        if not data.get("forwarded") and not self.owns(user):
+            response = self.forward_read(user, "fetch", data)
+            if response is not None:
+                return response
+
+        messages, cursor, pending = self.delivery.fetch(
+            user, data.get("limit", DELIVERY_FETCH_LIMIT), data.get("after"))
+
+        self.increment_clock()
+        return {
+            "service": "fetch",
+            "data": {
+                "status": "OK",
+                "user": user,
+                "messages": messages,
+                "cursor": cursor,
+                "pending": pending,
+                "timestamp": datetime.now().isoformat(),
+                "clock": self.logical_clock
+            }
+        }
+
+    def handle_ack(self, data, pub_socket=None):
+        """Confirma a entrega das mensagens de um usuário até `cursor` (vale em todas as réplicas)"""
+        self.update_clock(data.get("clock", 0))
+
+        user = data.get("user")
+        cursor = data.get("cursor")
+
+        known = isinstance(user, str) and user in self.users
+        if not known or not valid_cursor(cursor):
+            self.increment_clock()
+            return {
+                "service": "ack",
+                "data": {
+                    "status": "erro",
+                    "message": "Cursor inválido" if known else "Usuário não existe",
+                    "timestamp": datetime.now().isoformat(),
+                    "clock": self.logical_clock
+                }
+            }
+
+        if self.delivery.advance(user, cursor):
+            # Numerada (origem, seq) como as demais mutações: lacunas são refeitas pelo sync
+            record = self.save_ack(user, self.delivery.cursor(user))
+            if pub_socket:
+                self.replicate_data(pub_socket, "ack", record)
+
+        self.increment_clock()
+        return {
+            "service": "ack",
+            "data": {
+                "status": "OK",
+                "cursor": self.delivery.cursor(user),
+                "timestamp": datetime.now().isoformat(),
+                "clock": self.logical_clock
+            }
+        }
+
+    def handle_subscription(self, frames):
+        """Processa notificações de coordenador e mensagens de replicação"""
+        topic_str = frames[0].decode()
+        data = msgpack.unpackb(frames[1], raw=False)
+        self.update_clock(data.get("clock", 0))
+        
+        if topic_str == "replication" and len(frames) == 3:
+            # Lote: [tópico, cabeçalho, operações (possivelmente comprimidas)]
+            self.handle_replication_batch(data, frames[2])
+            return
+        
+        if topic_str == "servers":
+            self.coordinator = data.get("coordinator")
+            coordinator_rank = data.get("rank", "?")
+            is_coordinator = (self.coordinator == self.server_name)
+            status = "EU SOU O COORDENADOR!" if is_coordinator else f"Coordenador é {self.coordinator}"
+            self.log.info(f"⚡ ELEIÇÃO: {status} (rank={coordinator_rank}, Clock={self.logical_clock})")
+        elif topic_str == "replication":
+            self.handle_replication(data)
+
+    def handle_batch(self, data, pub_socket=None):
+        """Executa uma lista de operações e retorna uma resposta por operação"""
+        self.update_clock(data.get("clock", 0))
+
+        operations = data.get("operations")
+        if not isinstance(operations, list) or len(operations) > MAX_BATCH_OPERATIONS:
+            self.increment_clock()
+            return {
+                "service": "batch",
+                "data": {
+                    "status": "erro",
+                    "timestamp": datetime.now().isoformat(),
+                    "clock": self.logical_clock,
+                    "description": f"Lote inválido (máximo de {MAX_BATCH_OPERATIONS} operações)"
+                }
+            }
+
+        responses = []
+        for operation in operations:
+            service = operation.get("service") if isinstance(operation, dict) else None
+            if service == "batch":
+                self.increment_clock()
+                responses.append({
+                    "service": service,
+                    "data": {
+                        "status": "erro",
+                        "timestamp": datetime.now().isoformat(),
+                        "clock": self.logical_clock,
+                        "description": "Lotes aninhados não são permitidos"
+                    }
+                })
+                continue
+            try:
+                responses.append(self.dispatch(service, operation.get("data", {}), pub_socket))
+            except Exception as e:
+                self.increment_clock()
+                responses.append({
+                    "service": service,
+                    "data": {
+                        "status": "erro",
+                        "timestamp": datetime.now().isoformat(),
+                        "clock": self.logical_clock,
+                        "description": f"Erro interno: {e}"
+                    }
+                })
+
+        self.increment_clock()
+        return {
+            "service": "batch",
+            "data": {
+                "status": "OK",
+                "responses": responses,
+                "timestamp": datetime.now().isoformat(),
+                "clock": self.logical_clock
+            }
+        }
+
+    def dispatch(self, service, data, pub_socket=None, peer=False):
+        """Encaminha a requisição para o handler do serviço (peer: recebida na porta de pares)"""
+        if service in CONTROL_SERVICES and not peer:
+            self.increment_clock()
+            return {
+                "service": service,
+                "data": {
+                    "status": "erro",
+                    "timestamp": datetime.now().isoformat(),
+                    "clock": self.logical_clock,
+                    "description": f"Serviço {service} atendido apenas na porta de pares"
+                }
+            }
+        if service == "login":
+            return self.handle_login(data, pub_socket)
+        elif service == "users":
+            return self.handle_users(data)
+        elif service == "channel":
+            return self.handle_channel(data, pub_socket)
+        elif service == "channels":
+            return self.handle_channels(data)
+        elif service == "publish":
+            return self.handle_publish(data, pub_socket)
+        elif service == "message":
+            return self.handle_message(data, pub_socket)
+        elif service == "history":
+            return self.handle_history(data)
+        elif service == "inbox":
+            return self.handle_inbox(data)
+        elif service == "fetch":
+            return self.handle_fetch(data)
+        elif service == "ack":
+            return self.handle_ack(data, pub_socket)
+        elif service == "batch":
+            return self.handle_batch(data, pub_socket)
+        elif service == "sync":
+            return self.handle_sync(data)
+        elif service == "stats":
+            return self.handle_stats(data)
+        elif service == "profile":
+            return self.handle_profile(data)
+
+        self.increment_clock()
+        return {
+            "service": service,
+            "data": {
+                "status": "erro",
+                "timestamp": datetime.now().isoformat(),
+                "clock": self.logical_clock,
+                "description": f"Serviço desconhecido: {service}"
+            }
+        }
+
+    def handle_stats(self, data):
+        """Métricas deste servidor (`format`: "summary" ou "prometheus")"""
+        self.update_clock(data.get("clock", 0))
+        response = {"status": "OK", "server": self.server_name}
+        if data.get("format") == "prometheus":
+            response["text"] = self.metrics.prometheus()
+        else:
+            response["metrics"] = self.metrics.snapshot()
+            response["storage"] = self.storage.metrics() if self.storage else {}
+            response["replication"] = self.replication.metrics()
+            response["delivery"] = self.delivery.metrics() if self.delivery else {}
+            response["retention"] = self.compactor.metrics() if self.compactor else {}
+            response["responses"] = self.responses.metrics()
+            response["ordering"] = self.ordering.metrics()
+        self.increment_clock()
+        response["timestamp"] = datetime.now().isoformat()
+        response["clock"] = self.logical_clock
+        return {"service": "stats", "data": response}
+
+    def handle_profile(self, data):
+        """Liga/desliga o perfilamento e o amostrador de pilhas em execução"""
+        self.update_clock(data.get("clock", 0))
+        try:
+            response = {"status": "OK", "server": self.server_name, **self.profiler.control(data)}
+        except (ValueError, OSError) as e:
+            response = {"status": "erro", "description": str(e)}
+        self.increment_clock()
+        response["timestamp"] = datetime.now().isoformat()
+        response["clock"] = self.logical_clock
+        return {"service": "profile", "data": response}
+
+    def encode_response(self, response, compact):
+        """Codifica a resposta na versão do protocolo usada pela requisição"""
+        if compact:
+            return wire.encode_response(response["service"], response["data"])
+        return wire.pack_response(response)
+
+    def error_response(self, message, error):
+        """Resposta de erro interno na versão do protocolo da requisição (v1 se ela não foi decodificada)"""
+        service = None
+        if isinstance(message, (dict, list)):
+            try:
+                service = wire.request_service(message)
+            except TypeError:
+                # Código de serviço v2 inválido (não hashable)
+                pass
+        self.increment_clock()
+        return self.encode_response({
+            "service": service,
+            "data": {
+                "status": "erro",
+                "timestamp": datetime.now().isoformat(),
+                "clock": self.logical_clock,
+                "description": f"Erro interno: {error}"
+            }
+        }, wire.is_compact(message))
+
+    def process_request(self, message, pub_socket=None, decode_seconds=0.0, peer=False):
+        """Trata e codifica uma requisição já decodificada (decode_seconds: tempo do decode, para o perfil)"""
+        compact = wire.is_compact(message)
+        if compact:
+            service, data = wire.decode_request(message)
+        else:
+            service = message.get("service")
+            data = message.get("data", {})
+        if self.log.enabled("debug"):
+            self.log.debug(f"Clock={self.logical_clock} Recebido: {service}", key="request")
+        trace = self.profiler.begin(service)
+        start = time.perf_counter()
+        response = self.dispatch(service, data, pub_socket, peer)
+        elapsed = time.perf_counter() - start
+        label = service if service in SERVICES else "desconhecido"
+        self.metrics.observe("request_seconds", label, elapsed)
+        self.metrics.inc("requests_total", label)
+        if response["data"].get("status") == "erro":
+            self.metrics.inc("request_errors_total", label)
+        if trace is None:
+            return self.encode_response(response, compact)
+
+        trace.add("decode", decode_seconds)
+        trace.add("handler", elapsed)
+        start = time.perf_counter()
+        response_bytes = self.encode_response(response, compact)
+        trace.add("encode", time.perf_counter() - start)
+        self.profiler.end(trace)
+        return response_bytes
+
+    def connect_broker(self, context, capacity):
+        """Conecta ao broker (modo lb) e anuncia quantas requisições pode atender"""
+        socket = context.socket(zmq.DEALER)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(BROKER_BACKEND)
+        socket.send_multipart([PPP_READY, str(capacity).encode()])
+        return socket
+
+    def serve_frontend(self, context):
+        """Distribui requisições do broker entre os workers"""
+        backend = context.socket(zmq.DEALER)
+        backend.bind("inproc://workers")
+
+        if BROKER_MODE == "proxy":
+            # Broker round-robin: ROUTER -> DEALER sem controle de carga
+            frontend = context.socket(zmq.ROUTER)
+            frontend.connect(BROKER_BACKEND)
+            zmq.proxy(frontend, backend)
+            return
+
+        frontend = self.connect_broker(context, SERVER_WORKERS)
+        poller = zmq.Poller()
+        poller.register(frontend, zmq.POLLIN)
+        poller.register(backend, zmq.POLLIN)
+        last_seen = time.monotonic()
+        heartbeat_at = last_seen + HEARTBEAT_INTERVAL
+
+        while True:
+            socks = dict(poller.poll(HEARTBEAT_INTERVAL * 1000))
+            now = time.monotonic()
+
+            if frontend in socks:
+                frames = frontend.recv_multipart()
+                last_seen = now
+                # Heartbeats do broker não têm delimitador; requisições têm
+                if b"" in frames:
+                    backend.send_multipart(frames)
+
+            if backend in socks:
+                frontend.send_multipart(backend.recv_multipart())
+
+            if now >= heartbeat_at:
+                frontend.send(PPP_HEARTBEAT)
+                heartbeat_at = now + HEARTBEAT_INTERVAL
+
+            if now - last_seen > HEARTBEAT_INTERVAL * HEARTBEAT_LIVENESS:
+                self.log.warning("Broker sem resposta, reconectando...")
+                poller.unregister(frontend)
+                frontend.close()
+                time.sleep(RECONNECT_INTERVAL)
+                frontend = self.connect_broker(context, SERVER_WORKERS)
+                poller.register(frontend, zmq.POLLIN)
+                last_seen = time.monotonic()
+
+    def worker(self, context, worker_id):
+        """Atende leituras localmente e encaminha mutações para a thread dona do estado"""
+        socket = context.socket(zmq.REP)
+        socket.connect("inproc://workers")
+        owner = context.socket(zmq.REQ)
+        owner.connect("inproc://owner")
+
+        while True:
+            message_bytes = socket.recv()
+            message = None
+            try:
+                start = time.perf_counter()
+                message = msgpack.unpackb(message_bytes, raw=False)
+                decode_seconds = time.perf_counter() - start
+                if is_write_request(message):
+                    start = time.perf_counter()
+                    self.metrics.add("owner_queue_depth", 1)
+                    try:
+                        owner.send(message_bytes)
+                        response_bytes = owner.recv()
+                    finally:
+                        self.metrics.add("owner_queue_depth", -1)
+                    self.metrics.observe("owner_wait_seconds", wire.request_service(message), time.perf_counter() - start)
+                else:
+                    response_bytes = self.process_request(message, decode_seconds=decode_seconds)
+            except Exception as e:
+                self.log.error(f"worker {worker_id}: Erro: {e}", key="worker_error")
+                response_bytes = self.error_response(message, e)
+            socket.send(response_bytes)
+
     def run(self):
-        self.ensure_data_dir()
-        self.users = self.load_users()
-        self.channels = self.load_channels()
+        self.load_state()
+        if METRICS_PORT:
+            self.metrics.serve_http(METRICS_PORT)
         
         context = zmq.Context()
         
-        # Socket REP para requisições do broker
-        rep_socket = context.socket(zmq.REP)
-        rep_socket.connect("tcp://broker:5556")
+        # Socket ROUTER interno que recebe as mutações encaminhadas pelos workers
+        owner_socket = context.socket(zmq.ROUTER)
+        owner_socket.bind("inproc://owner")
+
+        # Aviso de chamadas enfileiradas pela thread de sincronização (on_owner)
+        calls_socket = context.socket(zmq.PULL)
+        calls_socket.bind("inproc://owner-calls")
         
-        # Socket PUB para publicações no proxy
-        pub_socket = context.socket(zmq.PUB)
-        pub_socket.connect("tcp://proxy:5557")
+        # Publicações no proxy (shard do tópico) e replicação no plano de controle
+        pub_socket = Publisher(context)
         
-        # Socket SUB para receber coordenador e replicação
-        sub_socket = context.socket(zmq.SUB)
-        sub_socket.connect("tcp://proxy:5558")
-        sub_socket.subscribe("servers")
-        sub_socket.subscribe("replication")
+        # Socket SUB do plano de controle: coordenador e replicação
+        sub_socket = control_subscriber(context)
         
         # Socket REQ para comunicação com servidor de referência
         ref_socket = context.socket(zmq.REQ)
-        ref_socket.connect("tcp://reference:5559")
+        ref_socket.connect(REFERENCE_ADDR)
         
         # Registra no servidor de referência
         self.register_with_reference(ref_socket)
         self.get_servers_list(ref_socket)
         
+        # Atende sincronização de outras réplicas e recupera o que perdeu enquanto esteve fora
+        threading.Thread(target=self.serve_peers, args=(context,), daemon=True).start()
+        self.catch_up(context)
+        self.owner_thread = threading.current_thread()
+        threading.Thread(target=self.sync_loop, args=(context,), daemon=True).start()
+        self.compactor.start()
+        
         # Inicia thread de heartbeat
         heartbeat_thread = threading.Thread(target=self.send_heartbeat, args=(ref_socket,), daemon=True)
         heartbeat_thread.start()
         
-        print(f"Servidor {self.server_name} (rank={self.rank}) iniciado, Clock: {self.logical_clock}")
+        # Inicia o pool de workers e o frontend conectado ao broker
+        for worker_id in range(SERVER_WORKERS):
+            threading.Thread(target=self.worker, args=(context, worker_id), daemon=True).start()
+        threading.Thread(target=self.serve_frontend, args=(context,), daemon=True).start()
+        
+        self.log.info(f"Servidor {self.server_name} (rank={self.rank}, workers={SERVER_WORKERS}) iniciado, Clock: {self.logical_clock}")
         
         # Poller para múltiplos sockets
         poller = zmq.Poller()
-        poller.register(rep_socket, zmq.POLLIN)
+        poller.register(owner_socket, zmq.POLLIN)
         poller.register(sub_socket, zmq.POLLIN)
+        poller.register(calls_socket, zmq.POLLIN)
         
         while True:
             try:
-                socks = dict(poller.poll(timeout=1000))
+                socks = dict(poller.poll(timeout=self.ordering.timeout_ms(self.replication.timeout_ms(1000))))
                 
-                # Processa requisições dos clientes
-                if rep_socket in socks:
-                    message_bytes = rep_socket.recv()
-                    message = msgpack.unpackb(message_bytes, raw=False)
-                    
-                    service = message.get("service")
-                    data = message.get("data", {})
-                    
-                    print(f"[{self.server_name} Clock={self.logical_clock}] Recebido: {service}")
-                    
-                    if service == "login":
-                        response = self.handle_login(data, pub_socket)
-                    elif service == "users":
-                        response = self.handle_users(data)
-                    elif service == "channel":
-                        response = self.handle_channel(data, pub_socket)
-                    elif service == "channels":
-                        response = self.handle_channels(data)
-                    elif service == "publish":
-                        response = self.handle_publish(data, pub_socket)
-                    elif service == "message":
-                        response = self.handle_message(data, pub_socket)
-                    else:
-                        self.increment_clock()
-                        response = {
-                            "service": service,
-                            "data": {
-                                "status": "erro",
-                                "timestamp": datetime.now().isoformat(),
-                                "clock": self.logical_clock,
-                                "description": f"Serviço desconhecido: {service}"
-                            }
-                        }
-                    
-                    response_bytes = msgpack.packb(response)
-                    rep_socket.send(response_bytes)
+                # Processa mutações encaminhadas pelos workers
+                if owner_socket in socks:
+                    worker_address, empty, message_bytes = owner_socket.recv_multipart()
+                    message = None
+                    try:
+                        start = time.perf_counter()
+                        message = msgpack.unpackb(message_bytes, raw=False)
+                        response_bytes = self.process_request(message, pub_socket, time.perf_counter() - start)
+                    except Exception as e:
+                        # Sempre responde: o worker fica bloqueado no REQ até receber a resposta
+                        self.log.error(f"Erro: {e}", key="request_error")
+                        response_bytes = self.error_response(message, e)
+                    owner_socket.send_multipart([worker_address, empty, response_bytes])
                 
                 # Recebe notificação de novo coordenador ou replicação
                 if sub_socket in socks:
-                    topic, msg = sub_socket.recv_multipart()
-                    topic_str = topic.decode()
-                    data = msgpack.unpackb(msg, raw=False)
-                    self.update_clock(data.get("clock", 0))
-                    
-                    if topic_str == "servers":
-                        self.coordinator = data.get("coordinator")
-                        coordinator_rank = data.get("rank", "?")
-                        is_coordinator = (self.coordinator == self.server_name)
-                        status = "EU SOU O COORDENADOR!" if is_coordinator else f"Coordenador é {self.coordinator}"
-                        print(f"[{self.server_name}] ⚡ ELEIÇÃO: {status} (rank={coordinator_rank}, Clock={self.logical_clock})")
-                    elif topic_str == "replication":
-                        self.handle_replication(data)
+                    self.handle_subscription(sub_socket.recv_multipart())
+
+                # Leituras e aplicações pedidas pela thread de sincronização
+                if calls_socket in socks:
+                    while calls_socket.poll(0):
+                        calls_socket.recv()
+                self.run_owner_calls()
+
+                self.flush_replication(pub_socket)
+
+                self.release_ordered()
+
+                self.maybe_snapshot()
+
+                self.maybe_compact()
                     
             except Exception as e:
-                print(f"Erro: {e}")
+                self.log.error(f"Erro: {e}")
                 import traceback
                 traceback.print_exc()
 
 if __name__ == "__main__":
     import sys
-    server_name = sys.argv[1] if len(sys.argv) > 1 else None
-    server = Server(server_name)
-    server.run()
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    server_name = args[0] if args else None
+    if "--asyncio" in sys.argv or SERVER_RUNTIME == "asyncio":
+        from async_server import AsyncServer
+        AsyncServer(server_name).run()
+    else:
+        server = Server(server_name)
+        server.run()
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""Instrumentação do servidor: contadores, histogramas de latência e log com níveis
+
+Os histogramas seguem a ideia do HdrHistogram: baldes log-lineares (cada potência de
+dois de microssegundos dividida em HISTOGRAM_SUB_BUCKETS faixas iguais), então
+registrar uma amostra custa um cálculo de índice e um incremento, e os percentis
+têm erro relativo limitado independentemente da escala.
+
+Uso pela linha de comando (consulta a porta de pares de um servidor):
+  python metrics.py tcp://localhost:5560 [prometheus]
+"""
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import msgpack
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "info")  # debug | info | warning | error
+LOG_RATE_LIMIT = float(os.environ.get("LOG_RATE_LIMIT", 20))  # linhas/s por tipo de mensagem (0: sem limite)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))  # HTTP /metrics para o Prometheus (0: desligado)
+
+HISTOGRAM_SUB_BUCKETS = 8  # erro relativo máximo de 1/8 por balde
+HISTOGRAM_MAX_POWER = 40   # até 2^40 us (~12 dias)
+# Limites (em segundos) dos baldes exportados para o Prometheus
+PROMETHEUS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+
+def bucket_index(micros):
+    """Índice do balde log-linear de um valor em microssegundos"""
+    if micros < HISTOGRAM_SUB_BUCKETS:
+        return micros
+    power = micros.bit_length() - 1
+    shift = power - 3  # HISTOGRAM_SUB_BUCKETS = 2^3
+    return (power - 2) * HISTOGRAM_SUB_BUCKETS + (micros >> shift) - HISTOGRAM_SUB_BUCKETS
+
+
+def bucket_upper(index):
+    """Maior valor (em microssegundos) do balde"""
+    if index < HISTOGRAM_SUB_BUCKETS:
+        return index
+    power = index // HISTOGRAM_SUB_BUCKETS + 2
+    offset = index % HISTOGRAM_SUB_BUCKETS + HISTOGRAM_SUB_BUCKETS
+    return ((offset + 1) << (power - 3)) - 1
+
+
+class Histogram:
+    """Histograma de latências em baldes log-lineares de microssegundos"""
+
+    def __init__(self):
+        self.counts = [0] * ((HISTOGRAM_MAX_POWER - 1) * HISTOGRAM_SUB_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        index = min(bucket_index(max(0, int(seconds * 1_000_000))), len(self.counts) - 1)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, fraction):
+        """Limite superior (em segundos) do balde que contém o percentil"""
+        if not self.count:
+            return 0.0
+        target = max(1, int(self.count * fraction + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(bucket_upper(index) / 1_000_000, self.max)
+        return self.max
+
+    def cumulative(self, bounds):
+        """Contagens acumuladas até cada limite (em segundos), para o formato Prometheus"""
+        result = []
+        index = 0
+        seen = 0
+        for bound in bounds:
+            micros = bound * 1_000_000
+            while index < len(self.counts) and bucket_upper(index) <= micros:
+                seen += self.counts[index]
+                index += 1
+            result.append(seen)
+        return result
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.50) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "p999_ms": round(self.percentile(0.999) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class Metrics:
+    """Registro de métricas do servidor
+
+    Cada métrica tem um nome e no máximo um rótulo (ex.: service="publish"). Gauges
+    são funções avaliadas apenas quando as métricas são lidas.
+    """
+
+    def __init__(self, prefix="chat"):
+        self.prefix = prefix
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.counters = {}    # {(nome, valor do rótulo): valor}
+        self.histograms = {}  # {(nome, valor do rótulo): Histogram}
+        self.gauges = {}      # {nome: função}
+        self.levels = {}      # {nome: valor} de gauges atualizados por incremento
+        self.labels = {}      # {nome: nome do rótulo}
+        self.help = {}
+
+    def describe(self, name, help_text, label=None):
+        self.help[name] = help_text
+        if label:
+            self.labels[name] = label
+
+    def inc(self, name, label=None, value=1):
+        key = (name, label)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, label, seconds):
+        key = (name, label)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        histogram.record(seconds)
+
+    def add(self, name, delta):
+        """Soma delta a um gauge incremental (ex.: profundidade de fila)"""
+        with self.lock:
+            self.levels[name] = self.levels.get(name, 0) + delta
+
+    def level(self, name):
+        return self.levels.get(name, 0)
+
+    def gauge(self, name, function, help_text=""):
+        self.gauges[name] = function
+        self.help.setdefault(name, help_text)
+
+    def snapshot(self):
+        """Métricas em um dicionário para o serviço stats"""
+        counters = {}
+        for (name, label), value in sorted(self.counters.items(), key=lambda item: str(item[0])):
+            if label is None:
+                counters[name] = value
+            else:
+                counters.setdefault(name, {})[label] = value
+        histograms = {}
+        for (name, label), histogram in sorted(self.histograms.items(), key=lambda item: str(item[0])):
+            if label is None:
+                histograms[name] = histogram.summary()
+            else:
+                histograms.setdefault(name, {})[label] = histogram.summary()
+        return {
+            "uptime": round(time.time() - self.started, 1),
+            "counters": counters,
+            "histograms": histograms,
+            "gauges": {name: function() for name, function in self.gauges.items()},
+        }
+
+    def prometheus(self):
+        """Métricas no formato de texto do Prometheus"""
+        lines = []
+
+        def header(name, kind):
+            if self.help.get(name):
+                lines.append(f"# HELP {self.prefix}_{name} {self.help[name]}")
+            lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+        def labels(name, label, extra=""):
+            parts = []
+            if label is not None:
+                parts.append(f'{self.labels.get(name, "label")}="{label}"')
+            if extra:
+                parts.append(extra)
+            return "{" + ",".join(parts) + "}" if parts else ""
+
+        for name in sorted({name for name, _ in self.counters}):
+            header(name, "counter")
+            for (metric, label), value in self.counters.items():
+                if metric == name:
+                    lines.append(f"{self.prefix}_{name}{labels(name, label)} {value}")
+
+        for name in sorted({name for name, _ in self.histograms}):
+            header(name, "histogram")
+            for (metric, label), histogram in self.histograms.items():
+                if metric != name:
+                    continue
+                for bound, count in zip(PROMETHEUS_BUCKETS, histogram.cumulative(PROMETHEUS_BUCKETS)):
+                    bucket_labels = labels(name, label, 'le="%s"' % bound)
+                    lines.append(f"{self.prefix}_{name}_bucket{bucket_labels} {count}")
+                bucket_labels = labels(name, label, 'le="+Inf"')
+                lines.append(f"{self.prefix}_{name}_bucket{bucket_labels} {histogram.count}")
+                lines.append(f"{self.prefix}_{name}_sum{labels(name, label)} {histogram.total}")
+                lines.append(f"{self.prefix}_{name}_count{labels(name, label)} {histogram.count}")
+
+        for name, function in sorted(self.gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{self.prefix}_{name} {function()}")
+
+        return "\n".join(lines) + "\n"
+
+    def serve_http(self, port=METRICS_PORT):
+        """Expõe /metrics em HTTP (para o Prometheus) em uma thread própria"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class Logger:
+    """Log com níveis e limite de taxa por tipo de mensagem
+
+    Mensagens frequentes (uma por requisição ou por lote) passam um `key`; quando um
+    tipo excede LOG_RATE_LIMIT linhas por segundo, as seguintes são descartadas e a
+    quantidade descartada aparece na próxima linha impressa daquele tipo.
+    """
+
+    def __init__(self, name, level=LOG_LEVEL, rate_limit=LOG_RATE_LIMIT):
+        self.name = name
+        self.level = LEVELS.get(level, LEVELS["info"])
+        self.rate_limit = rate_limit
+        self.windows = {}  # {key: [início da janela, linhas na janela, descartadas]}
+        self.lock = threading.Lock()
+
+    def enabled(self, level):
+        return LEVELS[level] >= self.level
+
+    def log(self, level, message, key=None):
+        if LEVELS[level] < self.level:
+            return
+        suffix = ""
+        if self.rate_limit > 0:
+            key = key or message
+            now = time.monotonic()
+            with self.lock:
+                window = self.windows.get(key)
+                if window is None or now - window[0] >= 1.0:
+                    dropped = window[2] if window else 0
+                    window = self.windows[key] = [now, 0, 0]
+                    if dropped:
+                        suffix = f" ({dropped} mensagens semelhantes suprimidas)"
+                    if len(self.windows) > 1024:
+                        self.windows = {key: window}
+                if window[1] >= self.rate_limit:
+                    window[2] += 1
+                    return
+                window[1] += 1
+        print(f"[{self.name}] {message}{suffix}")
+
+    def debug(self, message, key=None):
+        self.log("debug", message, key)
+
+    def info(self, message, key=None):
+        self.log("info", message, key)
+
+    def warning(self, message, key=None):
+        self.log("warning", message, key)
+
+    def error(self, message, key=None):
+        self.log("error", message, key)
+
+
+def print_stats(address, output="summary"):
+    """Consulta o serviço stats de um servidor (porta de pares) e imprime o resultado"""
+    import zmq
+
+    context = zmq.Context()
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.RCVTIMEO, 5000)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(address)
+    socket.send(msgpack.packb({"service": "stats", "data": {"format": output}}))
+    data = msgpack.unpackb(socket.recv(), raw=False)["data"]
+    if output == "prometheus":
+        print(data["text"], end="")
+        return
+
+    print(f"{data['server']}: uptime {data['metrics']['uptime']}s")
+    for name, value in data["metrics"]["gauges"].items():
+        print(f"  {name} = {value}")
+    for name, value in data["metrics"]["counters"].items():
+        print(f"  {name} = {value}")
+    for name, histograms in data["metrics"]["histograms"].items():
+        for label, summary in (histograms.items() if "count" not in histograms else [(None, histograms)]):
+            title = f"{name}[{label}]" if label is not None else name
+            print(f"  {title} n={summary['count']} p50={summary['p50_ms']}ms "
+                  f"p99={summary['p99_ms']}ms p999={summary['p999_ms']}ms máx={summary['max_ms']}ms")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Uso: python metrics.py tcp://<servidor>:<PEER_PORT> [prometheus]")
+    print_stats(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "summary")
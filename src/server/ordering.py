@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""Relógios vetoriais e entrega causal da replicação entre servidores
+
+O relógio de Lamport escalar (Server.update_clock) ordena os eventos de forma
+consistente com a causalidade, mas não distingue operações concorrentes, e os lotes
+de replicação eram aplicados na ordem de chegada: se B publica depois de aplicar uma
+publicação de A, um terceiro servidor podia receber (e repassar aos assinantes) a de B
+antes da de A.
+
+A componente de cada origem no vetor é o seq das suas mutações (ver sync.ReplicaLog),
+então o vetor local é o próprio `applied` da réplica, mantido também em forma de
+array. Cada lote de replicação leva em `deps` o vetor da origem no momento do envio
+(sem a componente da própria origem, já coberta pelo seq); o receptor só aplica o
+lote quando o seu vetor cobre `deps`. Lotes que chegam antes das suas dependências
+ficam em um buffer por origem (a ordem de cada origem é preservada) e são liberados
+assim que as dependências chegam, pela replicação ao vivo ou pela sincronização.
+
+Janela de reordenação: um lote que espera mais que ORDERING_WINDOW_MS marca as origens
+que faltam para sincronização; depois de ORDERING_MAX_WAIT_MS, ou com mais de
+ORDERING_MAX_PENDING operações em espera, o lote mais antigo é aplicado mesmo assim
+(como na ordem de chegada) para que a falha de um par não pare a replicação.
+"""
+import os
+import time
+from array import array
+from collections import deque
+from itertools import compress
+from operator import gt, lt
+
+ORDERING = os.environ.get("ORDERING", "causal")                              # causal | arrival
+ORDERING_WINDOW_MS = float(os.environ.get("ORDERING_WINDOW_MS", 200))        # espera antes de sincronizar
+ORDERING_MAX_WAIT_MS = float(os.environ.get("ORDERING_MAX_WAIT_MS", 5000))   # espera máxima de um lote
+ORDERING_MAX_PENDING = int(os.environ.get("ORDERING_MAX_PENDING", 50000))    # operações em espera
+
+# Resultado de VectorClock.compare()
+BEFORE = "before"
+AFTER = "after"
+EQUAL = "equal"
+CONCURRENT = "concurrent"
+
+
+class ReplicaIds:
+    """Posição de cada origem nos vetores; compartilhada pelos relógios do processo"""
+
+    def __init__(self):
+        self.slots = {}
+        self.names = []
+
+    def slot(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = len(self.names)
+            self.names.append(name)
+        return slot
+
+
+REPLICAS = ReplicaIds()
+
+
+class VectorClock:
+    """Relógio vetorial em um array('Q') indexado pela posição da origem em ReplicaIds
+
+    A forma compacta não é mais rápida que um dicionário {origem: seq}: em
+    benchmark/clocks.py, merge é mais lento e covers fica próximo. O custo é pago uma
+    vez por lote de replicação. Vetores de tamanhos diferentes valem zero nas posições
+    ausentes.
+    """
+    __slots__ = ("values", "ids")
+
+    def __init__(self, values=None, ids=REPLICAS):
+        self.values = array("Q", values or ())
+        self.ids = ids
+
+    @classmethod
+    def from_dict(cls, mapping, ids=REPLICAS):
+        """Vetor a partir da forma de transmissão {origem: seq}"""
+        clock = cls(ids=ids)
+        if mapping:
+            slots = list(map(ids.slots.get, mapping))
+            if None in slots:
+                slots = [ids.slot(name) for name in mapping]
+            values = clock.values = array("Q", bytes(8 * (max(slots) + 1)))
+            for slot, value in zip(slots, mapping.values()):
+                values[slot] = value
+        return clock
+
+    def to_dict(self, exclude=None):
+        """Forma de transmissão {origem: seq}, só com as componentes não nulas"""
+        names = self.ids.names
+        return {names[slot]: value for slot, value in enumerate(self.values)
+                if value and names[slot] != exclude}
+
+    def get(self, name):
+        slot = self.ids.slots.get(name)
+        return self.values[slot] if slot is not None and slot < len(self.values) else 0
+
+    def advance(self, name, value):
+        """Componente da origem = max(atual, value)"""
+        slot = self.ids.slot(name)
+        values = self.values
+        if slot >= len(values):
+            values.extend([0] * (slot + 1 - len(values)))
+        if value > values[slot]:
+            values[slot] = value
+
+    def copy(self):
+        return VectorClock(self.values, self.ids)
+
+    def merge(self, other):
+        """Máximo componente a componente (recebimento de um evento)"""
+        a, b = self.values, other.values
+        if len(b) > len(a):
+            a.extend([0] * (len(b) - len(a)))
+        # Só as posições em que other está à frente são escritas
+        for slot in compress(range(len(b)), map(gt, b, a)):
+            a[slot] = b[slot]
+
+    def covers(self, other):
+        """Indica se todo evento conhecido por other também é conhecido por este vetor"""
+        a, b = self.values, other.values
+        if any(map(lt, a, b)):
+            return False
+        return len(b) <= len(a) or not any(b[len(a):])
+
+    def compare(self, other):
+        """BEFORE, AFTER, EQUAL ou CONCURRENT em relação a other"""
+        a, b = self.values, other.values
+        before = any(map(lt, a, b)) or (len(b) > len(a) and any(b[len(a):]))
+        after = any(map(gt, a, b)) or (len(a) > len(b) and any(a[len(b):]))
+        if before and after:
+            return CONCURRENT
+        if before:
+            return BEFORE
+        if after:
+            return AFTER
+        return EQUAL
+
+    def missing(self, other):
+        """Origens em que other está à frente deste vetor"""
+        names = self.ids.names
+        a = self.values
+        return {names[slot] for slot, value in enumerate(other.values)
+                if value > (a[slot] if slot < len(a) else 0)}
+
+    def __repr__(self):
+        return f"VectorClock({self.to_dict()})"
+
+
+class PendingBatch:
+    __slots__ = ("origin", "deps", "operations", "received_at", "sync_requested")
+
+    def __init__(self, origin, deps, operations):
+        self.origin = origin
+        self.deps = deps
+        self.operations = operations
+        self.received_at = time.monotonic()
+        self.sync_requested = False
+
+
+class CausalOrdering:
+    """Buffer de lotes replicados liberados em ordem causal
+
+    O vetor local é ReplicaLog.vector, avançado pela aplicação das operações; as origens
+    que faltam quando a janela de reordenação expira vão para ReplicaLog.pending.
+    """
+
+    def __init__(self, replica_log, mode=ORDERING, window_ms=ORDERING_WINDOW_MS,
+                 max_wait_ms=ORDERING_MAX_WAIT_MS, max_pending=ORDERING_MAX_PENDING):
+        self.replica_log = replica_log
+        self.enabled = mode == "causal"
+        self.window = window_ms / 1000
+        self.max_wait = max_wait_ms / 1000
+        self.max_pending = max_pending
+        self.queues = {}  # {origem: deque de PendingBatch}
+        self.buffered_ops = 0
+
+        self.delivered = 0
+        self.delayed = 0
+        self.forced = 0
+        self.concurrent = 0
+        self.sync_requests = 0
+        self.max_buffered = 0
+        self.total_wait = 0.0
+
+    def offer(self, origin, deps, operations):
+        """Recebe um lote; gera, em ordem, os lotes (origem, operações) prontos para aplicar
+
+        O chamador aplica cada lote antes de pedir o próximo: é a aplicação que avança o
+        vetor local e pode liberar os lotes em espera.
+        """
+        if not self.enabled:
+            yield origin, operations
+            return
+        deps = VectorClock.from_dict(deps)
+        if self.replica_log.vector.compare(deps) == CONCURRENT:
+            self.concurrent += 1
+        queue = self.queues.get(origin)
+        if not queue and self.replica_log.vector.covers(deps):
+            self.delivered += 1
+            yield origin, operations
+            if self.queues:
+                yield from self.release()
+            return
+        self.delayed += 1
+        self.queues.setdefault(origin, deque()).append(PendingBatch(origin, deps, operations))
+        self.buffered_ops += len(operations)
+        self.max_buffered = max(self.max_buffered, self.buffered_ops)
+        yield from self.release()
+
+    def release(self):
+        """Gera os lotes em espera cujas dependências já foram aplicadas (e os vencidos)"""
+        vector = self.replica_log.vector
+        while self.queues:
+            progress = False
+            now = time.monotonic()
+            for origin in list(self.queues):
+                queue = self.queues[origin]
+                while queue:
+                    batch = queue[0]
+                    waited = now - batch.received_at
+                    if not vector.covers(batch.deps):
+                        if waited >= self.max_wait or self.buffered_ops > self.max_pending:
+                            self.forced += 1
+                        else:
+                            if waited >= self.window and not batch.sync_requested:
+                                batch.sync_requested = True
+                                self.sync_requests += 1
+                                self.replica_log.pending.update(vector.missing(batch.deps))
+                            break
+                    queue.popleft()
+                    self.buffered_ops -= len(batch.operations)
+                    self.delivered += 1
+                    self.total_wait += waited
+                    progress = True
+                    yield origin, batch.operations
+                if not queue:
+                    del self.queues[origin]
+            if not progress:
+                return
+
+    def timeout_ms(self, default):
+        """Tempo máximo de espera no poll até o próximo vencimento de janela"""
+        if not self.queues:
+            return default
+        now = time.monotonic()
+        deadline = min(queue[0].received_at + (self.max_wait if queue[0].sync_requested else self.window)
+                       for queue in self.queues.values())
+        return max(0, min(default, (deadline - now) * 1000))
+
+    def metrics(self):
+        return {
+            "mode": "causal" if self.enabled else "arrival",
+            "replicas": len(self.replica_log.vector.to_dict()),
+            "delivered_batches": self.delivered,
+            "delayed_batches": self.delayed,
+            "forced_batches": self.forced,
+            "concurrent_batches": self.concurrent,
+            "sync_requests": self.sync_requests,
+            "buffered_ops": self.buffered_ops,
+            "max_buffered_ops": self.max_buffered,
+            "avg_wait_ms": round(self.total_wait / self.delayed * 1000, 3) if self.delayed else 0.0,
+        }
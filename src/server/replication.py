@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Agrupamento e compressão do fluxo de replicação entre servidores"""
+import os
+import time
+import zlib
+
+import msgpack
+
+from metrics import Logger
+
+REPLICATION_BATCH_OPS = int(os.environ.get("REPLICATION_BATCH_OPS", 256))
+REPLICATION_BATCH_BYTES = int(os.environ.get("REPLICATION_BATCH_BYTES", 256 * 1024))
+REPLICATION_BATCH_MS = float(os.environ.get("REPLICATION_BATCH_MS", 5))
+REPLICATION_CODEC = os.environ.get("REPLICATION_CODEC", "none")  # none | zlib | zstd | lz4
+REPLICATION_COMPRESS_MIN = int(os.environ.get("REPLICATION_COMPRESS_MIN", 1024))
+REPLICATION_METRICS_INTERVAL = float(os.environ.get("REPLICATION_METRICS_INTERVAL", 60))
+
+
+def load_codecs():
+    """Codecs disponíveis: {nome: (compress, decompress)}; zstd e lz4 são opcionais"""
+    codecs = {
+        "none": (None, None),
+        "zlib": (lambda data: zlib.compress(data, 1), zlib.decompress),
+    }
+    try:
+        import zstandard
+        compressor = zstandard.ZstdCompressor(level=1)
+        decompressor = zstandard.ZstdDecompressor()
+        codecs["zstd"] = (compressor.compress, decompressor.decompress)
+    except ImportError:
+        pass
+    try:
+        import lz4.frame
+        codecs["lz4"] = (lz4.frame.compress, lz4.frame.decompress)
+    except ImportError:
+        pass
+    return codecs
+
+
+CODECS = load_codecs()
+
+
+def decode_batch(header, payload):
+    """Descomprime e decodifica as operações de um lote"""
+    codec = header.get("codec", "none")
+    if codec != "none":
+        if codec not in CODECS:
+            raise ValueError(f"Codec de replicação não suportado: {codec}")
+        payload = CODECS[codec][1](payload)
+    return msgpack.unpackb(payload, raw=False)
+
+
+class ReplicationBatcher:
+    """Acumula mutações e as publica em lotes limitados por tamanho e tempo"""
+
+    def __init__(self, server_name, max_ops=REPLICATION_BATCH_OPS, max_bytes=REPLICATION_BATCH_BYTES,
+                 max_ms=REPLICATION_BATCH_MS, codec=REPLICATION_CODEC,
+                 metrics_interval=REPLICATION_METRICS_INTERVAL, deps=None):
+        if codec not in CODECS:
+            print(f"Aviso: codec de replicação '{codec}' indisponível, usando zlib")
+            codec = "zlib"
+        self.server_name = server_name
+        self.log = Logger(server_name)
+        self.max_ops = max_ops
+        self.max_bytes = max_bytes
+        self.max_seconds = max_ms / 1000
+        self.codec = codec
+        self.metrics_interval = metrics_interval
+        self.deps = deps  # função que retorna as dependências causais do lote (ver ordering.py)
+        self.operations = []
+        self.pending_bytes = 0
+        self.first_at = None
+        self.packer = msgpack.Packer()
+
+        self.batches_sent = 0
+        self.ops_sent = 0
+        self.max_batch_sent = 0
+        self.bytes_raw = 0
+        self.bytes_sent = 0
+        self.batches_received = 0
+        self.ops_received = 0
+        self.max_batch_received = 0
+        self.last_lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.total_lag_ms = 0.0
+        self.last_report = time.monotonic()
+
+    def add(self, pub_socket, operation, data, clock, payload=None):
+        """Enfileira uma mutação; publica o lote se algum limite foi atingido
+
+        payload: `data` já codificado (os mesmos bytes gravados no log), embutido sem recodificar.
+        """
+        # Cada operação é serializada uma única vez; o lote concatena os bytes prontos
+        if payload is None:
+            entry = self.packer.pack({"operation": operation, "data": data, "clock": clock, "ts": time.time()})
+        else:
+            pack = self.packer.pack
+            entry = (self.packer.pack_map_header(4) + pack("operation") + pack(operation) + pack("data") + payload
+                     + pack("clock") + pack(clock) + pack("ts") + pack(time.time()))
+        self.operations.append(entry)
+        self.pending_bytes += len(entry)
+        if self.first_at is None:
+            self.first_at = time.monotonic()
+        if len(self.operations) >= self.max_ops or self.pending_bytes >= self.max_bytes:
+            self.flush(pub_socket, clock)
+
+    def timeout_ms(self, default):
+        """Tempo máximo de espera no poll para não atrasar o lote pendente"""
+        if self.first_at is None:
+            return default
+        remaining = self.first_at + self.max_seconds - time.monotonic()
+        return max(0, min(default, remaining * 1000))
+
+    def flush_due(self, pub_socket, clock):
+        if self.first_at is not None and time.monotonic() - self.first_at >= self.max_seconds:
+            self.flush(pub_socket, clock)
+
+    def flush(self, pub_socket, clock):
+        """Publica as mutações pendentes como um único frame de replicação"""
+        if not self.operations:
+            return
+        payload = self.packer.pack_array_header(len(self.operations)) + b"".join(self.operations)
+        raw_size = len(payload)
+        codec = "none"
+        if self.codec != "none" and raw_size >= REPLICATION_COMPRESS_MIN:
+            payload = CODECS[self.codec][0](payload)
+            codec = self.codec
+        header = {
+            "server": self.server_name,
+            "clock": clock,
+            "count": len(self.operations),
+            "codec": codec,
+            "sent_at": time.time(),
+        }
+        if self.deps is not None:
+            header["deps"] = self.deps()
+        pub_socket.send_multipart([b"replication", msgpack.packb(header), payload], copy=False)
+        self.log.debug(f"Replicando: {len(self.operations)} operações", key="replication")
+
+        self.batches_sent += 1
+        self.ops_sent += len(self.operations)
+        self.max_batch_sent = max(self.max_batch_sent, len(self.operations))
+        self.bytes_raw += raw_size
+        self.bytes_sent += len(payload)
+        self.operations = []
+        self.pending_bytes = 0
+        self.first_at = None
+        self.maybe_report()
+
+    def record_received(self, operations):
+        """Contabiliza um lote recebido e o atraso de replicação de suas operações"""
+        now = time.time()
+        self.batches_received += 1
+        self.ops_received += len(operations)
+        self.max_batch_received = max(self.max_batch_received, len(operations))
+        for entry in operations:
+            if "ts" in entry:
+                lag_ms = (now - entry["ts"]) * 1000
+                self.last_lag_ms = lag_ms
+                self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+                self.total_lag_ms += lag_ms
+        self.maybe_report()
+
+    def metrics(self):
+        return {
+            "batches_sent": self.batches_sent,
+            "ops_sent": self.ops_sent,
+            "avg_batch_sent": round(self.ops_sent / self.batches_sent, 2) if self.batches_sent else 0.0,
+            "max_batch_sent": self.max_batch_sent,
+            "bytes_raw": self.bytes_raw,
+            "bytes_sent": self.bytes_sent,
+            "batches_received": self.batches_received,
+            "ops_received": self.ops_received,
+            "avg_batch_received": round(self.ops_received / self.batches_received, 2) if self.batches_received else 0.0,
+            "max_batch_received": self.max_batch_received,
+            "last_lag_ms": round(self.last_lag_ms, 3),
+            "max_lag_ms": round(self.max_lag_ms, 3),
+            "avg_lag_ms": round(self.total_lag_ms / self.ops_received, 3) if self.ops_received else 0.0,
+        }
+
+    def maybe_report(self):
+        if self.metrics_interval <= 0 or time.monotonic() - self.last_report < self.metrics_interval:
+            return
+        self.last_report = time.monotonic()
+        m = self.metrics()
+        self.log.info(f"replicação: enviados={m['batches_sent']} lotes/{m['ops_sent']} ops "
+              f"(média {m['avg_batch_sent']}) recebidos={m['batches_received']} lotes/{m['ops_received']} ops "
+              f"atraso médio={m['avg_lag_ms']}ms máx={m['max_lag_ms']}ms bytes={m['bytes_sent']}/{m['bytes_raw']}")
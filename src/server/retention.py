@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""Retenção, compactação e arquivamento do histórico persistido
+
+As políticas valem por tipo de dado (idade máxima, registros por canal/destinatário,
+bytes em disco por log; logins guardados por usuário em RETENTION_LOGINS) e são
+aplicadas por uma thread de compactação em três etapas a cada COMPACTION_INTERVAL:
+
+1. Calcula, fora da thread principal, quantos registros antigos cada chave dos
+   índices perdeu; a thread dona do estado só corta o início das listas.
+2. Reescreve os segmentos fechados cujos registros vivos caíram abaixo de
+   COMPACTION_DEAD_RATIO (ou que ficaram mais velhos que ARCHIVE_AFTER) em arquivos
+   compactados (.arc), que guardam a posição original de cada registro: os índices
+   continuam apontando para os mesmos lugares e as consultas de histórico leem o
+   arquivo de forma transparente. Segmentos sem registros vivos são apagados.
+3. Remove dos índices de réplica as posições dos segmentos apagados.
+
+Nenhuma etapa bloqueia Server.run: a leitura e a escrita dos segmentos acontecem
+nesta thread e a thread principal só aplica trocas baratas em submit()/apply().
+"""
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import msgpack
+
+from history import OFFSET_BITS
+from state import RETENTION_LOGINS
+import wire
+
+COMPACTION_INTERVAL = float(os.environ.get("COMPACTION_INTERVAL", 60))       # segundos entre rodadas
+COMPACTION_DEAD_RATIO = float(os.environ.get("COMPACTION_DEAD_RATIO", 0.5))  # fração morta que dispara a reescrita
+ARCHIVE_AFTER = float(os.environ.get("ARCHIVE_AFTER", 0))                    # segundos; 0 = só compacta
+
+Policy = namedtuple("Policy", ["max_age", "max_per_key", "max_bytes"])
+
+
+def policy(kind):
+    """Política de um tipo de dado: RETENTION_<LIMITE>_<TIPO> ou o valor geral RETENTION_<LIMITE>"""
+    def setting(name, cast):
+        value = os.environ.get(f"RETENTION_{name}_{kind.upper()}", os.environ.get(f"RETENTION_{name}", 0))
+        return cast(value)
+
+    if kind == "users":
+        # Um usuário sempre mantém seus logins mais recentes (senão deixaria de existir)
+        return Policy(0, RETENTION_LOGINS, 0)
+    return Policy(setting("MAX_AGE", float), setting("MAX_PER_KEY", int), setting("MAX_BYTES", int))
+
+
+class Compactor:
+    """Thread de retenção e compactação dos logs de mensagens, publicações e usuários"""
+
+    def __init__(self, storage, indexes, users, replica_log, interval=COMPACTION_INTERVAL,
+                 dead_ratio=COMPACTION_DEAD_RATIO, archive_after=ARCHIVE_AFTER, log=print):
+        self.storage = storage
+        self.indexes = indexes  # {"messages": inbox_index, "publications": channel_index}
+        self.users = users
+        self.replica_log = replica_log
+        self.interval = interval
+        self.dead_ratio = dead_ratio
+        self.archive_after = archive_after
+        self.log = log
+        self.policies = {kind: policy(kind) for kind in ("messages", "publications", "users")}
+        self.tasks = queue.Queue()
+        self.thread = None
+
+        self.runs = 0
+        self.trimmed = 0
+        self.compacted = 0
+        self.dropped = 0
+        self.reclaimed_bytes = 0
+        self.last_run_ms = 0.0
+
+    def enabled(self):
+        return self.archive_after > 0 or any(any(p) for p in self.policies.values())
+
+    def start(self):
+        if self.enabled() and self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def submit(self, function, *args):
+        """Executa function na thread dona do estado (em apply()) e aguarda o resultado"""
+        done = threading.Event()
+        result = []
+        self.tasks.put((function, args, done, result))
+        done.wait()
+        return result[0] if result else None
+
+    def apply(self):
+        """Chamado pela thread principal: aplica as trocas preparadas pela compactação"""
+        while True:
+            try:
+                function, args, done, result = self.tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                result.append(function(*args))
+            finally:
+                done.set()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                self.log(f"Erro na compactação: {e}")
+
+    def run_once(self):
+        start = time.perf_counter()
+        for kind in ("messages", "publications", "users"):
+            if not any(self.policies[kind]) and not self.archive_after:
+                continue
+            log = self.storage.logs()[kind]
+            boundary = self.byte_boundary(log, self.policies[kind].max_bytes)
+            if kind in self.indexes:
+                trims = self.plan_trims(kind, boundary)
+                if trims:
+                    self.trimmed += self.submit(self.apply_trims, self.indexes[kind], trims)
+            dropped = self.compact(kind, log, boundary)
+            if dropped:
+                plan = self.replica_log.prune_plan(kind, dropped)
+                self.submit(self.replica_log.apply_prune, kind, plan)
+        self.runs += 1
+        self.last_run_ms = (time.perf_counter() - start) * 1000
+
+    def byte_boundary(self, log, max_bytes):
+        """Primeiro segmento mantido para que o log caiba em max_bytes (os anteriores são apagados)"""
+        sealed = log.sealed()
+        if not max_bytes or not sealed:
+            return None
+        total = log.disk_bytes()
+        boundary = None
+        for segment in sealed:
+            if total <= max_bytes:
+                break
+            total -= log.segment_size(segment)
+            boundary = segment + 1
+        return boundary
+
+    def plan_trims(self, kind, boundary):
+        """{chave: quantos registros mais antigos descartar} segundo idade, contagem e bytes"""
+        policy = self.policies[kind]
+        index = self.indexes[kind]
+        cutoff = wire.now_micros() - int(policy.max_age * 1_000_000) if policy.max_age else None
+        limit = boundary << OFFSET_BITS if boundary is not None else None
+        trims = {}
+        for name in list(index.keys):
+            # O dono insere registros replicados fora de ordem: lê a chave sob o lock do índice
+            with index.lock:
+                keys, pointers = index.locked(name)
+                count = len(keys)
+                trim = count - policy.max_per_key if policy.max_per_key and count > policy.max_per_key else 0
+                if cutoff is not None:
+                    while trim < count and wire.to_micros(keys[trim][1]) < cutoff:
+                        trim += 1
+                if limit is not None:
+                    # Ordem por relógio: corta até o último registro que está em um segmento apagado
+                    for i in range(count - 1, trim - 1, -1):
+                        if pointers[i] < limit:
+                            trim = i + 1
+                            break
+            if trim:
+                trims[name] = trim
+        return trims
+
+    @staticmethod
+    def apply_trims(index, trims):
+        return sum(index.trim(name, count) for name, count in trims.items())
+
+    def live_offsets(self, kind):
+        """{segmento: posições ainda referenciadas pelo índice}"""
+        live = {}
+        index = self.indexes[kind]
+        for name in list(index.pointers):
+            with index.lock:
+                pointers = index.locked(name)[1][:]
+            for packed in pointers:
+                live.setdefault(packed >> OFFSET_BITS, set()).add(packed & ((1 << OFFSET_BITS) - 1))
+        return live
+
+    def is_live_login(self, payload):
+        record = msgpack.unpackb(payload, raw=False)
+        user = self.users.get(record.get("user"))
+        return user is not None and record.get("timestamp") in user.logins
+
+    def compact(self, kind, log, boundary):
+        """Reescreve ou apaga os segmentos fechados de um log; retorna os segmentos apagados"""
+        live = self.live_offsets(kind) if kind in self.indexes else None
+        now = time.time()
+        dropped = set()
+        for segment in log.sealed():
+            size = log.segment_size(segment)
+            if boundary is not None and segment < boundary:
+                log.drop(segment)
+            else:
+                frames = list(log.segment_frames(segment))
+                if live is not None:
+                    offsets = live.get(segment, ())
+                    kept = [frame for frame in frames if frame[0] in offsets]
+                else:
+                    kept = [frame for frame in frames if self.is_live_login(frame[1])]
+                archived = segment in log.archives
+                dead = 1 - len(kept) / len(frames) if frames else 1
+                aged = (not archived and self.archive_after
+                        and now - os.path.getmtime(log.segment_path(segment)) >= self.archive_after)
+                if kept and dead < self.dead_ratio and not aged:
+                    continue
+                if kept and archived and len(kept) == len(frames):
+                    continue
+                log.install_archive(segment, kept)
+                if kept:
+                    self.compacted += 1
+                    self.reclaimed_bytes += size - log.segment_size(segment)
+                    continue
+            dropped.add(segment)
+            self.dropped += 1
+            self.reclaimed_bytes += size
+        if dropped:
+            self.log(f"[retenção] {kind}: {len(dropped)} segmentos apagados")
+        return dropped
+
+    def metrics(self):
+        return {
+            "enabled": self.enabled(),
+            "policies": {kind: p._asdict() for kind, p in self.policies.items()},
+            "runs": self.runs,
+            "trimmed_records": self.trimmed,
+            "compacted_segments": self.compacted,
+            "dropped_segments": self.dropped,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "last_run_ms": round(self.last_run_ms, 1),
+            "disk_bytes": {kind: log.disk_bytes() for kind, log in self.storage.logs().items()},
+        }
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Leitura sequencial e preguiçosa do histórico persistido, para análises e varreduras
+
+Percorre os segmentos de um log (diretório messages/, publications/, ...) via mmap, sem
+carregar os arquivos na memória: os registros são gerados um a um e o uso de memória não
+depende do tamanho do histórico. O filtro por chave (canal, destinatário ou usuário) e por
+faixa de clock usa o cabeçalho dos frames e só os registros devolvidos são decodificados.
+Segmentos compactados pela retenção (.arc) são lidos bloco a bloco.
+
+A leitura não altera o diretório, então pode rodar ao lado de um servidor em execução
+(registros ainda sendo escritos no fim do segmento ativo são ignorados).
+
+Uso:
+  python scan.py DIR [--key geral] [--from CLOCK] [--to CLOCK] [--limit N] [--count]
+"""
+import argparse
+import json
+import os
+
+import msgpack
+
+from storage import (ARCHIVE_SUFFIX, KEY_FIELDS, SEGMENT_SUFFIX, ArchiveReader, RecordPointer,
+                     scan_segment)
+
+
+def segment_files(directory):
+    """[(segmento, caminho)] em ordem; a versão compactada substitui o segmento original"""
+    files = {}
+    for name in os.listdir(directory):
+        for suffix in (SEGMENT_SUFFIX, ARCHIVE_SUFFIX):
+            if name.endswith(suffix):
+                segment = int(name[:-len(suffix)])
+                if suffix == ARCHIVE_SUFFIX or segment not in files:
+                    files[segment] = os.path.join(directory, name)
+    return sorted(files.items())
+
+
+def scan(directory, key=None, clock_from=None, clock_to=None, key_field=None):
+    """Gera (posição, registro) dos registros do log com a chave e o clock pedidos
+
+    key_field é o campo da chave no registro; por padrão vem do nome do diretório
+    (ex.: "channel" para publications/). clock_from e clock_to são inclusivos.
+    """
+    if key_field is None:
+        key_field = KEY_FIELDS.get(os.path.basename(os.path.normpath(directory)))
+    for segment, path in segment_files(directory):
+        if path.endswith(ARCHIVE_SUFFIX):
+            archive = ArchiveReader(path)
+            try:
+                yield from matching(segment, archive.frames(), key, clock_from, clock_to, key_field)
+            finally:
+                archive.close()
+        else:
+            frames = scan_segment(path, key=key, clock_from=clock_from, clock_to=clock_to)
+            try:
+                yield from matching(segment, frames, key, clock_from, clock_to, key_field)
+            except FileNotFoundError:
+                # Segmento compactado ou apagado pela retenção durante a varredura
+                continue
+
+
+def matching(segment, frames, key, clock_from, clock_to, key_field):
+    """Decodifica os frames e confere o filtro (colisões de hash, segmentos sem cabeçalho de filtro)"""
+    for offset, payload in frames:
+        record = msgpack.unpackb(payload, raw=False)
+        if key is not None and record.get(key_field) != key:
+            continue
+        clock = record.get("clock") or 0
+        if (clock_from is not None and clock < clock_from) or (clock_to is not None and clock > clock_to):
+            continue
+        yield RecordPointer(segment, offset), record
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Varre um log de histórico sem carregá-lo na memória")
+    parser.add_argument("directory", help="diretório do log (ex.: /app/data/<servidor>/publications)")
+    parser.add_argument("--key", help="canal, destinatário ou usuário")
+    parser.add_argument("--from", dest="clock_from", type=int, help="clock mínimo (inclusivo)")
+    parser.add_argument("--to", dest="clock_to", type=int, help="clock máximo (inclusivo)")
+    parser.add_argument("--limit", type=int, help="máximo de registros")
+    parser.add_argument("--count", action="store_true", help="apenas conta os registros")
+    args = parser.parse_args()
+
+    count = 0
+    for _, record in scan(args.directory, args.key, args.clock_from, args.clock_to):
+        count += 1
+        if not args.count:
+            print(json.dumps(record, ensure_ascii=False, default=str))
+        if args.limit and count >= args.limit:
+            break
+    if args.count:
+        print(count)
+
+
+if __name__ == "__main__":
+    main()
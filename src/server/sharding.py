@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""Particionamento de canais e usuários entre réplicas por hashing consistente"""
+import hashlib
+import os
+from bisect import bisect_right
+
+SHARDING = os.environ.get("SERVER_SHARDING", "off")  # off | hash
+SHARD_REPLICAS = int(os.environ.get("SHARD_REPLICAS", 1))  # cópias de cada canal/caixa de entrada
+SHARD_VNODES = int(os.environ.get("SHARD_VNODES", 64))     # pontos de cada servidor no anel
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Anel de hashing consistente: cada chave pertence aos próximos servidores no anel"""
+
+    def __init__(self, nodes=(), vnodes=SHARD_VNODES):
+        self.nodes = sorted(set(nodes))
+        points = sorted((ring_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self.hashes = [point for point, _ in points]
+        self.points = [node for _, node in points]
+
+    def owners(self, key, count=SHARD_REPLICAS):
+        """Servidores responsáveis pela chave, em ordem de preferência"""
+        if not self.nodes:
+            return []
+        count = min(count, len(self.nodes))
+        position = bisect_right(self.hashes, ring_hash(key))
+        owners = []
+        for i in range(len(self.points)):
+            node = self.points[(position + i) % len(self.points)]
+            if node not in owners:
+                owners.append(node)
+                if len(owners) == count:
+                    break
+        return owners
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Snapshots binários do estado do servidor para inicialização rápida"""
+import os
+import struct
+import threading
+import time
+import zlib
+
+import msgpack
+
+from storage import RecordPointer
+
+SNAPSHOT_FILE = "snapshot.bin"
+SNAPSHOT_EVERY = int(os.environ.get("SNAPSHOT_EVERY", 50000))         # mutações
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", 300))   # segundos
+
+# [magic][versão:u8][crc32:u32][payload msgpack]
+SNAPSHOT_MAGIC = b"SNAP"
+SNAPSHOT_VERSION = 2  # 2: chaves do histórico com (origem, seq)
+SNAPSHOT_HEADER = struct.Struct(">4sBI")
+
+
+def encode_snapshot(state):
+    payload = msgpack.packb(state, use_bin_type=True)
+    return SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, zlib.crc32(payload)) + payload
+
+
+def decode_snapshot(data):
+    """Valida e decodifica um snapshot; retorna None se estiver inválido"""
+    if len(data) < SNAPSHOT_HEADER.size:
+        return None
+    magic, version, crc = SNAPSHOT_HEADER.unpack_from(data)
+    payload = data[SNAPSHOT_HEADER.size:]
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION or zlib.crc32(payload) != crc:
+        return None
+    state = msgpack.unpackb(payload, raw=False, strict_map_key=False)
+    state["high_water"] = {
+        name: RecordPointer(*pointer) for name, pointer in state["high_water"].items()
+    }
+    return state
+
+
+class SnapshotManager:
+    """Decide quando tirar snapshots e os grava em segundo plano"""
+
+    def __init__(self, data_dir, storage=None, every=SNAPSHOT_EVERY, interval=SNAPSHOT_INTERVAL):
+        self.path = os.path.join(data_dir, SNAPSHOT_FILE)
+        self.storage = storage
+        self.every = every
+        self.interval = interval
+        self.mutations = 0
+        self.last_snapshot = time.monotonic()
+        self.writing = threading.Lock()
+
+    def load(self):
+        """Lê o snapshot mais recente, se houver um válido"""
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "rb") as f:
+            state = decode_snapshot(f.read())
+        if state is None:
+            print(f"Aviso: snapshot {self.path} inválido, ignorando")
+        return state
+
+    def matches(self, state):
+        """Verifica se as marcas de high-water do snapshot existem nos logs abertos"""
+        tails = self.storage.tails()
+        for name, pointer in state["high_water"].items():
+            if pointer > tails[name]:
+                print(f"Aviso: snapshot à frente do log '{name}', ignorando")
+                return False
+        return True
+
+    def record_mutation(self):
+        self.mutations += 1
+
+    def due(self):
+        if not self.mutations:
+            return False
+        return self.mutations >= self.every or time.monotonic() - self.last_snapshot >= self.interval
+
+    def take(self, state):
+        """Grava um snapshot do estado capturado; a escrita ocorre em outra thread
+
+        O estado deve ter sido capturado junto com storage.tails() para que as
+        marcas de high-water correspondam exatamente ao conteúdo do snapshot.
+        """
+        if not self.writing.acquire(blocking=False):
+            return False
+        self.mutations = 0
+        self.last_snapshot = time.monotonic()
+        data = encode_snapshot(state)
+        threading.Thread(target=self.write, args=(data,), daemon=True).start()
+        return True
+
+    def write(self, data):
+        try:
+            start = time.perf_counter()
+            # Os registros cobertos pelo snapshot precisam estar em disco antes dele
+            self.storage.sync_all()
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"Snapshot gravado: {len(data)} bytes em {elapsed:.1f}ms")
+        except Exception as e:
+            print(f"Erro ao gravar snapshot: {e}")
+        finally:
+            self.writing.release()
+
+    def write_now(self, state):
+        """Grava um snapshot de forma síncrona (usado no encerramento e em benchmarks)"""
+        self.writing.acquire()
+        self.mutations = 0
+        self.last_snapshot = time.monotonic()
+        self.write(encode_snapshot(state))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Estruturas de estado em memória do servidor com verificação de pertinência O(1)"""
+import os
+from collections import deque
+
+RECENT_LOGINS = int(os.environ.get("RECENT_LOGINS", 16))
+RETENTION_LOGINS = int(os.environ.get("RETENTION_LOGINS", 0))  # logins guardados por usuário (0: todos)
+
+
+class OrderedSet:
+    """Conjunto que preserva a ordem de inserção (apoiado em dict)"""
+    __slots__ = ("items",)
+
+    def __init__(self, items=()):
+        self.items = dict.fromkeys(items)
+
+    def add(self, item):
+        """Adiciona um item; retorna False se ele já existia"""
+        if item in self.items:
+            return False
+        self.items[item] = None
+        return True
+
+    def discard(self, item):
+        self.items.pop(item, None)
+
+    def pop_oldest(self):
+        item = next(iter(self.items))
+        del self.items[item]
+        return item
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def to_list(self):
+        return list(self.items)
+
+
+class UserRecord:
+    """Usuário com o conjunto de timestamps de login e um anel dos logins mais recentes"""
+    __slots__ = ("name", "logins", "recent")
+
+    def __init__(self, name):
+        self.name = name
+        self.logins = OrderedSet()
+        self.recent = deque(maxlen=RECENT_LOGINS)
+
+    @classmethod
+    def restore(cls, name, logins):
+        """Recria um registro a partir da lista ordenada de logins (snapshots)"""
+        user = cls(name)
+        if RETENTION_LOGINS:
+            logins = logins[-RETENTION_LOGINS:]
+        user.logins = OrderedSet(logins)
+        user.recent.extend(logins[-RECENT_LOGINS:])
+        return user
+
+    def add_login(self, timestamp):
+        """Registra um login; retorna False se o timestamp já era conhecido"""
+        if not self.logins.add(timestamp):
+            return False
+        self.recent.append(timestamp)
+        if RETENTION_LOGINS and len(self.logins) > RETENTION_LOGINS:
+            # Os mais antigos saem da memória e, na próxima compactação, do log de usuários
+            self.logins.pop_oldest()
+        return True
+
+    def last_login(self):
+        return self.recent[-1] if self.recent else None
+
+
+class UserTable(dict):
+    """Tabela {nome: UserRecord}; mantém a interface de dict usada pelos serviços"""
+
+    def record(self, name):
+        """Retorna o registro do usuário, criando-o se necessário"""
+        user = self.get(name)
+        if user is None:
+            user = self[name] = UserRecord(name)
+        return user
+
+    def add_login(self, name, timestamp):
+        return self.record(name).add_login(timestamp)
@@ -0,0 +1,925 @@
+#!/usr/bin/env python3
+"""Log de segmentos append-only usado como motor de persistência do servidor"""
+import os
+import json
+import mmap
+import queue
+import struct
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+import msgpack
+
+# Configuração do log (pode ser sobrescrita por variáveis de ambiente)
+SEGMENT_BYTES = int(os.environ.get("LOG_SEGMENT_BYTES", 64 * 1024 * 1024))
+FSYNC_POLICY = os.environ.get("LOG_FSYNC", "interval")  # always | interval | never
+FSYNC_INTERVAL = float(os.environ.get("LOG_FSYNC_INTERVAL", 1.0))
+
+# Group commit: sync (fsync a cada registro, na thread da requisição),
+# batched (fsync por lote, na thread de escrita) ou async (sem fsync por lote)
+DURABILITY = os.environ.get("STORAGE_DURABILITY", "batched")
+GROUP_COMMIT_RECORDS = int(os.environ.get("GROUP_COMMIT_RECORDS", 256))
+GROUP_COMMIT_MS = float(os.environ.get("GROUP_COMMIT_MS", 5))
+GROUP_COMMIT_QUEUE = int(os.environ.get("GROUP_COMMIT_QUEUE", 10000))
+STORAGE_METRICS_INTERVAL = float(os.environ.get("STORAGE_METRICS_INTERVAL", 60))
+
+# Cada segmento começa com um cabeçalho fixo e contém frames
+# [tamanho:u32][crc32:u32][clock:i64][hash da chave:u32][payload msgpack]. O clock e o hash da
+# chave (canal, destinatário ou usuário) permitem filtrar registros sem decodificá-los; o crc32
+# cobre esses campos e o payload. Segmentos da versão 1 (frames [tamanho][crc32][payload])
+# continuam legíveis e os novos registros vão sempre para um segmento da versão 2.
+SEGMENT_MAGIC = b"SLOG\x02"
+SEGMENT_MAGIC_V1 = b"SLOG\x01"
+FRAME_HEADER = struct.Struct(">IIqI")
+FRAME_HEADER_V1 = struct.Struct(">II")
+FRAME_META = struct.Struct(">qI")
+FRAME_HEADERS = {SEGMENT_MAGIC: FRAME_HEADER, SEGMENT_MAGIC_V1: FRAME_HEADER_V1}
+SEGMENT_SUFFIX = ".seg"
+
+# Campo usado como chave de cada log no cabeçalho dos frames
+KEY_FIELDS = {
+    "users": "user",
+    "channels": "channel",
+    "messages": "dst",
+    "publications": "channel",
+}
+
+# Segmentos compactados/arquivados: [magic][tamanho do cabeçalho:u32][cabeçalho msgpack][blocos zlib].
+# Guardam só os frames vivos, com a posição original de cada um (as posições do índice continuam valendo)
+ARCHIVE_MAGIC = b"SARC\x01"
+ARCHIVE_SUFFIX = ".arc"
+ARCHIVE_HEADER = struct.Struct(">I")
+ARCHIVE_BLOCK_BYTES = int(os.environ.get("ARCHIVE_BLOCK_BYTES", 256 * 1024))
+ARCHIVE_LEVEL = int(os.environ.get("ARCHIVE_LEVEL", 6))
+ARCHIVE_CACHE_BLOCKS = int(os.environ.get("ARCHIVE_CACHE_BLOCKS", 16))  # blocos descompactados por arquivo
+
+# Arquivos JSON do formato antigo e o log que substitui cada um
+LEGACY_FILES = {
+    "users": "users.json",
+    "channels": "channels.json",
+    "messages": "messages.json",
+    "publications": "publications.json",
+}
+
+RecordPointer = namedtuple("RecordPointer", ["segment", "offset"])
+
+
+def key_hash(key):
+    """Hash de 32 bits da chave de um registro guardado no cabeçalho do frame (0: sem chave)"""
+    return zlib.crc32(str(key).encode()) if key is not None else 0
+
+
+def frame_checksum(header, data, offset, payload):
+    """crc32 de um frame: na versão 2 inclui clock e hash da chave"""
+    if header is FRAME_HEADER_V1:
+        return zlib.crc32(payload)
+    return zlib.crc32(payload, zlib.crc32(data[offset + FRAME_HEADER_V1.size:offset + FRAME_HEADER.size]))
+
+
+def encode_frame(record, payload=None, key_field=None):
+    """Serializa um registro em um frame da versão 2 (payload: registro já codificado)"""
+    if payload is None:
+        payload = msgpack.packb(record)
+    meta = FRAME_META.pack(int(record.get("clock") or 0), key_hash(record.get(key_field)) if key_field else 0)
+    return FRAME_HEADER_V1.pack(len(payload), zlib.crc32(payload, zlib.crc32(meta))) + meta + payload
+
+
+def iter_frames(data, start=len(SEGMENT_MAGIC), base=0, header=FRAME_HEADER):
+    """Percorre os frames válidos de um segmento, parando no primeiro frame incompleto
+
+    data pode ser apenas um trecho do segmento que começa na posição base.
+    """
+    offset = start - base
+    end = len(data)
+    while offset + header.size <= end:
+        size, crc = FRAME_HEADER_V1.unpack_from(data, offset)
+        payload_start = offset + header.size
+        payload_end = payload_start + size
+        if payload_end > end:
+            break
+        payload = data[payload_start:payload_end]
+        if frame_checksum(header, data, offset, payload) != crc:
+            break
+        yield base + offset, payload
+        offset = payload_end
+
+
+def scan_segment(path, first=len(SEGMENT_MAGIC), key=None, clock_from=None, clock_to=None):
+    """Percorre um segmento via mmap, sem carregá-lo na memória
+
+    Gera (posição, payload) apenas dos frames cuja chave tem o hash de `key` e cujo clock
+    está em [clock_from, clock_to]; nos segmentos da versão 2 o filtro usa só o cabeçalho.
+    O payload é um memoryview sobre o arquivo, válido até a próxima iteração: decodifique-o
+    ou copie-o antes de continuar. Segmentos da versão 1 não têm clock nem chave no cabeçalho
+    e são devolvidos sem filtro (quem chama confere o registro decodificado).
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size <= len(SEGMENT_MAGIC):
+            return
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    try:
+        header = FRAME_HEADERS.get(mapped[:len(SEGMENT_MAGIC)])
+        if header is None:
+            return
+        filtered = header is FRAME_HEADER and (key is not None or clock_from is not None or clock_to is not None)
+        wanted = key_hash(key) if key is not None else None
+        offset = first
+        while offset + header.size <= size:
+            if header is FRAME_HEADER:
+                length, crc, clock, hashed = header.unpack_from(mapped, offset)
+            else:
+                length, crc = header.unpack_from(mapped, offset)
+            start = offset + header.size
+            end = start + length
+            if end > size:
+                break
+            frame, offset = offset, end
+            if filtered and ((wanted is not None and hashed != wanted)
+                             or (clock_from is not None and clock < clock_from)
+                             or (clock_to is not None and clock > clock_to)):
+                continue
+            with view[start:end] as payload:
+                if frame_checksum(header, mapped, frame, payload) != crc:
+                    break
+                yield frame, payload
+    finally:
+        view.release()
+        mapped.close()
+
+
+def write_archive(path, frames, block_bytes=ARCHIVE_BLOCK_BYTES, level=ARCHIVE_LEVEL):
+    """Grava os frames [(posição original, payload)] de um segmento em um arquivo compactado
+
+    Os frames são agrupados em blocos comprimidos de forma independente, então uma
+    leitura descompacta apenas o bloco do registro. A escrita é atômica (tmp + rename).
+    """
+    offsets = array("Q")
+    positions = array("I")
+    blocks = []  # [[posição nos dados, tamanho comprimido, índice do primeiro frame]]
+    compressed = []
+    chunk = []
+    chunk_size = 0
+    data_size = 0
+
+    def flush():
+        nonlocal chunk, chunk_size, data_size
+        if chunk:
+            block = zlib.compress(b"".join(chunk), level)
+            blocks.append([data_size, len(block), len(offsets) - len(chunk)])
+            compressed.append(block)
+            data_size += len(block)
+            chunk, chunk_size = [], 0
+
+    for offset, payload in frames:
+        frame = FRAME_HEADER_V1.pack(len(payload), zlib.crc32(payload)) + payload
+        offsets.append(offset)
+        positions.append(chunk_size)
+        chunk.append(frame)
+        chunk_size += len(frame)
+        if chunk_size >= block_bytes:
+            flush()
+    flush()
+
+    header = msgpack.packb({"offsets": offsets.tobytes(), "positions": positions.tobytes(), "blocks": blocks})
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(ARCHIVE_MAGIC + ARCHIVE_HEADER.pack(len(header)) + header)
+        for block in compressed:
+            f.write(block)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(offsets)
+
+
+class ArchiveReader:
+    """Leitura de um segmento arquivado pelas posições originais dos registros"""
+
+    def __init__(self, path, cache_blocks=ARCHIVE_CACHE_BLOCKS):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError(f"Arquivo de segmento inválido: {path}")
+            (size,) = ARCHIVE_HEADER.unpack(f.read(ARCHIVE_HEADER.size))
+            header = msgpack.unpackb(f.read(size), raw=False)
+        self.data_start = len(ARCHIVE_MAGIC) + ARCHIVE_HEADER.size + size
+        self.offsets = array("Q")
+        self.offsets.frombytes(header["offsets"])
+        self.positions = array("I")
+        self.positions.frombytes(header["positions"])
+        self.blocks = header["blocks"]
+        self.firsts = [block[2] for block in self.blocks]
+        self.fd = os.open(path, os.O_RDONLY)
+        self.cache = OrderedDict()
+        self.cache_blocks = cache_blocks
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def size(self):
+        return os.fstat(self.fd).st_size
+
+    def block(self, number):
+        with self.lock:
+            data = self.cache.get(number)
+            if data is not None:
+                self.cache.move_to_end(number)
+                return data
+        start, length, _ = self.blocks[number]
+        data = zlib.decompress(os.pread(self.fd, length, self.data_start + start))
+        with self.lock:
+            self.cache[number] = data
+            if len(self.cache) > self.cache_blocks:
+                self.cache.popitem(last=False)
+        return data
+
+    def payload(self, offset):
+        """Payload do registro na posição original, ou None se ele foi descartado"""
+        i = bisect_left(self.offsets, offset)
+        if i == len(self.offsets) or self.offsets[i] != offset:
+            return None
+        data = self.block(bisect_right(self.firsts, i) - 1)
+        position = self.positions[i]
+        size, crc = FRAME_HEADER_V1.unpack_from(data, position)
+        payload = data[position + FRAME_HEADER_V1.size:position + FRAME_HEADER_V1.size + size]
+        if zlib.crc32(payload) != crc:
+            raise ValueError(f"Checksum inválido em {self.path} (posição {offset})")
+        return payload
+
+    def frames(self, start=0):
+        """Percorre (posição original, payload) dos registros a partir da posição start"""
+        first = bisect_left(self.offsets, start)
+        for number in range(len(self.blocks)):
+            end = self.firsts[number + 1] if number + 1 < len(self.blocks) else len(self.offsets)
+            if end <= first:
+                continue
+            data = self.block(number)
+            for i, (_, payload) in enumerate(iter_frames(data, 0, header=FRAME_HEADER_V1), self.firsts[number]):
+                if i >= first:
+                    yield self.offsets[i], payload
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SegmentLog:
+    """Log append-only dividido em segmentos de tamanho limitado"""
+
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, fsync=FSYNC_POLICY,
+                 fsync_interval=FSYNC_INTERVAL, recover_from=None, key_field=None):
+        if fsync not in ("always", "interval", "never"):
+            raise ValueError(f"Política de fsync inválida: {fsync}")
+        self.directory = directory
+        self.key_field = key_field
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.last_fsync = time.monotonic()
+        self.segments = []
+        self.active = None
+        self.active_size = 0
+        self.tail = RecordPointer(0, len(SEGMENT_MAGIC))
+        self.lock = threading.Lock()
+        self.readers = {}
+        self.headers = {}   # {segmento: formato do frame}, conforme o magic do segmento
+        self.archives = {}  # {segmento: ArchiveReader} dos segmentos compactados
+        self.retired = []   # descritores de segmentos substituídos, fechados na próxima troca
+        self.open(recover_from)
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f"{segment:010d}{SEGMENT_SUFFIX}")
+
+    def archive_path(self, segment):
+        return os.path.join(self.directory, f"{segment:010d}{ARCHIVE_SUFFIX}")
+
+    def open(self, recover_from=None):
+        """Abre o diretório do log, recuperando o último segmento após falhas
+
+        recover_from é uma posição sabidamente íntegra (ex.: a marca de um snapshot);
+        se estiver no último segmento, apenas os frames depois dela são verificados.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith(ARCHIVE_SUFFIX + ".tmp"):
+                # Compactação interrompida: o segmento original continua valendo
+                os.remove(os.path.join(self.directory, name))
+            elif name.endswith(ARCHIVE_SUFFIX):
+                segment = int(name[:-len(ARCHIVE_SUFFIX)])
+                self.archives[segment] = ArchiveReader(self.archive_path(segment))
+        for segment in self.archives:
+            if os.path.exists(self.segment_path(segment)):
+                # Queda entre a gravação do arquivo compactado e a remoção do original
+                os.remove(self.segment_path(segment))
+        self.segments = sorted(
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+        if not self.segments:
+            segment = max(self.archives) + 1 if self.archives else 0
+            self.roll(segment)
+            self.tail = RecordPointer(segment, self.active_size)
+            return
+
+        segment = self.segments[-1]
+        path = self.segment_path(segment)
+        size = os.path.getsize(path)
+        trusted = len(SEGMENT_MAGIC)
+        if recover_from and recover_from.segment == segment and recover_from.offset <= size:
+            trusted = recover_from.offset
+        with open(path, "rb") as f:
+            magic = f.read(len(SEGMENT_MAGIC))
+            f.seek(trusted)
+            data = f.read()
+        valid_end = len(SEGMENT_MAGIC)
+        header = FRAME_HEADERS.get(magic)
+        if header is not None:
+            valid_end = trusted
+            for offset, payload in iter_frames(data, trusted, base=trusted, header=header):
+                valid_end = offset + header.size + len(payload)
+        if valid_end != size:
+            # Descarta frame parcialmente escrito (queda durante append)
+            print(f"Aviso: truncando segmento {path} de {size} para {valid_end} bytes")
+            with open(path, "r+b") as f:
+                f.truncate(valid_end)
+                if valid_end == len(SEGMENT_MAGIC):
+                    f.seek(0)
+                    f.write(SEGMENT_MAGIC)
+        if header is FRAME_HEADER_V1:
+            if valid_end > len(SEGMENT_MAGIC):
+                # Novos registros vão para um segmento da versão 2
+                self.roll(segment + 1)
+                self.tail = RecordPointer(segment + 1, self.active_size)
+                return
+            with open(path, "r+b") as f:
+                f.write(SEGMENT_MAGIC)
+        self.active = open(path, "ab")
+        self.active_size = valid_end
+        self.tail = RecordPointer(segment, valid_end)
+
+    def roll(self, segment):
+        """Fecha o segmento ativo e inicia um novo"""
+        if self.active:
+            self.sync()
+            self.active.close()
+        path = self.segment_path(segment)
+        self.active = open(path, "ab")
+        self.active.write(SEGMENT_MAGIC)
+        self.active.flush()
+        self.active_size = len(SEGMENT_MAGIC)
+        if not self.segments or self.segments[-1] != segment:
+            self.segments.append(segment)
+
+    def prepare(self, record, payload=None):
+        """Serializa um registro e reserva sua posição no final do log"""
+        frame = encode_frame(record, payload, self.key_field)
+        with self.lock:
+            segment, offset = self.tail
+            if offset + len(frame) > self.segment_bytes and offset > len(SEGMENT_MAGIC):
+                segment, offset = segment + 1, len(SEGMENT_MAGIC)
+            pointer = RecordPointer(segment, offset)
+            self.tail = RecordPointer(segment, offset + len(frame))
+        return pointer, frame
+
+    def write(self, entries):
+        """Escreve frames já reservados, em ordem, agrupando-os por segmento"""
+        chunk = []
+        for pointer, frame in entries:
+            if pointer.segment != self.segments[-1]:
+                self.flush_chunk(chunk)
+                chunk = []
+                self.roll(pointer.segment)
+            chunk.append(frame)
+        self.flush_chunk(chunk)
+
+    def flush_chunk(self, frames):
+        if not frames:
+            return
+        data = b"".join(frames)
+        self.active.write(data)
+        self.active.flush()
+        self.active_size += len(data)
+
+    def rewind(self, pointer):
+        """Descarta o que foi escrito a partir de `pointer` (escrita com erro) e volta a reservar dali"""
+        with self.lock:
+            segment = self.segments[-1]
+            offset = pointer.offset if pointer.segment == segment else self.active_size
+            try:
+                self.active.close()
+            except OSError:
+                # Dados parciais no buffer: o truncate abaixo os descarta
+                pass
+            path = self.segment_path(segment)
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+            self.active = open(path, "ab")
+            self.active_size = offset
+            self.tail = RecordPointer(segment, offset)
+
+    def append(self, record):
+        """Adiciona um registro ao final do log e retorna sua posição"""
+        entry = self.prepare(record)
+        self.write([entry])
+        self.maybe_sync()
+        return entry[0]
+
+    def maybe_sync(self):
+        """Aplica a política de fsync configurada"""
+        if self.fsync == "always":
+            self.sync()
+        elif self.fsync == "interval" and time.monotonic() - self.last_fsync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """Força os dados do segmento ativo para o disco"""
+        self.active.flush()
+        os.fsync(self.active.fileno())
+        self.last_fsync = time.monotonic()
+
+    def read(self, pointer):
+        """Lê um único registro a partir de sua posição (seguro entre threads)
+
+        Retorna None se o registro foi descartado pela política de retenção.
+        """
+        archive = self.archives.get(pointer.segment)
+        if archive is not None:
+            payload = archive.payload(pointer.offset)
+            return msgpack.unpackb(payload, raw=False) if payload is not None else None
+        fd = self.readers.get(pointer.segment)
+        header = self.headers.get(pointer.segment)
+        if fd is None or header is None:
+            try:
+                opened = os.open(self.segment_path(pointer.segment), os.O_RDONLY)
+            except FileNotFoundError:
+                # Compactado ou removido entre a consulta acima e a abertura
+                if pointer.segment in self.archives:
+                    return self.read(pointer)
+                return None
+            header = self.headers.setdefault(
+                pointer.segment, FRAME_HEADERS.get(os.pread(opened, len(SEGMENT_MAGIC), 0), FRAME_HEADER))
+            fd = self.readers.setdefault(pointer.segment, opened)
+            if fd != opened:
+                os.close(opened)
+        data = os.pread(fd, header.size, pointer.offset)
+        size, crc = FRAME_HEADER_V1.unpack_from(data)
+        payload = os.pread(fd, size, pointer.offset + header.size)
+        if frame_checksum(header, data, 0, payload) != crc:
+            raise ValueError(f"Checksum inválido em {pointer}")
+        return msgpack.unpackb(payload, raw=False)
+
+    def replay(self, start=None):
+        """Percorre todos os registros do log (a partir de start) em ordem"""
+        for segment in sorted(set(self.segments) | set(self.archives)):
+            if start and segment < start.segment:
+                continue
+            first = start.offset if start and segment == start.segment else len(SEGMENT_MAGIC)
+            archive = self.archives.get(segment)
+            frames = archive.frames(first) if archive is not None else scan_segment(self.segment_path(segment), first)
+            for offset, payload in frames:
+                yield RecordPointer(segment, offset), msgpack.unpackb(payload, raw=False)
+
+    def segment_frames(self, segment, first=len(SEGMENT_MAGIC)):
+        """(posição, payload) dos registros de um segmento, compactado ou não"""
+        archive = self.archives.get(segment)
+        if archive is not None:
+            yield from archive.frames(first)
+            return
+        for offset, payload in scan_segment(self.segment_path(segment), first):
+            yield offset, bytes(payload)
+
+    def sealed(self):
+        """Segmentos que não recebem mais escritas (todos menos o ativo), do mais antigo ao mais novo"""
+        return sorted(set(self.segments[:-1]) | set(self.archives))
+
+    def segment_size(self, segment):
+        archive = self.archives.get(segment)
+        if archive is not None:
+            return archive.size()
+        return os.path.getsize(self.segment_path(segment))
+
+    def disk_bytes(self):
+        return sum(self.segment_size(segment) for segment in self.sealed()) + self.active_size
+
+    def install_archive(self, segment, frames):
+        """Substitui um segmento fechado pela versão compactada com apenas `frames`"""
+        if not frames:
+            self.drop(segment)
+            return 0
+        path = self.archive_path(segment)
+        count = write_archive(path, frames)
+        previous = self.archives.get(segment)
+        self.archives[segment] = ArchiveReader(path)
+        self.retire(segment, previous)
+        return count
+
+    def drop(self, segment):
+        """Remove um segmento fechado inteiro (todos os registros descartados)"""
+        previous = self.archives.pop(segment, None)
+        self.retire(segment, previous)
+        if previous is not None:
+            os.remove(self.archive_path(segment))
+
+    def retire(self, segment, previous_archive=None):
+        """Tira o segmento original de uso; leituras em andamento terminam com o descritor antigo"""
+        for item in self.retired:
+            item.close() if isinstance(item, ArchiveReader) else os.close(item)
+        self.retired = []
+        if previous_archive is not None:
+            self.retired.append(previous_archive)
+        self.headers.pop(segment, None)
+        fd = self.readers.pop(segment, None)
+        if fd is not None:
+            self.retired.append(fd)
+        if segment in self.segments:
+            self.segments.remove(segment)
+            os.remove(self.segment_path(segment))
+
+    def is_empty(self):
+        return not self.archives and self.tail == RecordPointer(self.segments[0], len(SEGMENT_MAGIC))
+
+    def close(self):
+        self.sync()
+        self.active.close()
+        for fd in self.readers.values():
+            os.close(fd)
+        self.readers.clear()
+        for archive in self.archives.values():
+            archive.close()
+        self.retire(None)
+
+
+class WriteError(OSError):
+    """Registro não persistido: a escrita no log falhou ou foi interrompida por uma falha anterior"""
+
+
+class GroupCommitWriter:
+    """Thread de escrita que agrupa registros em uma única escrita + fsync por lote
+
+    Uma falha de escrita na fila interrompe o writer: as posições já reservadas depois do
+    lote com erro não correspondem mais ao arquivo, então os registros seguintes são
+    descartados e toda escrita ou barreira posterior levanta WriteError.
+    """
+
+    def __init__(self, durability=DURABILITY, batch_records=GROUP_COMMIT_RECORDS,
+                 batch_ms=GROUP_COMMIT_MS, queue_size=GROUP_COMMIT_QUEUE,
+                 metrics_interval=STORAGE_METRICS_INTERVAL, observer=None):
+        if durability not in ("sync", "batched", "async"):
+            raise ValueError(f"Modo de durabilidade inválido: {durability}")
+        self.durability = durability
+        self.batch_records = batch_records
+        self.batch_seconds = batch_ms / 1000
+        self.metrics_interval = metrics_interval
+        # Chamado com (registros, segundos) a cada lote gravado
+        self.observer = observer
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.deferring = None
+        self.failed = None
+
+        self.flushes = 0
+        self.records_flushed = 0
+        self.max_batch = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.last_report = time.monotonic()
+
+        self.thread = None
+        if durability != "sync":
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def append(self, log, record, payload=None):
+        """Enfileira um registro (ou grava direto no modo sync) e retorna sua posição"""
+        with self.lock:
+            self.check()
+            pointer, frame = log.prepare(record, payload)
+            if self.durability == "sync":
+                start = time.perf_counter()
+                try:
+                    log.write([(pointer, frame)])
+                    if self.deferring is None:
+                        log.sync()
+                except Exception as e:
+                    self.discard(log, pointer, e)
+                    raise WriteError(f"Falha ao gravar registro: {e}") from e
+                if self.deferring is not None:
+                    self.deferring.add(log)
+                    return pointer
+                self.record_flush(1, start)
+                return pointer
+            self.pending[(id(log), pointer)] = record
+            # Bloqueia quando a fila está cheia (backpressure sobre as requisições)
+            self.queue.put((log, pointer, frame))
+        return pointer
+
+    def check(self):
+        if self.failed is not None:
+            raise WriteError(f"Escrita interrompida após falha: {self.failed}") from self.failed
+
+    def discard(self, log, pointer, error):
+        """Modo sync: desfaz o registro com erro para que o próximo ocupe sua posição"""
+        try:
+            log.rewind(pointer)
+        except Exception as e:
+            print(f"Erro ao desfazer escrita em {log.directory}: {e}")
+            self.failed = error
+
+    @contextmanager
+    def deferred(self):
+        """No modo sync, agrupa as escritas do bloco em um único fsync por log"""
+        if self.durability != "sync" or self.deferring is not None:
+            yield
+            return
+        self.deferring = set()
+        try:
+            yield
+        finally:
+            logs, self.deferring = self.deferring, None
+            start = time.perf_counter()
+            with self.lock:
+                try:
+                    for log in logs:
+                        log.sync()
+                except Exception as e:
+                    # Vários registros já escritos sem fsync confirmado: não há como desfazer só um
+                    self.failed = e
+                    raise WriteError(f"Falha ao sincronizar registros: {e}") from e
+            if logs:
+                self.record_flush(len(logs), start)
+
+    def barrier(self, logs):
+        """Bloqueia até que tudo o que foi enfileirado antes esteja gravado e sincronizado"""
+        if self.durability == "sync":
+            with self.lock:
+                self.check()
+                try:
+                    for log in logs:
+                        log.sync()
+                except Exception as e:
+                    self.failed = e
+                    raise WriteError(f"Falha ao sincronizar registros: {e}") from e
+            return
+        self.check()
+        done = threading.Event()
+        self.queue.put((None, logs, done))
+        done.wait()
+        self.check()
+
+    def read(self, log, pointer):
+        """Lê um registro, inclusive se ainda estiver na fila de escrita"""
+        record = self.pending.get((id(log), pointer))
+        if record is not None:
+            return record
+        return log.read(pointer)
+
+    def next_batch(self):
+        """Aguarda o primeiro registro e coleta o lote até N registros ou T ms"""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.batch_seconds
+        while len(batch) < self.batch_records:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self.queue.get_nowait())
+                else:
+                    batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        """Loop da thread de escrita"""
+        while True:
+            batch = self.next_batch()
+            start = time.perf_counter()
+            barriers = [item for item in batch if item[0] is None]
+            records = [item for item in batch if item[0] is not None]
+            try:
+                if self.failed is None:
+                    self.write_batch(records, barriers, start)
+                elif records:
+                    print(f"Escrita interrompida: {len(records)} registros descartados")
+            except Exception as e:
+                self.failed = e
+                print(f"Erro na escrita em lote ({len(records)} registros), escrita interrompida: {e}")
+            finally:
+                for log, pointer, _ in records:
+                    self.pending.pop((id(log), pointer), None)
+                for _, _, done in barriers:
+                    done.set()
+                for _ in batch:
+                    self.queue.task_done()
+            self.maybe_report()
+
+    def write_batch(self, records, barriers, start):
+        by_log = {}
+        for log, pointer, frame in records:
+            by_log.setdefault(id(log), (log, []))[1].append((pointer, frame))
+        for log, entries in by_log.values():
+            log.write(entries)
+            if self.durability == "batched":
+                log.sync()
+            else:
+                log.maybe_sync()
+        if records:
+            self.record_flush(len(records), start)
+        for _, logs, _ in barriers:
+            for log in logs:
+                log.sync()
+
+    def record_flush(self, count, start):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.flushes += 1
+        self.records_flushed += count
+        self.max_batch = max(self.max_batch, count)
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+        if self.observer:
+            self.observer(count, elapsed_ms / 1000)
+
+    def metrics(self):
+        """Retorna métricas da fila e dos flushes"""
+        return {
+            "durability": self.durability,
+            "failed": self.failed is not None,
+            "queue_depth": self.queue.qsize(),
+            "flushes": self.flushes,
+            "records_flushed": self.records_flushed,
+            "max_batch": self.max_batch,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+    def maybe_report(self):
+        if self.metrics_interval <= 0 or time.monotonic() - self.last_report < self.metrics_interval:
+            return
+        self.last_report = time.monotonic()
+        m = self.metrics()
+        print(f"[storage] fila={m['queue_depth']} flushes={m['flushes']} registros={m['records_flushed']} "
+              f"flush médio={m['avg_flush_ms']}ms máx={m['max_flush_ms']}ms")
+
+    def flush(self):
+        """Aguarda até que todos os registros enfileirados estejam gravados"""
+        if self.thread:
+            self.queue.join()
+        self.check()
+
+
+class Storage:
+    """Agrupa os logs de usuários, canais, mensagens, publicações e confirmações de entrega"""
+
+    def __init__(self, data_dir, writer=None, recover_from=None):
+        recover_from = recover_from or {}
+        self.data_dir = data_dir
+        self.users = SegmentLog(os.path.join(data_dir, "users"),
+                                recover_from=recover_from.get("users"), key_field=KEY_FIELDS["users"])
+        self.channels = SegmentLog(os.path.join(data_dir, "channels"),
+                                   recover_from=recover_from.get("channels"), key_field=KEY_FIELDS["channels"])
+        self.messages = SegmentLog(os.path.join(data_dir, "messages"),
+                                   recover_from=recover_from.get("messages"), key_field=KEY_FIELDS["messages"])
+        self.publications = SegmentLog(os.path.join(data_dir, "publications"),
+                                       recover_from=recover_from.get("publications"),
+                                       key_field=KEY_FIELDS["publications"])
+        self.acks = SegmentLog(os.path.join(data_dir, "acks"), recover_from=recover_from.get("acks"))
+        self.writer = writer or GroupCommitWriter()
+
+    def logs(self):
+        return {
+            "users": self.users,
+            "channels": self.channels,
+            "messages": self.messages,
+            "publications": self.publications,
+            "acks": self.acks,
+        }
+
+    def append(self, log, record, payload=None):
+        """Persiste um registro conforme o modo de durabilidade configurado"""
+        return self.writer.append(log, record, payload)
+
+    def read(self, log, pointer):
+        return self.writer.read(log, pointer)
+
+    def deferred(self):
+        return self.writer.deferred()
+
+    def sync_all(self):
+        """Garante que todos os registros já enfileirados estão em disco"""
+        self.writer.barrier(list(self.logs().values()))
+
+    def tails(self):
+        """Posições de final de cada log (próxima escrita)"""
+        return {name: log.tail for name, log in self.logs().items()}
+
+    def metrics(self):
+        return self.writer.metrics()
+
+    def close(self):
+        try:
+            self.writer.flush()
+        finally:
+            for log in self.logs().values():
+                log.close()
+
+
+def legacy_records(name, content):
+    """Converte o conteúdo de um arquivo JSON antigo em registros do log"""
+    if name == "users":
+        for user, timestamps in content.items():
+            for timestamp in timestamps:
+                yield {"user": user, "timestamp": timestamp}
+    elif name == "channels":
+        for channel in content:
+            yield {"channel": channel}
+    else:
+        yield from content
+
+
+def migrate_legacy_json(data_dir, storage, shared=False):
+    """Importa (uma única vez) os arquivos JSON antigos para os logs de segmentos
+
+    Com shared=True os arquivos estão no diretório compartilhado entre réplicas: não são
+    renomeados, pois as outras réplicas também os importam, e cada réplica só importa
+    para os seus logs ainda vazios (como import_shared_logs).
+    """
+    migrated = {}
+    for name, filename in LEGACY_FILES.items():
+        path = os.path.join(data_dir, filename)
+        if not os.path.exists(path):
+            continue
+        log = storage.logs()[name]
+        if not log.is_empty():
+            if not shared:
+                print(f"Aviso: {filename} ignorado, log '{name}' já contém dados")
+            continue
+        try:
+            with open(path, "r") as f:
+                text = f.read()
+            content = json.loads(text) if text.strip() else []
+        except (json.JSONDecodeError, ValueError) as e:
+            print(f"Aviso: {filename} corrompido, não migrado: {e}")
+            continue
+        count = 0
+        for record in legacy_records(name, content):
+            log.append(record)
+            count += 1
+        log.sync()
+        if not shared:
+            try:
+                os.rename(path, path + ".migrated")
+            except FileNotFoundError:
+                # Outro processo migrou o mesmo arquivo ao mesmo tempo
+                pass
+        migrated[name] = count
+        print(f"Migrados {count} registros de {filename}")
+    return migrated
+
+
+def import_shared_logs(source_dir, storage):
+    """Copia os logs do antigo diretório compartilhado entre réplicas para os logs desta réplica
+
+    Só importa logs ainda vazios; o diretório de origem não é alterado, pois as outras
+    réplicas também o importam.
+    """
+    imported = {}
+    for name, log in storage.logs().items():
+        directory = os.path.join(source_dir, name)
+        if not os.path.isdir(directory) or not log.is_empty():
+            continue
+        count = 0
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith(SEGMENT_SUFFIX):
+                continue
+            with open(os.path.join(directory, filename), "rb") as f:
+                data = f.read()
+            header = FRAME_HEADERS.get(data[:len(SEGMENT_MAGIC)])
+            if header is None:
+                continue
+            for _, payload in iter_frames(data, header=header):
+                log.append(msgpack.unpackb(payload, raw=False))
+                count += 1
+        if count:
+            log.sync()
+            imported[name] = count
+            print(f"Importados {count} registros do log compartilhado '{name}'")
+    return imported
+
+
+if __name__ == "__main__":
+    import sys
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else "/app/data"
+    storage = Storage(data_dir)
+    migrate_legacy_json(data_dir, storage)
+    storage.close()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""Números de sequência por origem e digests por faixa para sincronização entre réplicas
+
+Cada mutação recebe (origem, seq) no servidor que a criou; os registros persistidos
+guardam esses campos, então qualquer réplica pode servir a outra tudo o que veio
+depois de um seq. Divergências que os números de sequência não cobrem (dados
+anteriores à numeração, registros perdidos) são encontradas comparando digests de
+baldes de hash e reparadas trocando apenas os registros ausentes.
+"""
+import hashlib
+import heapq
+import os
+from array import array
+from bisect import bisect_right
+
+import msgpack
+
+from history import OFFSET_BITS, pack_pointer, unpack_pointer
+from ordering import VectorClock
+
+PEER_PORT = int(os.environ.get("PEER_PORT", 5560))
+SYNC_TIMEOUT = float(os.environ.get("SYNC_TIMEOUT", 2.0))               # segundos por requisição
+SYNC_INTERVAL = float(os.environ.get("SYNC_INTERVAL", 300))             # anti-entropia periódica
+SYNC_RETRY_INTERVAL = float(os.environ.get("SYNC_RETRY_INTERVAL", 5))   # após lacuna sem sucesso
+SYNC_CHECK_INTERVAL = float(os.environ.get("SYNC_CHECK_INTERVAL", 0.2))  # verificação de lacunas
+SYNC_BATCH_OPERATIONS = int(os.environ.get("SYNC_BATCH_OPERATIONS", 1000))
+SYNC_MAX_BUCKETS = int(os.environ.get("SYNC_MAX_BUCKETS", 32))          # baldes reparados por rodada
+SYNC_BUCKETS = 256
+
+# Campos que identificam um registro (origem/seq e campos extras não entram no hash)
+RECORD_FIELDS = {
+    "users": ("user", "timestamp"),
+    "channels": ("channel",),
+    "messages": ("src", "dst", "message", "timestamp", "clock"),
+    "publications": ("channel", "user", "message", "timestamp", "clock"),
+    "acks": ("user", "cursor"),
+}
+OPERATIONS = {"users": "login", "channels": "channel", "messages": "message", "publications": "publication",
+              "acks": "ack"}
+DIGEST_MASK = (1 << 64) - 1
+
+# Resultado de check()
+APPLY = "apply"
+DUPLICATE = "duplicate"
+GAP = "gap"
+
+
+def sequence_stream(kind, seqs, pointers, start):
+    for i in range(start, len(seqs)):
+        yield seqs[i], kind, pointers[i]
+
+
+def record_hash(kind, record):
+    """Hash de 64 bits do conteúdo do registro, igual em todas as réplicas"""
+    fields = [record.get(field) for field in RECORD_FIELDS[kind]]
+    digest = hashlib.blake2b(msgpack.packb([kind, fields]), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class ReplicaLog:
+    """Índice de (origem, seq) dos registros locais e digests dos baldes de hash"""
+
+    def __init__(self, buckets=SYNC_BUCKETS):
+        self.buckets = buckets
+        self.applied = {}    # {origem: maior seq aplicado}
+        self.vector = VectorClock()  # applied em forma de relógio vetorial (ver ordering.py)
+        self.sequences = {}  # {(origem, tipo): (array('Q') seqs, array('Q') posições)}
+        self.digests = {kind: [0] * buckets for kind in RECORD_FIELDS}
+        self.members = {kind: [array("Q") for _ in range(buckets)] for kind in RECORD_FIELDS}
+        self.pending = set()  # origens com lacuna detectada na replicação ao vivo
+
+    def next_sequence(self, origin):
+        return self.applied.get(origin, 0) + 1
+
+    def check(self, origin, seq):
+        """Classifica uma operação ao vivo: aplicar, duplicada ou com lacuna antes dela"""
+        last = self.applied.get(origin, 0)
+        if seq <= last:
+            return DUPLICATE
+        if seq > last + 1:
+            return GAP
+        return APPLY
+
+    def advance(self, origin, seq):
+        if seq > self.applied.get(origin, 0):
+            self.applied[origin] = seq
+            self.vector.advance(origin, seq)
+
+    def add(self, kind, record, pointer):
+        """Registra um registro persistido no digest e, se numerado, no índice da origem"""
+        value = record_hash(kind, record)
+        bucket = value % self.buckets
+        self.digests[kind][bucket] = (self.digests[kind][bucket] + value) & DIGEST_MASK
+        packed = pack_pointer(pointer)
+        self.members[kind][bucket].append(packed)
+
+        seq = record.get("seq")
+        if seq is None:
+            return
+        origin = record.get("origin")
+        entry = self.sequences.get((origin, kind))
+        if entry is None:
+            entry = self.sequences[(origin, kind)] = (array("Q"), array("Q"))
+        entry[0].append(seq)
+        entry[1].append(packed)
+        self.advance(origin, seq)
+
+    def after(self, since, limit=SYNC_BATCH_OPERATIONS):
+        """Retorna ([(tipo, posição)], truncado) dos registros posteriores a `since` por origem"""
+        streams = {}
+        for (origin, kind), (seqs, pointers) in list(self.sequences.items()):
+            start = bisect_right(seqs, since.get(origin, 0))
+            if start < len(seqs):
+                streams.setdefault(origin, []).append(sequence_stream(kind, seqs, pointers, start))
+
+        result = []
+        for origin, kind_streams in streams.items():
+            for _, kind, packed in heapq.merge(*kind_streams):
+                if len(result) >= limit:
+                    return result, True
+                result.append((kind, unpack_pointer(packed)))
+        return result, False
+
+    def prune_plan(self, kind, dropped):
+        """Calcula (em segundo plano) cópias dos índices de `kind` sem as posições dos segmentos
+        removidos pela retenção; os digests não mudam, pois as outras réplicas aplicam a mesma política"""
+        sequences = []
+        for key, (seqs, pointers) in list(self.sequences.items()):
+            if key[1] != kind:
+                continue
+            n = len(pointers)
+            keep = [i for i in range(n) if pointers[i] >> OFFSET_BITS not in dropped]
+            if len(keep) < n:
+                sequences.append((key, n, array("Q", [seqs[i] for i in keep]),
+                                  array("Q", [pointers[i] for i in keep])))
+        members = []
+        for bucket, packed in enumerate(self.members[kind]):
+            n = len(packed)
+            kept = array("Q", [p for p in packed[:n] if p >> OFFSET_BITS not in dropped])
+            if len(kept) < n:
+                members.append((bucket, n, kept))
+        return sequences, members
+
+    def apply_prune(self, kind, plan):
+        """Troca os índices pelas cópias de prune_plan, acrescentando o que chegou depois dela"""
+        sequences, members = plan
+        for key, n, seqs, pointers in sequences:
+            current_seqs, current_pointers = self.sequences[key]
+            seqs.extend(current_seqs[n:])
+            pointers.extend(current_pointers[n:])
+            self.sequences[key] = (seqs, pointers)
+        for bucket, n, kept in members:
+            kept.extend(self.members[kind][bucket][n:])
+            self.members[kind][bucket] = kept
+
+    def digest(self):
+        return {kind: list(values) for kind, values in self.digests.items()}
+
+    def diff(self, remote, limit=SYNC_MAX_BUCKETS, kinds=None):
+        """Baldes [(tipo, balde)] cujo digest difere do digest remoto"""
+        differing = []
+        for kind, values in self.digests.items():
+            if kinds is not None and kind not in kinds:
+                continue
+            remote_values = remote.get(kind)
+            if not remote_values or len(remote_values) != self.buckets:
+                continue
+            for bucket in range(self.buckets):
+                if values[bucket] != remote_values[bucket]:
+                    differing.append((kind, bucket))
+                    if len(differing) >= limit:
+                        return differing
+        return differing
+
+    def bucket_pointers(self, kind, bucket):
+        return [unpack_pointer(p) for p in self.members[kind][bucket]]
+
+    def export(self):
+        """Serializa o índice de forma compacta para snapshots"""
+        return {
+            "applied": self.applied,
+            "sequences": [
+                [origin, kind, seqs.tobytes(), pointers.tobytes()]
+                for (origin, kind), (seqs, pointers) in self.sequences.items()
+            ],
+            "digests": self.digests,
+            "members": {kind: [b.tobytes() for b in buckets] for kind, buckets in self.members.items()},
+        }
+
+    def restore(self, exported):
+        """Reconstrói o índice a partir de export()"""
+        self.applied = dict(exported["applied"])
+        self.vector = VectorClock.from_dict(self.applied)
+        self.sequences = {}
+        for origin, kind, seqs, pointers in exported["sequences"]:
+            seq_array = array("Q")
+            seq_array.frombytes(seqs)
+            pointer_array = array("Q")
+            pointer_array.frombytes(pointers)
+            self.sequences[(origin, kind)] = (seq_array, pointer_array)
+        self.digests = {kind: list(values) for kind, values in exported["digests"].items()}
+        self.members = {}
+        for kind, buckets in exported["members"].items():
+            self.members[kind] = []
+            for data in buckets:
+                bucket = array("Q")
+                bucket.frombytes(data)
+                self.members[kind].append(bucket)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os módulos do servidor são importados pelo nome, como em main.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
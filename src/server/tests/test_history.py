@@ -0,0 +1,81 @@
+"""Testes do índice de histórico (history.HistoryIndex)"""
+import sys
+import threading
+import time
+
+from history import HistoryIndex, history_key, valid_cursor
+from storage import RecordPointer
+
+
+def test_numeric_and_iso_timestamps_share_one_order():
+    index = HistoryIndex()
+    # Mesmo relógio, timestamps em formatos diferentes: a chave não pode misturar tipos
+    index.add("geral", history_key(5, "2025-01-01T00:00:00", "server_1", 1), RecordPointer(0, 10))
+    index.add("geral", history_key(5, 1735689600, "server_2", 1), RecordPointer(0, 20))
+    index.add("geral", history_key(5, 1735689600 * 1_000_000, "server_3", 1), RecordPointer(0, 30))
+    assert all(isinstance(key[1], str) for key in index.keys["geral"])
+
+    pointers, _ = index.page("geral", 10)
+    assert sorted(pointers) == [RecordPointer(0, 10), RecordPointer(0, 20), RecordPointer(0, 30)]
+    # Cursor de página com timestamp numérico cai na mesma ordem das chaves
+    pointers, _ = index.page("geral", 10, after=[5, 1735689600, "server_1", 1])
+    assert pointers == [RecordPointer(0, 20), RecordPointer(0, 30)]
+
+
+def test_restore_normalizes_timestamps_of_old_snapshots():
+    index = HistoryIndex()
+    index.add("geral", history_key(1, "2025-01-01T00:00:00", "server_1", 1), RecordPointer(0, 10))
+    snapshot = index.export()
+    snapshot[0][2] = [1735689600]
+
+    restored = HistoryIndex()
+    restored.restore(snapshot)
+    restored.add("geral", history_key(2, "2025-01-01T00:00:01", "server_1", 2), RecordPointer(0, 20))
+    assert [key[1] for key in restored.keys["geral"]] == [history_key(0, 1735689600)[1], "2025-01-01T00:00:01"]
+
+
+def test_valid_cursor_checks_types():
+    assert valid_cursor([3, "2025-01-01T00:00:00"])
+    assert valid_cursor([3, "2025-01-01T00:00:00", "server_1", 7])
+    assert not valid_cursor(["3", "2025-01-01T00:00:00"])
+    assert not valid_cursor([3, "2025-01-01T00:00:00", ["server_1"], 7])
+    assert not valid_cursor([3, "2025-01-01T00:00:00", "server_1", "7"])
+    assert not valid_cursor({"clock": 3})
+
+
+
+def test_page_sees_keys_and_pointers_of_the_same_state():
+    index = HistoryIndex()
+    stop = threading.Event()
+    mismatches = []
+
+    def offset(key):
+        # A posição codifica a chave: página coerente tem o cursor igual ao primeiro registro
+        return key[0] * 10_000 + key[3]
+
+    def reader():
+        while not stop.is_set():
+            pointers, cursor = index.page("geral", 20)
+            if cursor is not None and pointers[0].offset != offset(cursor):
+                mismatches.append((cursor, pointers[0]))
+            time.sleep(0)
+
+    # Trocas de thread frequentes expõem leituras no meio de uma alteração
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    threads = [threading.Thread(target=reader) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    try:
+        for seq in range(1, 3000):
+            # Relógios alternados forçam inserções no meio das listas
+            key = history_key(seq + 200 - (seq % 7) * 30, "t", "server_1", seq)
+            index.add("geral", key, RecordPointer(0, offset(key)))
+            if seq % 200 == 0:
+                index.trim("geral", 100)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(interval)
+    assert not mismatches
@@ -0,0 +1,338 @@
+"""Testes do log de segmentos (storage.SegmentLog) e da escrita em lote (storage.GroupCommitWriter)"""
+import os
+import threading
+
+import pytest
+
+from storage import SEGMENT_MAGIC, GroupCommitWriter, RecordPointer, SegmentLog, Storage, WriteError
+
+
+def records(count, prefix="m"):
+    return [{"user": "ana", "message": f"{prefix}{i}", "clock": i} for i in range(count)]
+
+
+def replayed(log):
+    return [record for _, record in log.replay()]
+
+
+def gate(log):
+    """Segura as escritas do log na thread de escrita até o evento devolvido ser sinalizado"""
+    release = threading.Event()
+    write = log.write
+
+    def gated(entries):
+        release.wait(5)
+        write(entries)
+
+    log.write = gated
+    return release
+
+
+def fail_syncs(log, count=1):
+    """Faz as próximas `count` chamadas de sync do log falharem como um disco com erro"""
+    failures = [count]
+    sync = log.sync
+
+    def failing():
+        if failures[0] > 0:
+            failures[0] -= 1
+            raise OSError("disco indisponível")
+        sync()
+
+    log.sync = failing
+
+
+def count_syncs(log):
+    calls = []
+    sync = log.sync
+
+    def counted():
+        calls.append(1)
+        sync()
+
+    log.sync = counted
+    return calls
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / "messages")
+
+
+def test_append_read_and_replay(directory):
+    log = SegmentLog(directory, fsync="never")
+    assert log.is_empty()
+    pointers = [log.append(record) for record in records(5)]
+    assert not log.is_empty()
+    assert [log.read(pointer) for pointer in pointers] == records(5)
+    assert replayed(log) == records(5)
+    log.close()
+
+
+def test_rollover_spreads_records_over_segments(directory):
+    log = SegmentLog(directory, segment_bytes=200, fsync="never")
+    pointers = [log.append(record) for record in records(20)]
+    log.close()
+
+    segments = sorted(name for name in os.listdir(directory) if name.endswith(".seg"))
+    assert len(segments) > 1
+    assert all(os.path.getsize(os.path.join(directory, name)) <= 200 for name in segments[:-1])
+    # Posições crescentes: segmento e deslocamento
+    assert pointers == sorted(pointers)
+    assert len({pointer.segment for pointer in pointers}) == len(segments)
+
+    reopened = SegmentLog(directory, segment_bytes=200, fsync="never")
+    assert [reopened.read(pointer) for pointer in pointers] == records(20)
+    assert replayed(reopened) == records(20)
+    assert reopened.sealed() == list(range(len(segments) - 1))
+    reopened.close()
+
+
+def test_reopen_continues_after_last_record(directory):
+    log = SegmentLog(directory, fsync="always")
+    for record in records(3):
+        log.append(record)
+    tail = log.tail
+    log.close()
+
+    reopened = SegmentLog(directory, fsync="always")
+    assert reopened.tail == tail
+    pointer = reopened.append({"user": "ana", "message": "depois", "clock": 9})
+    assert pointer == tail
+    assert replayed(reopened) == records(3) + [{"user": "ana", "message": "depois", "clock": 9}]
+    reopened.close()
+
+
+def test_truncated_tail_is_discarded_on_reopen(directory):
+    log = SegmentLog(directory, fsync="always")
+    pointers = [log.append(record) for record in records(3)]
+    log.close()
+    path = log.segment_path(pointers[-1].segment)
+    size = os.path.getsize(path)
+    # Queda no meio do último append: só parte do frame chegou ao disco
+    with open(path, "r+b") as f:
+        f.truncate(size - 5)
+
+    reopened = SegmentLog(directory, fsync="always")
+    assert reopened.tail == pointers[-1]
+    assert os.path.getsize(path) == pointers[-1].offset
+    assert replayed(reopened) == records(2)
+    # O próximo registro ocupa o lugar do frame descartado
+    assert reopened.append(records(3)[2]) == pointers[-1]
+    assert replayed(reopened) == records(3)
+    reopened.close()
+
+
+def test_garbage_after_last_frame_is_discarded(directory):
+    log = SegmentLog(directory, fsync="always")
+    pointers = [log.append(record) for record in records(2)]
+    tail = log.tail
+    log.close()
+    with open(log.segment_path(pointers[0].segment), "ab") as f:
+        f.write(b"\x00\x00\x00\x10lixo")
+
+    reopened = SegmentLog(directory, fsync="always")
+    assert reopened.tail == tail
+    assert replayed(reopened) == records(2)
+    reopened.close()
+
+
+def test_segment_with_only_partial_magic_is_restored(directory):
+    log = SegmentLog(directory, fsync="always")
+    path = log.segment_path(0)
+    log.close()
+    with open(path, "r+b") as f:
+        f.truncate(2)
+
+    reopened = SegmentLog(directory, fsync="always")
+    assert reopened.is_empty()
+    with open(path, "rb") as f:
+        assert f.read() == SEGMENT_MAGIC
+    reopened.append(records(1)[0])
+    assert replayed(reopened) == records(1)
+    reopened.close()
+
+
+def test_recover_from_only_checks_frames_after_trusted_position(directory):
+    log = SegmentLog(directory, fsync="always")
+    pointers = [log.append(record) for record in records(4)]
+    log.close()
+    path = log.segment_path(0)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 3)
+
+    reopened = SegmentLog(directory, fsync="always", recover_from=pointers[2])
+    assert reopened.tail == pointers[3]
+    assert replayed(reopened) == records(3)
+    reopened.close()
+
+
+def test_invalid_fsync_policy(directory):
+    with pytest.raises(ValueError):
+        SegmentLog(directory, fsync="sometimes")
+
+
+def test_read_of_unknown_segment_returns_none(directory):
+    log = SegmentLog(directory, fsync="never")
+    assert log.read(RecordPointer(7, len(SEGMENT_MAGIC))) is None
+    log.close()
+
+
+@pytest.mark.parametrize("durability", ["sync", "batched", "async"])
+def test_every_durability_mode_persists_all_records(tmp_path, durability):
+    writer = GroupCommitWriter(durability=durability, metrics_interval=0)
+    storage = Storage(str(tmp_path), writer)
+    messages = records(50)
+    publications = records(30, prefix="p")
+    pointers = []
+    for message, publication in zip(messages, publications + [None] * 20):
+        pointers.append(storage.append(storage.messages, message))
+        if publication:
+            storage.append(storage.publications, publication)
+    assert [storage.read(storage.messages, pointer) for pointer in pointers] == messages
+    storage.close()
+    assert writer.records_flushed == 80
+    assert not writer.pending
+
+    reopened = Storage(str(tmp_path), GroupCommitWriter(durability="sync", metrics_interval=0))
+    assert replayed(reopened.messages) == messages
+    assert replayed(reopened.publications) == publications
+    reopened.close()
+
+
+def test_sync_mode_writes_before_returning(directory):
+    writer = GroupCommitWriter(durability="sync", metrics_interval=0)
+    assert writer.thread is None
+    log = SegmentLog(directory, fsync="never")
+    syncs = count_syncs(log)
+    pointer = writer.append(log, records(1)[0])
+    # Sem fila: o registro já está no arquivo e sincronizado
+    assert not writer.pending
+    assert syncs == [1]
+    assert log.read(pointer) == records(1)[0]
+    assert writer.metrics()["flushes"] == 1
+    log.close()
+
+
+def test_sync_mode_deferred_block_syncs_once_per_log(directory):
+    writer = GroupCommitWriter(durability="sync", metrics_interval=0)
+    log = SegmentLog(directory, fsync="never")
+    syncs = count_syncs(log)
+    with writer.deferred():
+        for record in records(10):
+            writer.append(log, record)
+        assert syncs == []
+    assert syncs == [1]
+    assert replayed(log) == records(10)
+    log.close()
+
+
+def test_batched_mode_groups_records_in_one_write_and_fsync(directory):
+    writer = GroupCommitWriter(durability="batched", batch_records=100, batch_ms=50, metrics_interval=0)
+    log = SegmentLog(directory, fsync="never")
+    syncs = count_syncs(log)
+    release = gate(log)
+    writer.append(log, {"message": "primeiro"})
+    for record in records(20):
+        writer.append(log, record)
+    release.set()
+    writer.flush()
+    # O primeiro registro pode sair sozinho; os demais, parados na fila, formam um lote
+    assert writer.records_flushed == 21
+    assert writer.flushes <= 2
+    assert writer.max_batch >= 20
+    assert len(syncs) == writer.flushes
+    assert replayed(log) == [{"message": "primeiro"}] + records(20)
+    log.close()
+
+
+def test_async_mode_leaves_fsync_to_log_policy(directory):
+    writer = GroupCommitWriter(durability="async", metrics_interval=0)
+    log = SegmentLog(directory, fsync="never")
+    syncs = count_syncs(log)
+    for record in records(10):
+        writer.append(log, record)
+    writer.flush()
+    assert syncs == []
+    assert replayed(log) == records(10)
+    # barrier força o fsync mesmo no modo async
+    writer.barrier([log])
+    assert syncs == [1]
+    log.close()
+
+
+@pytest.mark.parametrize("durability", ["batched", "async"])
+def test_read_while_pending_returns_queued_record(directory, durability):
+    writer = GroupCommitWriter(durability=durability, metrics_interval=0)
+    log = SegmentLog(directory, fsync="never")
+    release = gate(log)
+    pointers = [writer.append(log, record) for record in records(3)]
+    # Ainda na fila: lido da memória, o arquivo continua vazio
+    assert [writer.read(log, pointer) for pointer in pointers] == records(3)
+    assert log.active_size == len(SEGMENT_MAGIC)
+    release.set()
+    writer.flush()
+    assert not writer.pending
+    assert [writer.read(log, pointer) for pointer in pointers] == records(3)
+    assert [log.read(pointer) for pointer in pointers] == records(3)
+    log.close()
+
+
+def test_barrier_waits_for_queued_records(directory):
+    writer = GroupCommitWriter(durability="batched", metrics_interval=0)
+    log = SegmentLog(directory, fsync="never")
+    release = gate(log)
+    for record in records(5):
+        writer.append(log, record)
+    done = threading.Event()
+    threading.Thread(target=lambda: (writer.barrier([log]), done.set()), daemon=True).start()
+    assert not done.wait(0.1)
+    release.set()
+    assert done.wait(5)
+    assert not writer.pending
+    assert replayed(log) == records(5)
+    log.close()
+
+
+def test_invalid_durability_mode():
+    with pytest.raises(ValueError):
+        GroupCommitWriter(durability="eventual")
+
+
+def test_sync_mode_failure_raises_and_rewinds_the_tail(directory):
+    writer = GroupCommitWriter(durability="sync", metrics_interval=0)
+    log = SegmentLog(directory, fsync="never")
+    writer.append(log, records(1)[0])
+    tail = log.tail
+    fail_syncs(log)
+    with pytest.raises(WriteError):
+        writer.append(log, {"message": "perdido"})
+    # O registro com erro sai do arquivo e o próximo ocupa a sua posição
+    assert log.tail == tail
+    assert writer.append(log, records(2)[1]) == tail
+    assert replayed(log) == records(2)
+    log.close()
+
+
+@pytest.mark.parametrize("durability", ["batched", "async"])
+def test_queued_write_failure_stops_the_writer(directory, durability):
+    writer = GroupCommitWriter(durability=durability, metrics_interval=0)
+    log = SegmentLog(directory, fsync="never")
+    write = log.write
+
+    def failing(entries):
+        raise OSError("disco indisponível")
+
+    log.write = failing
+    writer.append(log, records(1)[0])
+    # Barreira e flush avisam quem espera em vez de confirmar a gravação
+    with pytest.raises(WriteError):
+        writer.barrier([log])
+    log.write = write
+    with pytest.raises(WriteError):
+        writer.append(log, records(2)[1])
+    with pytest.raises(WriteError):
+        writer.flush()
+    assert writer.metrics()["failed"]
+    assert not writer.pending
+    log.close()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Esquema compacto do protocolo (versão 2)
+
+A versão 1 é o formato original: {"service": nome, "data": {...}} com nomes de
+campos e timestamps ISO em toda mensagem. A versão 2 troca o dicionário por um
+array posicional com o serviço como inteiro e timestamps em microssegundos:
+
+  requisição: [2, código, clock, timestamp_us, campos...]
+  resposta:   [2, código, status, clock, timestamp_us, campos...]
+  publicação: tópico WIRE_TOPIC_PREFIX + nome, [usuário|origem, mensagem, timestamp_us, clock]
+
+A versão é reconhecida em cada mensagem (array = v2, mapa = v1), então clientes
+antigos continuam funcionando sem configuração. Os handlers seguem recebendo e
+devolvendo dicionários: a conversão acontece só nas bordas (decode_request e
+encode_response). O início de cada resposta (cabeçalho do array, versão, código
+e status) é codificado uma única vez por combinação e reaproveitado.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+import msgpack
+
+WIRE_VERSION = 2
+# Formato das publicações no proxy: v1 | v2 | both (both enquanto houver clientes v1 inscritos)
+WIRE_PUBLISH = os.environ.get("WIRE_PUBLISH", "v1")
+# Tópicos v2 ficam separados dos v1 (nenhum nome de canal/usuário começa com \x02)
+WIRE_TOPIC_PREFIX = b"\x02"
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# Serviços do protocolo compacto: código, campos da requisição e campos da resposta
+SERVICE_CODES = {
+    "login": 1,
+    "users": 2,
+    "channel": 3,
+    "channels": 4,
+    "publish": 5,
+    "message": 6,
+    "history": 7,
+    "inbox": 8,
+    "fetch": 9,
+    "ack": 10,
+}
+SERVICE_NAMES = {code: name for name, code in SERVICE_CODES.items()}
+REQUEST_FIELDS = {
+    "login": ("user",),
+    "users": ("if_version", "since", "offset", "limit"),
+    "channel": ("channel",),
+    "channels": ("if_version", "since", "offset", "limit"),
+    "publish": ("user", "channel", "message"),
+    "message": ("src", "dst", "message"),
+    "history": ("channel", "limit", "before", "after"),
+    "inbox": ("user", "limit", "before", "after"),
+    "fetch": ("user", "limit", "after"),
+    "ack": ("user", "cursor"),
+}
+RESPONSE_FIELDS = {
+    "login": (),
+    "users": ("users", "version", "not_modified", "delta", "next"),
+    "channel": (),
+    "channels": ("channels", "version", "not_modified", "delta", "next"),
+    "publish": (),
+    "message": (),
+    "history": ("publications", "cursor"),
+    "inbox": ("messages", "cursor"),
+    "fetch": ("messages", "cursor", "pending"),
+    "ack": ("cursor",),
+}
+# Registros de histórico/inbox viram arrays com estes campos
+RECORD_FIELDS = {
+    "publications": ("user", "message", "timestamp", "clock"),
+    "messages": ("src", "message", "timestamp", "clock"),
+}
+
+_local = threading.local()
+_envelopes = {}
+
+
+class Prepacked:
+    """Valor já codificado em msgpack (data), copiado como está nas respostas; value é o original"""
+    __slots__ = ("data", "value")
+
+    def __init__(self, data, value):
+        self.data = data
+        self.value = value
+
+
+def unwrap(obj):
+    """default do msgpack: Prepacked aninhado (ex.: dentro de um lote) é codificado pelo valor original"""
+    if isinstance(obj, Prepacked):
+        return obj.value
+    raise TypeError(f"Tipo não serializável: {type(obj).__name__}")
+
+
+def packer():
+    """Packer reutilizável da thread atual (msgpack.Packer não é thread-safe)"""
+    instance = getattr(_local, "packer", None)
+    if instance is None:
+        instance = _local.packer = msgpack.Packer(default=unwrap)
+    return instance
+
+
+def now_micros():
+    return time.time_ns() // 1000
+
+
+def to_micros(timestamp):
+    """Timestamp ISO ou numérico em microssegundos desde a época; 0 se ausente ou inválido"""
+    if isinstance(timestamp, (int, float)):
+        # Clientes v1 podem mandar segundos (time.time()); abaixo de 10^12 não é microssegundo plausível
+        return int(timestamp * 1_000_000) if timestamp < 10 ** 12 else int(timestamp)
+    if not timestamp:
+        return 0
+    try:
+        return int(datetime.fromisoformat(timestamp).timestamp() * 1_000_000)
+    except (TypeError, ValueError):
+        return 0
+
+
+def to_iso(micros):
+    """Microssegundos desde a época em ISO (formato guardado no log e no histórico)"""
+    return datetime.fromtimestamp(micros / 1_000_000).isoformat()
+
+
+def is_compact(message):
+    return isinstance(message, list)
+
+
+def request_service(message):
+    """Nome do serviço de uma requisição em qualquer versão"""
+    if isinstance(message, list):
+        return SERVICE_NAMES.get(message[1]) if len(message) > 1 else None
+    return message.get("service")
+
+
+def decode_request(message):
+    """Requisição v2 -> (serviço, data) no formato que os handlers já recebem"""
+    if len(message) < 4 or message[0] != WIRE_VERSION:
+        return None, {}
+    service = SERVICE_NAMES.get(message[1])
+    if service is None:
+        return f"código {message[1]}", {}
+    data = dict(zip(REQUEST_FIELDS[service], message[4:]))
+    # Campos opcionais ausentes ou nulos ficam com o padrão do handler
+    data = {key: value for key, value in data.items() if value is not None}
+    data["clock"] = message[2]
+    if message[3]:
+        data["timestamp"] = to_iso(message[3])
+    return service, data
+
+
+def envelope(service, status, count):
+    """Início pré-codificado da resposta: cabeçalho do array, versão, código e status"""
+    key = (service, status, count)
+    prefix = _envelopes.get(key)
+    if prefix is None:
+        header = packer()
+        prefix = _envelopes[key] = (header.pack_array_header(5 + count) + header.pack(WIRE_VERSION)
+                                    + header.pack(SERVICE_CODES.get(service, 0)) + header.pack(status))
+    return prefix
+
+
+def compact_record(kind, record):
+    fields = RECORD_FIELDS[kind]
+    return [to_micros(record.get(field)) if field == "timestamp" else record.get(field) for field in fields]
+
+
+def encode_response(service, data):
+    """Resposta de um handler (data do formato v1) no formato v2"""
+    pack = packer().pack
+    if data.get("status") == "erro":
+        description = data.get("description") or data.get("message") or ""
+        return envelope(service, STATUS_ERROR, 1) + pack(data.get("clock", 0)) + pack(now_micros()) + pack(description)
+    fields = RESPONSE_FIELDS.get(service, ())
+    parts = [envelope(service, STATUS_OK, len(fields)), pack(data.get("clock", 0)), pack(now_micros())]
+    for field in fields:
+        value = data.get(field)
+        if isinstance(value, Prepacked):
+            parts.append(value.data)
+            continue
+        if field in RECORD_FIELDS:
+            value = [compact_record(field, record) for record in value or ()]
+        parts.append(pack(value))
+    return b"".join(parts)
+
+
+def pack_response(response):
+    """Resposta v1 em msgpack, copiando os valores Prepacked de data sem recodificá-los"""
+    data = response.get("data")
+    if not isinstance(data, dict) or not any(isinstance(value, Prepacked) for value in data.values()):
+        return msgpack.packb(response, default=unwrap)
+    pack = packer().pack
+    parts = [packer().pack_map_header(len(response))]
+    for key, value in response.items():
+        parts.append(pack(key))
+        if key != "data":
+            parts.append(pack(value))
+            continue
+        parts.append(packer().pack_map_header(len(data)))
+        for field, item in data.items():
+            parts.append(pack(field))
+            parts.append(item.data if isinstance(item, Prepacked) else pack(item))
+    return b"".join(parts)
+
+
+def encode_publication(author, message, timestamp, clock):
+    """Corpo v2 de uma publicação em canal (author = usuário) ou mensagem privada (author = origem)"""
+    return packer().pack([author, message, to_micros(timestamp), clock])
+
+
+def decode_response(payload):
+    """Resposta v2 -> {"service", "data"} como na v1 (usado por clientes Python e pelo benchmark)"""
+    message = msgpack.unpackb(payload, raw=False)
+    service = SERVICE_NAMES.get(message[1])
+    status, clock, micros = message[2], message[3], message[4]
+    data = {"status": "erro" if status == STATUS_ERROR else "OK", "clock": clock, "timestamp": micros}
+    if status == STATUS_ERROR:
+        data["description"] = message[5] if len(message) > 5 else ""
+    else:
+        data.update(zip(RESPONSE_FIELDS.get(service, ()), message[5:]))
+    return {"service": service, "data": data}
+
+
+def encode_request(service, clock, fields, timestamp_us=None):
+    """Requisição v2 a partir de um dicionário de campos (ausentes viram nil)"""
+    values = [fields.get(name) for name in REQUEST_FIELDS[service]]
+    return packer().pack([WIRE_VERSION, SERVICE_CODES[service], clock,
+                          now_micros() if timestamp_us is None else timestamp_us, *values])